@@ -0,0 +1,60 @@
+import asyncio
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.shortcuts import render
+
+
+def async_login_required(view_func):
+    """login_required for async views, Django 4.2's decorator only wraps sync views"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        # Resolve the lazy user off the event loop, it may hit the session table
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _isolated(func):
+    def run():
+        try:
+            return func()
+        finally:
+            # Worker threads never see request_finished, so release their
+            # connection here (kept open when CONN_MAX_AGE allows it)
+            close_old_connections()
+    return run
+
+
+async def gather_queries(**queries):
+    """Run independent sync query callables concurrently.
+
+    Each callable runs on its own worker thread with its own database
+    connection, so the wall time is roughly that of the slowest query.
+    Returns a dict of results keyed like the arguments.
+    """
+    names = list(queries)
+    results = await asyncio.gather(*[
+        sync_to_async(_isolated(queries[name]), thread_sensitive=False)()
+        for name in names
+    ])
+    return dict(zip(names, results))
+
+
+async def cache_set_grouped(cache, entries):
+    """Write ``{key: (value, timeout)}`` with one set_many per distinct timeout"""
+    by_timeout = {}
+    for key, (value, timeout) in entries.items():
+        by_timeout.setdefault(timeout, {})[key] = value
+    # Not aset_many: Django's default loops over aset, a round trip per key
+    await asyncio.gather(*[
+        sync_to_async(cache.set_many)(values, timeout) for timeout, values in by_timeout.items()
+    ])
+
+
+async def async_render(request, template_name, context):
+    """Render a template off the event loop, templates may touch the ORM"""
+    return await sync_to_async(render)(request, template_name, context)
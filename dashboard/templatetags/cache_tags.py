@@ -1,19 +1,27 @@
 from django import template
 from django.core.cache import cache
 from django.utils.safestring import mark_safe
+from servers.cache import cache_tag_keys, cache_tag_versions, user_tag, count_cache_lookups
 import hashlib
 
 register = template.Library()
 
+# render_context entry holding the fragments fetched for the current template
+PREFETCH_STATE = 'user_cache_prefetch'
+
 @register.tag('user_cache')
 def do_user_cache(parser, token):
     """
     Template tag that caches content for each user separately.
     
     Usage:
-    {% user_cache [timeout_in_seconds] [fragment_name] %}
+    {% user_cache [timeout_in_seconds] [fragment_name] [vary_on ...] [depends tag ...] %}
         .. some expensive processing ..
     {% end_user_cache %}
+    
+    Tags name the data the fragment is built from. A bare tag like "servers"
+    is scoped to the current user ("servers:<user id>"), and any write to that
+    data (see servers/signals.py) makes the fragment stale.
     """
     nodelist = parser.parse(('end_user_cache',))
     parser.delete_first_token()
@@ -23,33 +31,95 @@ def do_user_cache(parser, token):
         raise template.TemplateSyntaxError(
             "%r tag requires at least 2 arguments." % tokens[0]
         )
-        
+    
+    depends = []
+    if 'depends' in tokens:
+        index = tokens.index('depends')
+        tokens, depends = tokens[:index], tokens[index + 1:]
+        if not depends:
+            raise template.TemplateSyntaxError(
+                "%r tag requires at least one tag after 'depends'." % tokens[0]
+            )
+    
     timeout = tokens[1]
     try:
         timeout = int(timeout)
     except ValueError:
         timeout = template.Variable(timeout)
-        
+    
     fragment_name = tokens[2]
     if not (fragment_name[0] == fragment_name[-1] and fragment_name[0] in ('"', "'")):
         fragment_name = template.Variable(fragment_name)
     else:
         fragment_name = fragment_name[1:-1]
-        
+    
     vary_on = []
     if len(tokens) > 3:
         vary_on = tokens[3:]
-        
-    return UserCacheNode(nodelist, timeout, fragment_name, vary_on)
+    
+    return UserCacheNode(nodelist, timeout, fragment_name, vary_on, depends)
+
+def resolve_token(var, context):
+    """Resolve a quoted literal or a template variable, None if it doesn't exist"""
+    if var[0] == var[-1] and var[0] in ('"', "'"):
+        return var[1:-1]
+    try:
+        return template.Variable(var).resolve(context)
+    except template.VariableDoesNotExist:
+        return None
+
+def fragment_cache_key(fragment_name, user_id, vary_values):
+    """Build a readable fragment key, hashing only keys a cache backend would reject"""
+    key = 'template_fragment_{}'.format(
+        ':'.join(str(part) for part in [fragment_name, user_id, *vary_values])
+    )
+    if len(key) > 200 or not (key.isascii() and key.isprintable()) or ' ' in key:
+        key = 'template_fragment_{}'.format(hashlib.md5(key.encode()).hexdigest())
+    return key
+
+def prefetch_fragments(context):
+    """Fetch every user_cache fragment of the template being rendered, and
+    the versions of the tags they depend on, in one get_many.
+    
+    Fragments whose keys depend on loop variables can't be resolved up
+    front and fall back to their own lookup when they render.
+    """
+    state = context.render_context.get(PREFETCH_STATE)
+    if state is not None:
+        return state
+    
+    nodes = []
+    for tmpl in (context.template, context.render_context.template):
+        if tmpl is not None:
+            for node in tmpl.nodelist.get_nodes_by_type(UserCacheNode):
+                if node not in nodes:
+                    nodes.append(node)
+    
+    keys = set()
+    tags = set()
+    for node in nodes:
+        cache_key, _, node_tags = node.resolve(context)
+        keys.add(cache_key)
+        tags.update(node_tags)
+    
+    fetched = cache.get_many([*keys, *cache_tag_keys(tags).values()])
+    state = {
+        'fragments': {key: fetched.get(key) for key in keys},
+        'tags': cache_tag_versions(tags, fetched) if tags else {},
+    }
+    context.render_context[PREFETCH_STATE] = state
+    return state
 
 class UserCacheNode(template.Node):
-    def __init__(self, nodelist, timeout, fragment_name, vary_on):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on, depends=None):
         self.nodelist = nodelist
         self.timeout = timeout
         self.fragment_name = fragment_name
         self.vary_on = vary_on
-        
-    def render(self, context):
+        self.depends = depends or []
+    
+    def resolve(self, context):
+        """Return (cache_key, timeout, tags) for this fragment in a context"""
         # Get timeout
         if isinstance(self.timeout, template.Variable):
             try:
@@ -58,7 +128,7 @@ class UserCacheNode(template.Node):
                 timeout = 300
         else:
             timeout = self.timeout
-            
+        
         # Get fragment name
         if isinstance(self.fragment_name, template.Variable):
             try:
@@ -67,35 +137,54 @@ class UserCacheNode(template.Node):
                 fragment_name = self.fragment_name
         else:
             fragment_name = self.fragment_name
-            
+        
         # Get user ID
         user_id = 'anonymous'
         if 'user' in context and hasattr(context['user'], 'id'):
             user_id = context['user'].id
-            
-        # Build vary_on values
-        vary_values = []
-        for var in self.vary_on:
-            if var[0] == var[-1] and var[0] in ('"', "'"):
-                vary_values.append(var[1:-1])
-            else:
-                try:
-                    vary_values.append(template.Variable(var).resolve(context))
-                except template.VariableDoesNotExist:
-                    vary_values.append(None)
-                    
-        # Create cache key
-        cache_key = 'template_fragment_{}_{}'.format(
-            fragment_name,
-            hashlib.md5(f'{user_id}_{"_".join(str(v) for v in vary_values)}'.encode()).hexdigest()
-        )
         
-        # Try to get from cache
-        content = cache.get(cache_key)
-        if content is None:
-            content = self.nodelist.render(context)
-            cache.set(cache_key, content, timeout)
-            
+        vary_values = [resolve_token(var, context) for var in self.vary_on]
+        
+        # Scope bare tag names to the current user
+        tags = []
+        for var in self.depends:
+            tag = resolve_token(var, context)
+            if tag:
+                tag = str(tag)
+                tags.append(tag if ':' in tag else user_tag(tag, user_id))
+        
+        return fragment_cache_key(fragment_name, user_id, vary_values), timeout, tags
+    
+    def render(self, context):
+        cache_key, timeout, tags = self.resolve(context)
+        state = prefetch_fragments(context)
+        
+        if cache_key in state['fragments']:
+            cached = state['fragments'][cache_key]
+        else:
+            cached = cache.get(cache_key)
+        
+        versions = {}
+        if tags:
+            unknown = [tag for tag in tags if tag not in state['tags']]
+            if unknown:
+                state['tags'].update(cache_tag_versions(unknown))
+            versions = {tag: state['tags'][tag] for tag in tags}
+        
+        # Cached as (tag versions, content), stale once any tag has moved on
+        hit = cached is not None and cached[0] == versions
+        # Labelled by the name as written in the template, so a name taken from
+        # a variable doesn't make a label per value
+        name = self.fragment_name
+        if isinstance(name, template.Variable):
+            name = name.var
+        count_cache_lookups(f'fragment.{name}', int(hit), int(not hit))
+        if hit:
+            return mark_safe(cached[1])
+        
+        content = self.nodelist.render(context)
+        cache.set(cache_key, (versions, content), timeout)
+        state['fragments'][cache_key] = (versions, content)
         return mark_safe(content)
 
 @register.simple_tag(takes_context=True)
@@ -109,5 +198,5 @@ def cache_key(context, name):
     user_id = 'anonymous'
     if 'user' in context and hasattr(context['user'], 'id'):
         user_id = context['user'].id
-        
-    return f'template_fragment_{name}_{user_id}'
\ No newline at end of file
+    
+    return f'template_fragment_{name}_{user_id}'
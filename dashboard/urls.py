@@ -7,4 +7,5 @@ urlpatterns = [
     path('', views.dashboard_home, name='home'),
     path('servers/', views.server_overview, name='server_overview'),
     path('activity/', views.activity_logs, name='activity_logs'),
+    path('activity/export/', views.activity_logs_export, name='activity_logs_export'),
 ]
\ No newline at end of file
@@ -1,280 +1,323 @@
-from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
 from datetime import timedelta
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
-from django.views.decorators.cache import cache_page
-from servers.models import Server, ServerGroup, ServerConnection, ServerLog
+from servers.models import Server, ServerConnection, ServerLog
+from servers.cache import user_cache_version, count_cache_lookups
+from servers.inventory import get_inventory, inventory_keys
+from servers.pagination import keyset_paginate, capped_count
+from servers.exports import stream_logs_response
+from servers.archive import search_log_archive, check_archive_range, ArchiveRangeTooWide
+from servers.dates import day_range, day_start, local_today, parse_date_param, timestamp_range_filter
+from server_manager.db import read_replica, replica_reads
+from .async_utils import async_login_required, async_render, cache_set_grouped, gather_queries
 
-@login_required
-def dashboard_home(request):
-    """Main dashboard view with caching for expensive queries"""
-    user = request.user
-    cache_key_prefix = f'dashboard_home_{user.id}'
-    cache_timeout = 300  # 5 minutes cache timeout
-    
-    # Server statistics - cached per user
-    servers_stats_key = f'{cache_key_prefix}_servers_stats'
-    servers_stats = cache.get(servers_stats_key)
-    
-    if servers_stats is None:
-        servers = Server.objects.filter(created_by=user)
-        total_servers = servers.count()
-        online_servers = servers.filter(status='online').count()
-        offline_servers = servers.filter(status='offline').count()
-        error_servers = servers.filter(status='error').count()
-        unknown_servers = servers.filter(status='unknown').count()
-        
-        status_data = {
-            'online': online_servers,
-            'offline': offline_servers,
-            'error': error_servers,
-            'unknown': unknown_servers
-        }
-        
-        servers_stats = {
-            'total_servers': total_servers,
-            'online_servers': online_servers,
-            'offline_servers': offline_servers,
-            'error_servers': error_servers,
-            'unknown_servers': unknown_servers,
-            'status_data': status_data
-        }
-        
-        cache.set(servers_stats_key, servers_stats, cache_timeout)
-    else:
-        total_servers = servers_stats['total_servers']
-        online_servers = servers_stats['online_servers']
-        offline_servers = servers_stats['offline_servers']
-        error_servers = servers_stats['error_servers']
-        unknown_servers = servers_stats['unknown_servers']
-        status_data = servers_stats.get('status_data', {
-            'online': online_servers,
-            'offline': offline_servers,
-            'error': error_servers,
-            'unknown': unknown_servers
+# Dashboard queries. They don't depend on each other, so the async views
+# below run whichever of them missed the cache concurrently.
+
+def get_server_stats(inventory):
+    """Server and group counts from the user's inventory snapshot"""
+    status_counts = inventory.status_counts
+    status_data = {
+        status: status_counts.get(status, 0) for status in ('online', 'offline', 'error', 'unknown')
+    }
+    return {
+        'total_servers': inventory.total_servers,
+        'online_servers': status_data['online'],
+        'offline_servers': status_data['offline'],
+        'error_servers': status_data['error'],
+        'unknown_servers': status_data['unknown'],
+        'total_groups': inventory.total_groups,
+        'status_data': status_data,
+    }
+
+def get_recent_logs(user):
+    """Last 10 log entries from the past 24 hours"""
+    yesterday = timezone.now() - timedelta(days=1)
+    return list(ServerLog.objects.filter(
+        owner=user,
+        timestamp__gte=yesterday
+    ).select_related('server', 'template').order_by('-timestamp')[:10])
+
+def get_today_stats(user, today_start, today_end):
+    """Both daily counts from one conditional aggregate over today's range"""
+    counts = ServerLog.objects.filter(
+        owner=user,
+        timestamp__gte=today_start,
+        timestamp__lt=today_end
+    ).aggregate(
+        connections=Count('id', filter=Q(log_type='connection')),
+        commands=Count('id', filter=Q(log_type='command')),
+    )
+    return {
+        'connections_today': counts['connections'],
+        'commands_today': counts['commands']
+    }
+
+def get_weekly_activity(user, today, today_end, tz):
+    """One range query over the week, bucketed by local day in the SELECT"""
+    week_start = day_start(today - timedelta(days=6), tz)
+    daily_counts = dict(
+        ServerLog.objects.filter(
+            owner=user,
+            log_type='connection',
+            timestamp__gte=week_start,
+            timestamp__lt=today_end
+        ).annotate(
+            day=TruncDate('timestamp', tzinfo=tz)
+        ).values('day').annotate(count=Count('id')).values_list('day', 'count')
+    )
+    weekly_activity = []
+    for i in range(6, -1, -1):
+        day = today - timedelta(days=i)
+        weekly_activity.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'connections': daily_counts.get(day, 0)
         })
+    return weekly_activity
+
+def build_server_overview(user):
+    """Counts and group membership from the inventory snapshot, plus one
+    select_related pass for the per-status server cards"""
+    inventory = get_inventory(user)
+    status_counts = inventory.status_counts
+    total_servers = inventory.total_servers
     
-    # Recent servers (last 5) - not cached as it's a simple query
-    servers = Server.objects.filter(created_by=user)
-    recent_servers = servers.order_by('-created_at')[:5]
-    
-    # Server groups - cached per user
-    groups_key = f'{cache_key_prefix}_groups'
-    groups_data = cache.get(groups_key)
-    
-    if groups_data is None:
-        groups = ServerGroup.objects.filter(created_by=user)
-        total_groups = groups.count()
-        groups_data = {'total_groups': total_groups}
-        cache.set(groups_key, groups_data, cache_timeout)
-    else:
-        total_groups = groups_data['total_groups']
-    
-    # Active connections - not cached as it's real-time data
-    active_connections = ServerConnection.objects.filter(
-        user=user,
-        is_active=True
-    ).select_related('server')
+    servers_by_status = {status: [] for status, _ in Server.STATUS_CHOICES}
+    if total_servers:
+        for server in Server.objects.filter(created_by=user).select_related('group'):
+            servers_by_status.setdefault(server.status, []).append(server)
     
-    # Recent activity (last 24 hours) - cached briefly
-    recent_logs_key = f'{cache_key_prefix}_recent_logs'
-    recent_logs = cache.get(recent_logs_key)
+    data = {
+        'servers_by_status': servers_by_status,
+        # (group, servers) pairs, ungrouped servers last under None
+        'servers_by_group': inventory.servers_by_group(),
+        'status_counts': status_counts,
+        'total_servers': total_servers,
+        'total_groups': inventory.total_groups,
+    }
+    for status in servers_by_status:
+        count = status_counts.get(status, 0)
+        data[f'{status}_percentage'] = count * 100.0 / total_servers if total_servers else 0
+    return data
+
+def filter_activity_logs(user, params):
+    """Build the activity log queryset for the filters in a request's GET params"""
+    logs = ServerLog.objects.filter(owner=user)
     
-    if recent_logs is None:
-        yesterday = timezone.now() - timedelta(days=1)
-        recent_logs = list(ServerLog.objects.filter(
-            server__created_by=user,
-            timestamp__gte=yesterday
-        ).select_related('server').order_by('-timestamp')[:10])
-        cache.set(recent_logs_key, recent_logs, 60)  # Cache for 1 minute only
+    log_type = params.get('type')
+    server_id = params.get('server')
+    if log_type:
+        logs = logs.filter(log_type=log_type)
+    if server_id:
+        logs = logs.filter(server_id=server_id)
+    # Half-open timestamp range so the timestamp indexes stay usable
+    return logs.filter(**timestamp_range_filter(params.get('date_from'), params.get('date_to')))
+
+async def request_cache_version(request):
+    """The user's cache version, as already read by the page cache middleware"""
+    version = getattr(request, '_user_cache_version', None)
+    if version is None:
+        version = await sync_to_async(user_cache_version)(request.user.id)
+    return version
+
+async def fetch_cached_parts(cached_parts, inventory_user=None, **uncached):
+    """Resolve ``{name: (cache_key, timeout, query)}`` with one get_many.
     
-    # Activity statistics - cached per user per day
-    today = timezone.now().date()
-    today_stats_key = f'{cache_key_prefix}_today_stats_{today.isoformat()}'
-    today_stats = cache.get(today_stats_key)
+    Misses run concurrently with the ``uncached`` queries and are written
+    back in a batch. With ``inventory_user``, the inventory snapshot keys are
+    read in the same get_many and ``get_inventory`` joins the uncached
+    queries. Returns ``(parts, uncached_results)``.
+    """
+    keys = [key for key, _, _ in cached_parts.values()]
+    if inventory_user is not None:
+        keys += inventory_keys(inventory_user.id)
+    # Not aget_many: Django's default loops over aget, a round trip per key
+    cached = await sync_to_async(cache.get_many)(keys)
+    if inventory_user is not None:
+        uncached['inventory'] = lambda: get_inventory(inventory_user, cached)
+    missing = {
+        name: query for name, (key, _, query) in cached_parts.items() if key not in cached
+    }
+    for name in cached_parts:
+        count_cache_lookups(f'dashboard.{name}', int(name not in missing), int(name in missing))
+    # Dashboard and log data tolerates replication lag
+    with read_replica():
+        results = await gather_queries(**uncached, **missing)
+    if missing:
+        await cache_set_grouped(cache, {
+            cached_parts[name][0]: (results[name], cached_parts[name][1]) for name in missing
+        })
+    parts = {
+        name: results[name] if name in missing else cached[key]
+        for name, (key, _, _) in cached_parts.items()
+    }
+    return parts, {name: results[name] for name in uncached}
+
+@async_login_required
+async def dashboard_home(request):
+    """Main dashboard view with batched caching and concurrent queries"""
+    user = request.user
+    version = await request_cache_version(request)
+    cache_key_prefix = f'dashboard_home_{user.id}_v{version}'
     
-    if today_stats is None:
-        connections_today = ServerLog.objects.filter(
-            server__created_by=user,
-            log_type='connection',
-            timestamp__date=today
-        ).count()
-        
-        commands_today = ServerLog.objects.filter(
-            server__created_by=user,
-            log_type='command',
-            timestamp__date=today
-        ).count()
-        
-        today_stats = {
-            'connections_today': connections_today,
-            'commands_today': commands_today
-        }
-        
-        cache.set(today_stats_key, today_stats, 300)  # Cache for 5 minutes
-    else:
-        connections_today = today_stats['connections_today']
-        commands_today = today_stats['commands_today']
+    # Activity statistics are per day, in the user's time zone
+    tz = timezone.get_current_timezone()
+    today = local_today(tz)
+    today_start, today_end = day_range(today, tz)
     
-    # Weekly activity data - cached per user per day
-    weekly_activity_key = f'{cache_key_prefix}_weekly_activity_{today.isoformat()}'
-    weekly_activity = cache.get(weekly_activity_key)
+    # name: (cache key, timeout, query)
+    cached_parts = {
+        'recent_logs': (f'{cache_key_prefix}_recent_logs', 60,  # Cache for 1 minute only
+                        lambda: get_recent_logs(user)),
+        'today_stats': (f'{cache_key_prefix}_today_stats_{today.isoformat()}', 300,
+                        lambda: get_today_stats(user, today_start, today_end)),
+        'weekly_activity': (f'{cache_key_prefix}_weekly_activity_{today.isoformat()}', 3600,
+                            lambda: get_weekly_activity(user, today, today_end, tz)),
+    }
     
-    if weekly_activity is None:
-        weekly_activity = []
-        for i in range(7):
-            day = timezone.now() - timedelta(days=i)
-            day_connections = ServerLog.objects.filter(
-                server__created_by=user,
-                log_type='connection',
-                timestamp__date=day.date()
-            ).count()
-            weekly_activity.append({
-                'date': day.strftime('%Y-%m-%d'),
-                'connections': day_connections
-            })
-        weekly_activity.reverse()
-        cache.set(weekly_activity_key, weekly_activity, 3600)  # Cache for 1 hour
+    # Recent servers and active connections are real-time, not cached, and
+    # the inventory snapshot is kept current by model signals
+    parts, live = await fetch_cached_parts(
+        cached_parts,
+        inventory_user=user,
+        recent_servers=lambda: list(
+            Server.objects.filter(created_by=user).order_by('-created_at')[:5]
+        ),
+        active_connections=lambda: list(
+            ServerConnection.objects.filter(user=user, is_active=True).select_related('server')
+        ),
+    )
     
     context = {
-        'total_servers': total_servers,
-        'online_servers': online_servers,
-        'offline_servers': offline_servers,
-        'error_servers': error_servers,
-        'unknown_servers': unknown_servers,
-        'total_groups': total_groups,
-        'recent_servers': recent_servers,
-        'active_connections': active_connections,
-        'recent_logs': recent_logs,
-        'connections_today': connections_today,
-        'commands_today': commands_today,
-        'status_data': status_data,
-        'weekly_activity': weekly_activity,
+        **get_server_stats(live['inventory']),
+        **parts['today_stats'],
+        'recent_servers': live['recent_servers'],
+        'active_connections': live['active_connections'],
+        'recent_logs': parts['recent_logs'],
+        'weekly_activity': parts['weekly_activity'],
     }
     
-    return render(request, 'dashboard/home.html', context)
+    return await async_render(request, 'dashboard/home.html', context)
 
-@login_required
-def server_overview(request):
+@async_login_required
+async def server_overview(request):
     """Server overview with detailed statistics and caching"""
     user = request.user
-    cache_key_prefix = f'server_overview_{user.id}'
-    cache_timeout = 300  # 5 minutes cache timeout
+    version = await request_cache_version(request)
+    cache_key_prefix = f'server_overview_{user.id}_v{version}'
     
-    # Try to get cached data
-    cache_key = f'{cache_key_prefix}_{request.GET.urlencode()}'
-    cached_data = cache.get(cache_key)
+    parts, live = await fetch_cached_parts(
+        {
+            'overview': (f'{cache_key_prefix}_{request.GET.urlencode()}', 300,
+                         lambda: build_server_overview(user)),
+        },
+        # Real-time data, not cached
+        active_connections=lambda: ServerConnection.objects.filter(
+            user=user, is_active=True
+        ).count(),
+    )
     
-    if cached_data is None:
-        servers = Server.objects.filter(created_by=user).select_related('group')
-        
-        # Group servers by status
-        servers_by_status = {
-            'online': list(servers.filter(status='online')),
-            'offline': list(servers.filter(status='offline')),
-            'error': list(servers.filter(status='error')),
-            'unknown': list(servers.filter(status='unknown')),
-        }
-        
-        # Group servers by group
-        servers_by_group = {}
-        for group in ServerGroup.objects.filter(created_by=user):
-            group_servers = list(servers.filter(group=group))
-            if group_servers:
-                servers_by_group[group.name] = group_servers
-        
-        # Ungrouped servers
-        ungrouped_servers = list(servers.filter(group__isnull=True))
-        if ungrouped_servers:
-            servers_by_group['Ungrouped'] = ungrouped_servers
-        
-        total_servers = servers.count()
-        
-        # Cache the data
-        cached_data = {
-            'servers_by_status': servers_by_status,
-            'servers_by_group': servers_by_group,
-            'total_servers': total_servers,
-        }
-        cache.set(cache_key, cached_data, cache_timeout)
-    
-    context = cached_data
+    context = {
+        **parts['overview'],
+        'active_connections': live['active_connections'],
+        'last_update': timezone.now(),
+    }
     
-    return render(request, 'dashboard/server_overview.html', context)
+    return await async_render(request, 'dashboard/overview.html', context)
 
-@login_required
-def activity_logs(request):
+@async_login_required
+async def activity_logs(request):
     """Activity logs view with optimized queries and caching"""
     user = request.user
+    version = await request_cache_version(request)
     
-    # Cache key based on user and request parameters
+    # Cache key based on user, data version and request parameters
     params = request.GET.copy()
-    if 'page' in params:
-        del params['page']  # Don't include page in cache key
-    cache_key = f'activity_logs_{user.id}_{params.urlencode()}'
-    
-    # Get servers for filter dropdown - cached
-    servers_cache_key = f'activity_logs_servers_{user.id}'
-    servers = cache.get(servers_cache_key)
-    if servers is None:
-        servers = list(Server.objects.filter(created_by=user).order_by('name'))
-        cache.set(servers_cache_key, servers, 300)  # Cache for 5 minutes
+    for cursor_param in ('page', 'after', 'before'):
+        params.pop(cursor_param, None)  # Don't include the cursor in cache key
+    cache_key = f'activity_logs_{user.id}_v{version}_{params.urlencode()}'
     
     # Get filter parameters
     log_type = request.GET.get('type')
     server_id = request.GET.get('server')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
-    page_number = request.GET.get('page', 1)
+    # The direction is part of the key, ?after=X and ?before=X are different pages
+    if request.GET.get('after'):
+        cursor = f"after_{request.GET['after']}"
+    else:
+        cursor = f"before_{request.GET.get('before', '')}"
     
-    # Try to get cached logs count
-    logs_count_key = f'{cache_key}_count'
-    logs_count = cache.get(logs_count_key)
+    # Build query with optimized filters (lazy, only runs on a cache miss)
+    logs = filter_activity_logs(user, request.GET)
     
-    # Try to get cached page
-    page_cache_key = f'{cache_key}_page_{page_number}'
-    page_obj = cache.get(page_cache_key)
+    # name: (cache key, timeout, query)
+    cached_parts = {
+        # Capped so deep tables never pay a full COUNT(*)
+        'logs_count': (f'{cache_key}_count', 60, lambda: capped_count(logs)),
+        # Keyset pagination on (timestamp, id) seeks through the (owner, timestamp, id) index
+        'page_obj': (f'{cache_key}_page_{cursor}', 60, lambda: keyset_paginate(
+            logs.select_related('server', 'user', 'template'),
+            ['-timestamp', '-id'],
+            request.GET,
+            per_page=50
+        )),
+    }
+    
+    uncached = {}
+    
+    # Archived logs are only read on demand, for an explicit date range
+    search_archive = request.GET.get('archive') == '1'
+    archive_error = None
+    if search_archive and date_from:
+        archive_from = parse_date_param(date_from)
+        archive_to = parse_date_param(date_to) if date_to else local_today()
+        if archive_from and archive_to:
+            try:
+                # Checked before any archive file is opened
+                check_archive_range(archive_from, archive_to)
+            except ArchiveRangeTooWide as e:
+                archive_error = str(e)
+            else:
+                uncached['archived_logs'] = lambda: search_log_archive(
+                    user, archive_from, archive_to, log_type=log_type, server_id=server_id
+                )
     
-    if page_obj is None:
-        # Build query with optimized filters
-        logs = ServerLog.objects.filter(server__created_by=user)
-        
-        # Apply filters
-        if log_type:
-            logs = logs.filter(log_type=log_type)
-        if server_id:
-            logs = logs.filter(server_id=server_id)
-        if date_from:
-            logs = logs.filter(timestamp__date__gte=date_from)
-        if date_to:
-            logs = logs.filter(timestamp__date__lte=date_to)
-        
-        # Add select_related to optimize queries
-        logs = logs.select_related('server', 'user').order_by('-timestamp')
-        
-        # Get count if not cached
-        if logs_count is None:
-            logs_count = logs.count()
-            cache.set(logs_count_key, logs_count, 60)  # Cache for 1 minute
-        
-        # Pagination
-        from django.core.paginator import Paginator
-        paginator = Paginator(logs, 50)
-        page_obj = paginator.get_page(page_number)
-        
-        # Cache the page object
-        cache.set(page_cache_key, page_obj, 60)  # Cache for 1 minute
+    # Servers for the filter dropdown come from the inventory snapshot
+    parts, live = await fetch_cached_parts(cached_parts, inventory_user=user, **uncached)
+    total_logs, total_is_estimate = parts['logs_count']
     
     context = {
-        'page_obj': page_obj,
+        'page_obj': parts['page_obj'],
+        'archived_logs': live.get('archived_logs'),
+        'search_archive': search_archive,
+        'archive_error': archive_error,
+        'total_logs': total_logs,
+        'total_is_estimate': total_is_estimate,
         'log_types': ServerLog.LOG_TYPES,
-        'servers': servers,
+        'servers': live['inventory'].servers,
         'current_type': log_type,
         'current_server': server_id,
         'date_from': date_from,
         'date_to': date_to,
     }
     
-    return render(request, 'dashboard/activity_logs.html', context)
\ No newline at end of file
+    return await async_render(request, 'dashboard/activity_logs.html', context)
+
+@login_required
+@replica_reads
+def activity_logs_export(request):
+    """Stream the filtered activity logs as CSV or NDJSON, optionally gzipped"""
+    logs = filter_activity_logs(request.user, request.GET)
+    return stream_logs_response(
+        logs,
+        request.GET.get('format', 'csv'),
+        f'activity_logs_{timezone.localdate().isoformat()}',
+        compress=request.GET.get('gzip') in ('1', 'true', 'on'),
+        asynchronous=isinstance(request, ASGIRequest),
+    )
@@ -57,6 +57,9 @@ def main():
     # Clean up expired sessions (older than 1 day)
     run_command(f'"{python_executable}" "{manage_py}" cleanup_sessions --days=1')
     
+    # Archive logs older than the retention period
+    run_command(f'"{python_executable}" "{manage_py}" archive_logs')
+    
     # Clear expired cache entries
     run_command(f'"{python_executable}" "{manage_py}" clear_expired_cache')
     
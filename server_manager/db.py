@@ -0,0 +1,62 @@
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA_ALIAS = 'replica'
+
+# Set while code that tolerates replication lag runs. A context variable
+# follows sync_to_async into worker threads, unlike a thread local.
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_replica():
+    """Send reads made inside the block to the replica, if one is configured"""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(view_func):
+    """View decorator running a whole sync view under read_replica()"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with read_replica():
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Routes reads to the replica inside read_replica(), everything else to default.
+
+    Reads are only sent to the replica on request, so pages that read their
+    own writes (a redirect after saving a server) never see a lagging copy.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Tune every new SQLite connection for concurrent readers and writers"""
+    if connection.vendor != 'sqlite':
+        return
+    options = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for pragma, value in options.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# A probe task on each event loop sleeps for a fixed interval and records
+# how late it woke up. A watchdog thread checks the probes' heartbeats, so
+# a loop that is blocked right now is noticed while it is still blocked and
+# the blocking stack can be captured, not only after it recovers.
+
+LOOP_LAG = metrics.Gauge(
+    'serverhub_event_loop_lag_seconds',
+    'How late the latest event loop probe woke up',
+    mode='all',
+)
+LOOP_DELAY = metrics.Histogram(
+    'serverhub_event_loop_delay_seconds',
+    'Event loop probe wake-up delays',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_STALLS = metrics.Counter(
+    'serverhub_event_loop_stalls_total',
+    'Times the event loop was blocked for longer than EVENT_LOOP_STALL_THRESHOLD',
+)
+
+
+class LoopMonitor:
+    """Lag samples and heartbeat of one event loop.
+    
+    The loop and the probe task (which references the loop) are held
+    weakly, so a loop's entry in ``_monitors`` goes away with the loop.
+    """
+    
+    def __init__(self, loop, interval, window=600):
+        self._loop = weakref.ref(loop)
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.lags = deque(maxlen=window)
+        self.stalled_since = None
+        self._task = None
+    
+    @property
+    def loop(self):
+        """The monitored loop, None once it has been garbage collected"""
+        return self._loop()
+    
+    @property
+    def task(self):
+        return self._task() if self._task is not None else None
+    
+    @task.setter
+    def task(self, task):
+        self._task = weakref.ref(task)
+    
+    async def probe(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            lag = max(0.0, self.last_beat - started - self.interval)
+            self.lags.append(lag)
+            LOOP_LAG.set(lag)
+            LOOP_DELAY.observe(lag)
+            if self.stalled_since is not None:
+                logger.warning('Event loop unblocked after %.2fs', self.last_beat - self.stalled_since)
+                self.stalled_since = None
+    
+    @property
+    def blocked_for(self):
+        """Seconds the loop is overdue for its next probe, 0 when it is keeping up"""
+        return max(0.0, time.monotonic() - self.last_beat - self.interval)
+    
+    def percentiles(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {'0.5': 0.0, '0.9': 0.0, '0.99': 0.0}
+        return {
+            quantile: lags[min(len(lags) - 1, int(float(quantile) * len(lags)))]
+            for quantile in ('0.5', '0.9', '0.99')
+        }
+
+
+# Probes the readiness check looks back over
+READY_SAMPLES = 20
+
+# One monitor per running event loop
+_monitors = weakref.WeakKeyDictionary()
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def ensure_loop_monitor():
+    """Start measuring the running event loop's lag, once per loop"""
+    loop = asyncio.get_running_loop()
+    monitor = _monitors.get(loop)
+    if monitor is None or monitor.task is None or monitor.task.done():
+        monitor = LoopMonitor(loop, getattr(settings, 'EVENT_LOOP_PROBE_INTERVAL', 0.5))
+        monitor.task = loop.create_task(monitor.probe())
+        _monitors[loop] = monitor
+        _start_watchdog()
+    return monitor
+
+
+def _start_watchdog():
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = threading.Thread(target=_watch, name='event-loop-watchdog', daemon=True)
+            _watchdog.start()
+
+
+def _watch():
+    while True:
+        threshold = getattr(settings, 'EVENT_LOOP_STALL_THRESHOLD', 0.25)
+        time.sleep(max(0.05, threshold / 2))
+        for monitor in list(_monitors.values()):
+            loop = monitor.loop
+            closed = loop is None or loop.is_closed()
+            # Don't keep the loop alive through the sleep
+            del loop
+            if closed:
+                continue
+            if monitor.stalled_since is None and monitor.blocked_for > threshold:
+                monitor.stalled_since = monitor.last_beat + monitor.interval
+                LOOP_STALLS.inc()
+                report_stall(monitor)
+
+
+def report_stall(monitor):
+    """Log the stack the loop's thread is stuck in, with the terminal session it serves"""
+    frame = sys._current_frames().get(monitor.thread_id)
+    if frame is None:
+        return
+    stack = ''.join(traceback.format_stack(frame))
+    logger.warning(
+        'Event loop blocked for %.2fs%s\n%s',
+        monitor.blocked_for, describe_context(frame), stack,
+    )
+
+
+def describe_context(frame):
+    """Find the consumer on the blocked stack and describe its session"""
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if owner is not None and hasattr(owner, 'session_id') and hasattr(owner, 'server_id'):
+            user = getattr(owner, 'user', None)
+            return (
+                f' in {type(owner).__name__}.{frame.f_code.co_name}'
+                f' (server {owner.server_id}, session {owner.session_id},'
+                f' user {getattr(user, "username", None)})'
+            )
+        frame = frame.f_back
+    return ''
+
+
+async def readiness_view(request):
+    """Load balancer readiness check, 503 while this worker's event loop is lagging.
+    
+    Ready means the p90 lag of the last READY_SAMPLES probes is within
+    EVENT_LOOP_READY_MAX_LAG. A loop that is blocked outright can't answer
+    at all, which the balancer's check timeout covers.
+    
+    Under WSGI each async view call gets a throwaway loop, so there is no
+    long-lived loop to judge and the check answers 503 "not applicable".
+    Until the first probe has woken up it answers 503 "starting".
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'status': 'not applicable',
+            'detail': 'Event loop readiness is only measured when served over ASGI',
+        }, status=503)
+    monitor = ensure_loop_monitor()
+    if not monitor.lags:
+        return JsonResponse({'status': 'starting', 'samples': 0}, status=503)
+    max_lag = getattr(settings, 'EVENT_LOOP_READY_MAX_LAG', 0.5)
+    recent = sorted(list(monitor.lags)[-READY_SAMPLES:])
+    recent_p90 = recent[min(len(recent) - 1, int(0.9 * len(recent)))]
+    ready = recent_p90 <= max_lag
+    return JsonResponse({
+        'status': 'ready' if ready else 'lagging',
+        'lag_seconds': round(monitor.lags[-1], 4),
+        'recent_p90_seconds': round(recent_p90, 4),
+        'max_lag_seconds': max_lag,
+        'lag_percentiles': {quantile: round(lag, 4) for quantile, lag in monitor.percentiles().items()},
+        'samples': len(monitor.lags),
+    }, status=200 if ready else 503)
+
+
+def _lag_percentiles():
+    values = {}
+    for monitor in list(_monitors.values()):
+        for quantile, lag in monitor.percentiles().items():
+            values[(quantile,)] = max(lag, values.get((quantile,), 0.0))
+    return values
+
+
+metrics.Gauge(
+    'serverhub_event_loop_lag_quantile_seconds',
+    'Event loop lag percentiles over the last EVENT_LOOP_PROBE_INTERVAL * 600 seconds',
+    ['quantile'],
+    mode='all',
+    function=_lag_percentiles,
+)
@@ -0,0 +1,282 @@
+import atexit
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Prometheus style metrics kept in plain dicts. Every process writes its
+# values to METRICS_DIR/<pid>.json every few seconds, and the scrape view
+# merges the files of all processes on the host. Without METRICS_DIR only
+# the process serving the scrape is reported.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+    def ensure_writer(self):
+        """Start the background snapshot writer once, when METRICS_DIR is set"""
+        if self._writer is not None or not getattr(settings, 'METRICS_DIR', None):
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, daemon=True)
+                self._writer.start()
+                atexit.register(self.write_snapshot)
+
+    def _write_forever(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 5))
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+    def write_snapshot(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(f'{path}.tmp', path)
+
+    def collect(self):
+        """Snapshots of every process on the host as ``[(pid, snapshot)]``"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return [(os.getpid(), self.snapshot())]
+        self.write_snapshot()
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as source:
+                    snapshots.append((int(os.path.basename(path)[:-5]), json.load(source)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+registry = MetricsRegistry()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {'kind': self.kind, 'help': self.documentation, 'labels': list(self.labelnames), 'samples': samples}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        registry.ensure_writer()
+
+
+class Gauge(Metric):
+    """A value that goes up and down.
+
+    ``mode='sum'`` adds up the live processes' values, ``mode='all'``
+    reports each process under a ``pid`` label. ``function`` computes the
+    value whenever a snapshot is taken, or ``{label values: value}`` for a
+    gauge with labels.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), mode='sum', function=None):
+        super().__init__(name, documentation, labelnames)
+        self.mode = mode
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        registry.ensure_writer()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        registry.ensure_writer()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+                if isinstance(value, dict):
+                    with self._lock:
+                        self._values = {tuple(map(str, key)): sample for key, sample in value.items()}
+                else:
+                    self.set(value)
+            except Exception:
+                pass
+        data = super().snapshot()
+        data['mode'] = self.mode
+        return data
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per bucket counts (not cumulative), then count and sum
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+        registry.ensure_writer()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(snapshots):
+    """Combine per-process snapshots: counters and histograms add up over
+    every process that ever wrote, gauges only over live ones"""
+    merged = {}
+    for pid, snapshot in snapshots:
+        alive = None
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, dict(data, samples={}))
+            labels = list(data['labels'])
+            if data['kind'] == 'gauge':
+                if alive is None:
+                    alive = _pid_alive(pid)
+                if not alive:
+                    continue
+                if data.get('mode') == 'all':
+                    labels.append('pid')
+            target['labels'] = labels
+            for key, value in data['samples']:
+                if data['kind'] == 'gauge' and data.get('mode') == 'all':
+                    key = key + [str(pid)]
+                key = tuple(key)
+                if data['kind'] == 'histogram':
+                    current = target['samples'].get(key)
+                    target['samples'][key] = (
+                        value if current is None else [a + b for a, b in zip(current, value)]
+                    )
+                else:
+                    target['samples'][key] = target['samples'].get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render(merged):
+    """Prometheus text exposition format"""
+    lines = []
+    for name in sorted(merged):
+        data = merged[name]
+        lines.append(f'# HELP {name} {data["help"]}')
+        lines.append(f'# TYPE {name} {data["kind"]}')
+        for key, value in sorted(data['samples'].items()):
+            if data['kind'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(data['buckets'], value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(data["labels"], key, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(data["labels"], key, [("le", "+Inf")])} {value[-2]}')
+                lines.append(f'{name}_count{_labels(data["labels"], key)} {value[-2]}')
+                lines.append(f'{name}_sum{_labels(data["labels"], key)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_labels(data["labels"], key)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Scrape endpoint. With METRICS_TOKEN set, a matching bearer token is required.
+
+    Without a token only staff users can read it, or anyone when DEBUG is on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied, token):
+            return HttpResponseForbidden('Forbidden')
+    elif not settings.DEBUG and not request.user.is_staff:
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(
+        render(merge(registry.collect())),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
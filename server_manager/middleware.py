@@ -1,78 +1,181 @@
-from django.utils.cache import get_cache_key, learn_cache_key, patch_response_headers
-from django.utils.deprecation import MiddlewareMixin
+import hashlib
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from servers.cache import user_cache_version, count_cache_lookups
+from . import metrics
+from .loopmonitor import ensure_loop_monitor
+
+REQUEST_DURATION = metrics.Histogram(
+    'serverhub_http_request_duration_seconds',
+    'HTTP request latency by view',
+    ['view', 'method', 'status'],
+)
+
+
+class MetricsMiddleware:
+    """
+    Times every request into a latency histogram labelled by view name.
+
+    Runs natively in both modes so async views don't pay for a thread hop.
+    Place it first so the time spent in the other middleware is included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        ensure_loop_monitor()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+            status=f'{response.status_code // 100}xx',
+        )
+
 
 class OptimizedCacheMiddleware(MiddlewareMixin):
     """
-    Middleware that applies cache to responses for authenticated users.
-    
+    Per-user full-page cache with strong ETags for authenticated users.
+
+    Rendered pages are stored under a key built from the user, the user's
+    cache version (bumped by model signals whenever their data changes),
+    the full path and the request variant. Hits are served without calling
+    the view, and a matching If-None-Match gets a 304 either way.
+
     This middleware must be placed AFTER:
-    - UpdateCacheMiddleware
     - SessionMiddleware
     - AuthenticationMiddleware
-    
-    And BEFORE:
-    - CommonMiddleware
-    - FetchFromCacheMiddleware
     """
-    
+
+    # Cache timeout per view name
+    cacheable_views = {
+        'dashboard:home': 300,  # 5 minutes
+        'dashboard:server_overview': 300,  # 5 minutes
+        'dashboard:activity_logs': 60,  # 1 minute
+        'terminal:sessions': 30,
+        'terminal:logs': 30,
+    }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Serve the page from cache or answer with 304 if the client is current."""
+        timeout = self.get_timeout(request)
+        if timeout is None:
+            return None
+
+        cache_key = self.get_cache_key(request)
+        request._page_cache_key = cache_key
+        request._page_cache_timeout = timeout
+
+        cached = cache.get(cache_key)
+        count_cache_lookups(f'page.{request.resolver_match.view_name}', int(cached is not None), int(cached is None))
+        if cached is None:
+            return None
+
+        content, content_type, etag = cached
+        if self.etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        self.patch_headers(response, etag)
+        return response
+
     def process_response(self, request, response):
-        """Set appropriate cache headers and cache the response if applicable."""
-        # Only cache for authenticated users
-        if not hasattr(request, 'user') or not request.user.is_authenticated:
+        """Tag fresh pages with an ETag and store them in the page cache."""
+        cache_key = getattr(request, '_page_cache_key', None)
+        if cache_key is None or response.has_header('ETag'):
             return response
-            
+
         # Don't cache responses with error status codes
         if response.status_code != 200:
             return response
-            
+
         # Don't cache streaming responses
         if getattr(response, 'streaming', False):
             return response
-            
-        # Don't cache if the response already has cache headers
-        if response.has_header('Cache-Control') and 'max-age=0' not in response['Cache-Control']:
-            return response
-            
-        # Don't cache POST requests or requests with query parameters
-        if request.method != 'GET' or len(request.GET) > 0:
-            return response
-            
-        # Only cache specific URL patterns
-        cacheable_urls = [
-            '/dashboard/',
-            '/dashboard/server-overview/',
-            '/dashboard/activity-logs/',
-        ]
-        
-        should_cache = False
-        for url in cacheable_urls:
-            if request.path.startswith(url):
-                should_cache = True
-                break
-                
-        if not should_cache:
+
+        # Don't cache responses that set cookies (flashed messages, login)
+        if response.cookies:
             return response
-            
-        # Set cache timeout based on URL
-        if request.path == '/dashboard/':
-            timeout = 300  # 5 minutes
-        elif request.path == '/dashboard/server-overview/':
-            timeout = 300  # 5 minutes
-        elif request.path == '/dashboard/activity-logs/':
-            timeout = 60   # 1 minute
-        else:
-            timeout = 600  # 10 minutes
-            
-        # Set cache headers
-        patch_response_headers(response, timeout)
-        
-        # Generate cache key based on user ID and URL
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            cache_key = f'user_{request.user.id}_{request.path}'
-            
-            # Store in cache
-            cache.set(cache_key, response.content, timeout)
-            
-        return response
\ No newline at end of file
+
+        etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+        cache.set(
+            cache_key,
+            (response.content, response['Content-Type'], etag),
+            request._page_cache_timeout
+        )
+
+        if self.etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        self.patch_headers(response, etag)
+        return response
+
+    def get_timeout(self, request):
+        """Return the cache timeout for this request, or None if it isn't cacheable"""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if not hasattr(request, 'user') or not request.user.is_authenticated:
+            return None
+
+        match = request.resolver_match
+        if match is None:
+            return None
+        timeout = self.cacheable_views.get(match.view_name)
+        if timeout is None:
+            return None
+
+        # Pages with pending flash messages must be rendered to show them
+        if 'messages' in request.COOKIES or '_messages' in request.session:
+            return None
+        return timeout
+
+    def get_cache_key(self, request):
+        """Build the page cache key for the user, data version and variant"""
+        user_id = request.user.id
+        # Kept on the request so the view doesn't read the version key again
+        request._user_cache_version = user_cache_version(user_id)
+        variant = '|'.join([
+            request.get_full_path(),
+            request.headers.get('X-Requested-With', ''),
+            # Pages embed a CSRF token, so tie them to the user's CSRF cookie
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        ])
+        return 'page_cache_{}_{}_{}'.format(
+            user_id,
+            request._user_cache_version,
+            hashlib.md5(variant.encode()).hexdigest()
+        )
+
+    def etag_matches(self, request, etag):
+        if_none_match = request.headers.get('If-None-Match', '')
+        return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+    def patch_headers(self, response, etag):
+        response['ETag'] = etag
+        # Browsers may keep the page but must revalidate it with If-None-Match
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'X-Requested-With'))
@@ -0,0 +1,231 @@
+import contextvars
+import html
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Per-request query and cache profiling. Every database connection gets an
+# execute wrapper and the default cache backend's methods are wrapped once;
+# both add to the profile in the current context, if any. The profile is a
+# context variable, so queries run by sync_to_async worker threads count
+# towards the request that started them.
+
+_profile = contextvars.ContextVar('request_profile', default=None)
+
+CACHE_METHODS = (
+    'get', 'get_many', 'get_or_set', 'set', 'set_many', 'add', 'delete',
+    'delete_many', 'incr', 'decr', 'touch', 'has_key', 'clear',
+)
+
+
+class RequestProfile:
+    """Query and cache counts and times of one request, times in seconds"""
+    
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_calls = 0
+        self.cache_time = 0.0
+        self.statements = Counter()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self._lock = threading.Lock()
+    
+    def add_query(self, sql, seconds):
+        with self._lock:
+            self.queries += 1
+            self.db_time += seconds
+            self.statements[sql] += 1
+    
+    def add_cache_call(self, seconds):
+        with self._lock:
+            self.cache_calls += 1
+            self.cache_time += seconds
+    
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+    
+    def repeated(self, minimum=3):
+        """Statements run at least ``minimum`` times, the usual sign of an N+1"""
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= minimum]
+    
+    def server_timing(self):
+        parts = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'cache;dur={self.cache_time * 1000:.1f};desc="{self.cache_calls} calls"',
+        ]
+        if self.elapsed is not None:
+            parts.append(f'total;dur={self.elapsed * 1000:.1f}')
+        return ', '.join(parts)
+    
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'cache_calls': self.cache_calls,
+            'cache_ms': round(self.cache_time * 1000, 2),
+            'total_ms': round(self.elapsed * 1000, 2) if self.elapsed is not None else None,
+        }
+
+
+@contextmanager
+def profiled():
+    """Profile everything run inside the block, yields the RequestProfile"""
+    instrument_cache()
+    # Connections opened before this module was imported have no recorder yet
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(None, connection)
+    profile = RequestProfile()
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+        profile.finish()
+
+
+class BudgetExceeded(AssertionError):
+    """A profiled block used more queries or cache calls than allowed"""
+
+
+def assert_budget(profile, label, queries=None, cache_calls=None):
+    """Raise BudgetExceeded when ``profile`` is over either limit (None means no limit)"""
+    problems = []
+    if queries is not None and profile.queries > queries:
+        problems.append(f'{profile.queries} queries (budget {queries})')
+    if cache_calls is not None and profile.cache_calls > cache_calls:
+        problems.append(f'{profile.cache_calls} cache calls (budget {cache_calls})')
+    if problems:
+        repeated = ''.join(f'\n  {count}x {sql}' for sql, count in profile.repeated())
+        raise BudgetExceeded(f'{label}: {", ".join(problems)}{repeated}')
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    """Attach the query recorder to every new database connection"""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Backends like LocMemCache implement get_many with get, count the outer call only
+_cache_depth = threading.local()
+
+
+def _wrap_cache_method(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profile = _profile.get()
+        if profile is None or getattr(_cache_depth, 'value', 0):
+            return method(self, *args, **kwargs)
+        _cache_depth.value = 1
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _cache_depth.value = 0
+            profile.add_cache_call(time.perf_counter() - started)
+    wrapper._profiled = True
+    return wrapper
+
+
+def instrument_cache():
+    """Wrap the default cache backend's methods once"""
+    backend = type(caches['default'])
+    for name in CACHE_METHODS:
+        method = getattr(backend, name, None)
+        if method is not None and not getattr(method, '_profiled', False):
+            setattr(backend, name, _wrap_cache_method(method))
+
+
+class ProfilingMiddleware:
+    """
+    Adds a Server-Timing header with the request's query count, DB time,
+    cache calls and cache time, and with DEBUG on a small panel at the
+    bottom of HTML pages listing repeated statements.
+    
+    Enabled by REQUEST_PROFILING (defaults to DEBUG). Place it right after
+    MetricsMiddleware so cache hits served by OptimizedCacheMiddleware are
+    profiled too.
+    """
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_PROFILING', settings.DEBUG)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        with profiled() as profile:
+            response = self.get_response(request)
+        return self.annotate(response, profile)
+    
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with profiled() as profile:
+            response = await self.get_response(request)
+        return self.annotate(response, profile)
+    
+    def annotate(self, response, profile):
+        response['Server-Timing'] = profile.server_timing()
+        if (
+            settings.DEBUG
+            and not response.streaming
+            and response.status_code == 200
+            and response.get('Content-Type', '').startswith('text/html')
+            and b'</body>' in response.content
+        ):
+            response.content = response.content.replace(
+                b'</body>', self.render_panel(profile).encode() + b'</body>', 1
+            )
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+            # The page cache's ETag is for the body without the panel, and
+            # a 304 for it would bring back a panel from an earlier request
+            if response.has_header('ETag'):
+                del response['ETag']
+        return response
+    
+    def render_panel(self, profile):
+        stats = profile.as_dict()
+        rows = ''.join(
+            f'<li><strong>{count}x</strong> <code>{html.escape(sql)}</code></li>'
+            for sql, count in profile.repeated()[:10]
+        )
+        return (
+            '<div id="profilingPanel" style="position:fixed;bottom:0;right:0;z-index:2000;'
+            'max-width:50%;max-height:40%;overflow:auto;padding:6px 10px;font:12px monospace;'
+            'background:rgba(33,37,41,.92);color:#f8f9fa">'
+            f'{stats["queries"]} queries in {stats["db_ms"]} ms, '
+            f'{stats["cache_calls"]} cache calls in {stats["cache_ms"]} ms, '
+            f'{stats["total_ms"]} ms total'
+            f'{f"<ul style=margin:4px 0 0;padding-left:16px>{rows}</ul>" if rows else ""}'
+            '</div>'
+        )
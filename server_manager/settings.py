@@ -44,15 +44,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'server_manager.middleware.MetricsMiddleware',  # First, so it times the rest
+    'server_manager.profiling.ProfilingMiddleware',  # Server-Timing header, see REQUEST_PROFILING
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',  # Added for caching
     'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'server_manager.middleware.OptimizedCacheMiddleware',  # Our custom middleware
+    'server_manager.middleware.OptimizedCacheMiddleware',  # Per-user page cache with ETags
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',  # Added for caching
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -80,6 +80,11 @@ WSGI_APPLICATION = 'server_manager.wsgi.application'
 ASGI_APPLICATION = 'server_manager.asgi.application'
 
 # Database
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before
+# reuse. Under ASGI each worker thread keeps its own connection, so for
+# many processes put PgBouncer (transaction pooling) in front of Postgres.
+DB_CONN_MAX_AGE = env.int('DB_CONN_MAX_AGE', default=60)
+
 if env('USE_POSTGRES', default=False):
     DATABASES = {
         'default': {
@@ -89,15 +94,53 @@ if env('USE_POSTGRES', default=False):
             'PASSWORD': env('DB_PASSWORD', default=''),
             'HOST': env('DB_HOST', default='localhost'),
             'PORT': env('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': env.int('DB_CONNECT_TIMEOUT', default=5),
+                # Detect dead connections held across idle periods
+                'keepalives': 1,
+                'keepalives_idle': 30,
+            },
         }
     }
+    if env('DB_REPLICA_HOST', default=''):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': env('DB_REPLICA_HOST'),
+            'PORT': env('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': env.int('SQLITE_BUSY_TIMEOUT', default=20),
+            },
         }
     }
+    # A second local database file can stand in for a replica
+    if env('DB_REPLICA_NAME', default=''):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'NAME': env('DB_REPLICA_NAME'),
+        }
+
+# Applied to every new SQLite connection (server_manager/db.py). WAL lets
+# readers run alongside a writer, and NORMAL only syncs at checkpoints.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': env.int('SQLITE_BUSY_TIMEOUT', default=20) * 1000,
+}
+
+# Reads inside server_manager.db.read_replica() go to the 'replica' alias when it exists
+DATABASE_ROUTERS = ['server_manager.db.ReplicaRouter']
 
 # Cache configuration
 if env('USE_REDIS'):
@@ -121,9 +164,82 @@ else:
         }
     }
 
-# Cache middleware settings
-CACHE_MIDDLEWARE_SECONDS = 300
-CACHE_MIDDLEWARE_KEY_PREFIX = 'serverhub'
+# Log retention: rows older than this are moved to compressed daily archives
+# by the archive_logs command and stay searchable from the activity log page
+LOG_RETENTION_DAYS = env.int('LOG_RETENTION_DAYS', default=90)
+LOG_ARCHIVE_DIR = env('LOG_ARCHIVE_DIR', default=str(BASE_DIR / 'logs' / 'archive'))
+# Longest date range, in days, an activity log archive search may read
+LOG_ARCHIVE_SEARCH_MAX_DAYS = env.int('LOG_ARCHIVE_SEARCH_MAX_DAYS', default=31)
+
+# Server status writes: a check that finds the same status is not written
+# again until the stored one is this many seconds old, and changes are
+# batched into one bulk update per flush delay
+SERVER_STATUS_FRESHNESS = env.int('SERVER_STATUS_FRESHNESS', default=60)
+SERVER_STATUS_FLUSH_DELAY = env.float('SERVER_STATUS_FLUSH_DELAY', default=0.5)
+
+# Server logs are buffered and written in batches (servers/logs.py). Set
+# SERVER_LOG_DURABILITY to 'durable' to write every log before returning,
+# if losing up to one flush interval of logs in a crash is not acceptable
+SERVER_LOG_DURABILITY = env.str('SERVER_LOG_DURABILITY', default='buffered')
+SERVER_LOG_FLUSH_INTERVAL = env.float('SERVER_LOG_FLUSH_INTERVAL', default=1.0)
+SERVER_LOG_BATCH_SIZE = env.int('SERVER_LOG_BATCH_SIZE', default=500)
+SERVER_LOG_MAX_QUEUE = env.int('SERVER_LOG_MAX_QUEUE', default=10000)
+
+# Terminal sessions: activity is written to ServerConnection.last_activity
+# every heartbeat interval, sessions show as idle after TERMINAL_IDLE_AFTER
+# and are closed, SSH transport included, after TERMINAL_IDLE_TIMEOUT seconds
+TERMINAL_HEARTBEAT_INTERVAL = env.int('TERMINAL_HEARTBEAT_INTERVAL', default=15)
+TERMINAL_IDLE_AFTER = env.int('TERMINAL_IDLE_AFTER', default=300)
+TERMINAL_IDLE_TIMEOUT = env.int('TERMINAL_IDLE_TIMEOUT', default=1800)
+
+# Terminal admission control, per ASGI worker (0 disables a limit). Clients
+# over a limit wait in a queue of TERMINAL_QUEUE_SIZE for up to
+# TERMINAL_QUEUE_TIMEOUT seconds, and are turned away when it is full
+TERMINAL_MAX_SESSIONS = env.int('TERMINAL_MAX_SESSIONS', default=200)
+TERMINAL_MAX_SESSIONS_PER_USER = env.int('TERMINAL_MAX_SESSIONS_PER_USER', default=10)
+TERMINAL_MAX_SESSIONS_PER_SERVER = env.int('TERMINAL_MAX_SESSIONS_PER_SERVER', default=20)
+TERMINAL_QUEUE_SIZE = env.int('TERMINAL_QUEUE_SIZE', default=50)
+TERMINAL_QUEUE_TIMEOUT = env.int('TERMINAL_QUEUE_TIMEOUT', default=30)
+
+# SSH logins running at once per worker, in total and per target host.
+# Logins over a limit wait up to TERMINAL_CONNECT_QUEUE_TIMEOUT seconds and
+# are served round robin across users
+TERMINAL_MAX_CONNECTS = env.int('TERMINAL_MAX_CONNECTS', default=16)
+TERMINAL_MAX_CONNECTS_PER_HOST = env.int('TERMINAL_MAX_CONNECTS_PER_HOST', default=4)
+TERMINAL_CONNECT_QUEUE_TIMEOUT = env.int('TERMINAL_CONNECT_QUEUE_TIMEOUT', default=60)
+
+# Blocking SSH calls run on a pool of TERMINAL_SSH_WORKERS threads per worker
+# process. Opening the shell, writes, resizes and close each give up after
+# TERMINAL_SSH_OPERATION_TIMEOUT seconds (connects use the server's timeout),
+# and input is written in chunks of up to TERMINAL_SEND_CHUNK_SIZE bytes
+TERMINAL_SSH_WORKERS = env.int('TERMINAL_SSH_WORKERS', default=32)
+TERMINAL_SSH_OPERATION_TIMEOUT = env.float('TERMINAL_SSH_OPERATION_TIMEOUT', default=10)
+TERMINAL_SEND_CHUNK_SIZE = env.int('TERMINAL_SEND_CHUNK_SIZE', default=32768)
+
+# Servers with keep_alive get an SSH keepalive every TERMINAL_KEEPALIVE_INTERVAL
+# seconds. A peer that leaves one unanswered for TERMINAL_KEEPALIVE_COUNT
+# intervals is dropped, with the session released and the browser told
+TERMINAL_KEEPALIVE_INTERVAL = env.float('TERMINAL_KEEPALIVE_INTERVAL', default=15)
+TERMINAL_KEEPALIVE_COUNT = env.int('TERMINAL_KEEPALIVE_COUNT', default=3)
+
+# Metrics at /metrics in the Prometheus text format (server_manager/metrics.py).
+# With several worker processes, point METRICS_DIR at a directory they share
+# on the host so a scrape reports all of them, not just the one answering.
+# Set METRICS_TOKEN to require 'Authorization: Bearer <token>', without one
+# /metrics is limited to staff users unless DEBUG is on
+METRICS_DIR = env.str('METRICS_DIR', default='')
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=5)
+EVENT_LOOP_PROBE_INTERVAL = env.float('EVENT_LOOP_PROBE_INTERVAL', default=0.5)
+# The watchdog logs the blocking stack when the loop is stuck for longer
+# than EVENT_LOOP_STALL_THRESHOLD seconds, and /ready answers 503 while the
+# recent p90 lag is above EVENT_LOOP_READY_MAX_LAG
+EVENT_LOOP_STALL_THRESHOLD = env.float('EVENT_LOOP_STALL_THRESHOLD', default=0.25)
+EVENT_LOOP_READY_MAX_LAG = env.float('EVENT_LOOP_READY_MAX_LAG', default=0.5)
+
+# Per-request query and cache profiling (server_manager/profiling.py): a
+# Server-Timing header on every response, plus a panel on HTML pages in DEBUG
+REQUEST_PROFILING = env.bool('REQUEST_PROFILING', default=DEBUG)
 
 # Channels configuration
 if env('USE_REDIS'):
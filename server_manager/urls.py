@@ -3,6 +3,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import redirect
+from .metrics import metrics_view
+from .loopmonitor import readiness_view
 
 def home_redirect(request):
     if request.user.is_authenticated:
@@ -16,6 +18,8 @@ urlpatterns = [
     path('dashboard/', include('dashboard.urls', namespace='dashboard')),
     path('servers/', include('servers.urls', namespace='servers')),
     path('terminal/', include('terminal.urls', namespace='terminal')),
+    path('metrics', metrics_view, name='metrics'),
+    path('ready', readiness_view, name='ready'),
 ]
 
 if settings.DEBUG:
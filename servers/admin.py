@@ -38,14 +38,15 @@ class ServerAdmin(admin.ModelAdmin):
 class ServerConnectionAdmin(admin.ModelAdmin):
     list_display = ['server', 'user', 'session_id', 'connected_at', 'last_activity', 'is_active']
     list_filter = ['is_active', 'connected_at', 'last_activity']
-    search_fields = ['server__name', 'user__username', 'session_id']
+    search_fields = ['server__name', 'user__username', '=session_id']
     readonly_fields = ['connected_at', 'last_activity']
 
 @admin.register(ServerLog)
 class ServerLogAdmin(admin.ModelAdmin):
     list_display = ['server', 'user', 'log_type', 'timestamp', 'session_id']
     list_filter = ['log_type', 'timestamp', 'server']
-    search_fields = ['server__name', 'user__username', 'message']
+    search_fields = ['server__name', 'user__username', 'template__text']
+    list_select_related = ['server', 'user']
     readonly_fields = ['timestamp']
     date_hierarchy = 'timestamp'
     
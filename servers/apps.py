@@ -4,4 +4,9 @@ from django.apps import AppConfig
 class ServersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'servers'
-    verbose_name = 'Server Management'
\ No newline at end of file
+    verbose_name = 'Server Management'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Connection tuning has to be hooked up before the first query
+        from server_manager import db  # noqa: F401
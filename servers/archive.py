@@ -0,0 +1,173 @@
+import gzip
+import heapq
+import json
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from .dates import day_range
+from .models import render_log_message
+
+# Columns archived for each model, as (key, lookup)
+LOG_ARCHIVE_COLUMNS = [
+    ('id', 'id'),
+    ('timestamp', 'timestamp'),
+    ('server_id', 'server_id'),
+    ('server', 'server__name'),
+    ('owner_id', 'server__created_by_id'),
+    ('user_id', 'user_id'),
+    ('user', 'user__username'),
+    ('log_type', 'log_type'),
+    ('session_id', 'session_id'),
+    # Message template and its arguments, rendered when searched
+    ('message', 'template__text'),
+    ('args', 'args'),
+]
+
+CONNECTION_ARCHIVE_COLUMNS = [
+    ('id', 'id'),
+    ('connected_at', 'connected_at'),
+    ('last_activity', 'last_activity'),
+    ('server_id', 'server_id'),
+    ('server', 'server__name'),
+    ('owner_id', 'server__created_by_id'),
+    ('user_id', 'user_id'),
+    ('session_id', 'session_id'),
+]
+
+
+def archive_dir():
+    return str(getattr(settings, 'LOG_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'logs', 'archive')))
+
+
+def archive_path(kind, day, owner_id=None):
+    """Return the archive file for one model, calendar day and server owner.
+
+    Files are partitioned as
+    ``<archive dir>/<YYYY>/<MM>/<kind>-<YYYY-MM-DD>-owner<id>.ndjson.gz``, so a
+    search only reads the searching user's rows. Archives written before the
+    owner split have no ``-owner<id>`` suffix and hold every user's rows.
+    """
+    suffix = f'-owner{owner_id}' if owner_id is not None else ''
+    return os.path.join(
+        archive_dir(), f'{day:%Y}', f'{day:%m}', f'{kind}-{day.isoformat()}{suffix}.ndjson.gz'
+    )
+
+
+def _close_archive(raw, archive):
+    archive.close()
+    # Rows are deleted next, so make sure the archive is on disk first
+    raw.flush()
+    os.fsync(raw.fileno())
+    raw.close()
+
+
+def archive_day(queryset, kind, day, columns, timestamp_field, chunk_size=2000):
+    """Append one day of rows to its archive file and return (count, max_id).
+
+    Each run appends a new gzip member, which gzip readers treat as one
+    continuous stream, so a re-run after an interrupted delete is harmless.
+    """
+    start, end = day_range(day)
+    lookups = dict(columns)
+    # Grouped by owner, so one file is open at a time
+    rows = queryset.filter(**{
+        f'{timestamp_field}__gte': start,
+        f'{timestamp_field}__lt': end,
+    }).order_by(lookups['owner_id'], 'id').values_list(
+        *[lookup for _, lookup in columns]
+    ).iterator(chunk_size=chunk_size)
+
+    keys = [key for key, _ in columns]
+
+    count = 0
+    max_id = None
+    owner_id = None
+    raw = None
+    archive = None
+    try:
+        for row in rows:
+            record = dict(zip(keys, row))
+            if archive is None or record['owner_id'] != owner_id:
+                if archive is not None:
+                    _close_archive(raw, archive)
+                    archive = None
+                # Only create a file once there is something to archive
+                owner_id = record['owner_id']
+                path = archive_path(kind, day, owner_id)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                raw = open(path, 'ab')
+                archive = gzip.GzipFile(fileobj=raw, mode='ab')
+            archive.write((json.dumps(record, default=str) + '\n').encode())
+            count += 1
+            max_id = record['id'] if max_id is None else max(max_id, record['id'])
+    finally:
+        if archive is not None:
+            _close_archive(raw, archive)
+    return count, max_id
+
+
+def delete_in_batches(queryset, batch_size=1000, pause=0.0):
+    """Delete a queryset in small id batches so no lock is held for long"""
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            queryset.model.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def iter_archive(kind, date_from, date_to, owner_id):
+    """Yield one owner's archived records for every day in [date_from, date_to]"""
+    seen = set()
+    day = date_from
+    while day <= date_to:
+        # The owner's own file, then the shared file of an older archive run
+        for path in (archive_path(kind, day, owner_id), archive_path(kind, day)):
+            if not os.path.exists(path):
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    record = json.loads(line)
+                    # Interrupted runs can archive a row twice
+                    if record['owner_id'] != owner_id or record['id'] in seen:
+                        continue
+                    seen.add(record['id'])
+                    yield record
+        day += timedelta(days=1)
+
+
+class ArchiveRangeTooWide(ValueError):
+    """An archive search spans more days than LOG_ARCHIVE_SEARCH_MAX_DAYS"""
+
+
+def check_archive_range(date_from, date_to):
+    """Raise ArchiveRangeTooWide unless the range is short enough to search"""
+    max_days = getattr(settings, 'LOG_ARCHIVE_SEARCH_MAX_DAYS', 31)
+    if (date_to - date_from).days + 1 > max_days:
+        raise ArchiveRangeTooWide(
+            f'Archive searches can span at most {max_days} days, narrow the date range'
+        )
+
+
+def search_log_archive(user, date_from, date_to, log_type=None, server_id=None, limit=500):
+    """Search archived logs of a user's servers, newest first, up to ``limit`` rows"""
+    check_archive_range(date_from, date_to)
+    matches = (
+        record for record in iter_archive('serverlog', date_from, date_to, user.id)
+        if (not log_type or record['log_type'] == log_type)
+        and (not server_id or str(record['server_id']) == str(server_id))
+    )
+    # Timestamps are stored in UTC, so their text form sorts chronologically
+    results = heapq.nlargest(limit, matches, key=lambda record: (record['timestamp'], record['id']))
+    for record in results:
+        record['timestamp'] = parse_datetime(record['timestamp'])
+        record['message'] = render_log_message(record['message'], record.get('args'))
+    return results
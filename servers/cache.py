@@ -0,0 +1,103 @@
+import time
+from django.core.cache import cache
+from server_manager import metrics
+
+USER_CACHE_VERSION_KEY = 'user_cache_version_{}'
+
+CACHE_LOOKUPS = metrics.Counter(
+    'serverhub_cache_lookups_total',
+    'Cache lookups by key namespace and result',
+    ['namespace', 'result'],
+)
+
+
+def count_cache_lookups(namespace, hits, misses):
+    """Record cache hits and misses for one namespace of keys"""
+    if hits:
+        CACHE_LOOKUPS.inc(hits, namespace=namespace, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, namespace=namespace, result='miss')
+
+
+def user_cache_version(user_id):
+    """Get the current cache version for a user's data"""
+    version = cache.get(USER_CACHE_VERSION_KEY.format(user_id))
+    if version is None:
+        version = 1
+        cache.add(USER_CACHE_VERSION_KEY.format(user_id), version, None)
+    return version
+
+
+def invalidate_user_cache(user_id):
+    """Bump a user's cache version so every cached page and fragment built
+    from the old version is ignored from now on"""
+    if user_id is None:
+        return
+    key = USER_CACHE_VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Key missing or evicted, start a fresh version that can't collide
+        # with anything cached under the default version
+        cache.set(key, 2, None)
+
+
+# Dependency tags, e.g. "servers:42" for everything built from user 42's
+# servers. A tag's version changes on every write to the data it names, and
+# cached fragments remember the versions they were rendered against.
+CACHE_TAG_KEY = 'cache_tag_{}'
+
+
+def user_tag(name, user_id):
+    """Return the dependency tag for one kind of a user's data"""
+    return f'{name}:{user_id}'
+
+
+def cache_tag_keys(tags):
+    return {tag: CACHE_TAG_KEY.format(tag) for tag in tags}
+
+
+def cache_tag_versions(tags, fetched=None):
+    """Return {tag: version}, creating versions for tags seen for the first time.
+
+    ``fetched`` may hold values already read with get_many, so callers that
+    batch their reads don't pay another round trip.
+    """
+    keys = cache_tag_keys(tags)
+    if fetched is None:
+        fetched = cache.get_many(keys.values())
+    versions = {tag: fetched[key] for tag, key in keys.items() if key in fetched}
+    lost = []
+    for tag in tags:
+        if tag in versions:
+            continue
+        # A time based start can't collide with a version from before an eviction
+        versions[tag] = time.time_ns()
+        if not cache.add(keys[tag], versions[tag], None):
+            lost.append(tag)
+    if lost:
+        # Another request created these first, use its versions
+        created = cache.get_many([keys[tag] for tag in lost])
+        versions.update({tag: created.get(keys[tag]) for tag in lost})
+    return versions
+
+
+def invalidate_cache_tags(*tags):
+    """Bump the version of each tag, staling every fragment that depends on it"""
+    for key in cache_tag_keys(tags).values():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate_users(user_ids, *names):
+    """Bump the cache version and the ``names`` tags of each user.
+
+    This is what the model signals do on a save. Bulk writes (bulk_create,
+    bulk_update, queryset update) skip the signals and call it themselves.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    for user_id in user_ids:
+        invalidate_user_cache(user_id)
+    invalidate_cache_tags(*(user_tag(name, user_id) for user_id in user_ids for name in names))
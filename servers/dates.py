@@ -0,0 +1,50 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def day_start(day, tz=None):
+    """Return the aware datetime at which a calendar day starts in a time zone"""
+    tz = tz or timezone.get_current_timezone()
+    return timezone.make_aware(datetime.combine(day, time.min), tz)
+
+
+def day_range(day, tz=None):
+    """Return the half-open [start, end) datetime range covering a calendar day.
+
+    Filtering with ``timestamp__gte=start, timestamp__lt=end`` keeps the
+    indexed column bare, unlike ``timestamp__date=day`` which casts every row.
+    """
+    return day_start(day, tz), day_start(day + timedelta(days=1), tz)
+
+
+def local_today(tz=None):
+    """Return today's date in the current (user's) time zone"""
+    return timezone.localdate(timezone=tz or timezone.get_current_timezone())
+
+
+def timestamp_range_filter(date_from=None, date_to=None, field='timestamp', tz=None):
+    """Build lookup kwargs for an inclusive date filter as a half-open range.
+
+    ``date_from``/``date_to`` may be dates or ISO date strings, invalid values
+    are ignored. ``date_to`` includes the whole day, so the upper bound is the
+    start of the following day.
+    """
+    lookups = {}
+    if isinstance(date_from, str):
+        date_from = parse_date_param(date_from)
+    if isinstance(date_to, str):
+        date_to = parse_date_param(date_to)
+    if date_from:
+        lookups[f'{field}__gte'] = day_start(date_from, tz)
+    if date_to:
+        lookups[f'{field}__lt'] = day_start(date_to + timedelta(days=1), tz)
+    return lookups
+
+
+def parse_date_param(value):
+    """Parse an ISO date request parameter, returning None if it is invalid"""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
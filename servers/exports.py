@@ -0,0 +1,125 @@
+import asyncio
+import csv
+import io
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+from django.http import StreamingHttpResponse
+from .models import render_log_message
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Columns written for every exported log row, as (header, lookup)
+LOG_EXPORT_COLUMNS = [
+    ('timestamp', 'timestamp'),
+    ('server', 'server__name'),
+    ('type', 'log_type'),
+    ('user', 'user__username'),
+    ('session_id', 'session_id'),
+    # Must stay last: filled from the row's args after the query
+    ('message', 'template__text'),
+]
+
+
+def _csv_chunks(rows, headers, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows, headers, batch_size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(headers, row)), default=str))
+        if len(lines) >= batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip_chunks(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_DONE = object()
+
+
+def _close_chunks(chunks):
+    chunks.close()
+    connections.close_all()
+
+
+async def _chunks_in_thread(chunks):
+    """Produce ``chunks`` one at a time on a thread of their own.
+
+    Under ASGI, Django reads a sync iterator into a list before sending the
+    first byte, so the export is handed this async iterator instead. Every
+    chunk is pulled on the same thread, which keeps the database cursor on
+    the connection that opened it, and that connection is closed at the end.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, _DONE)
+            if chunk is _DONE:
+                break
+            yield chunk
+    finally:
+        await loop.run_in_executor(executor, _close_chunks, chunks)
+        executor.shutdown(wait=False)
+
+
+def stream_logs_response(queryset, fmt, filename, compress=False, chunk_size=2000, asynchronous=False):
+    """Stream a log queryset as CSV or NDJSON without loading it into memory.
+
+    Rows are read as tuples through ``iterator(chunk_size=...)``, which uses a
+    server-side cursor on PostgreSQL, so memory stays flat whatever the size.
+    Pass ``asynchronous=True`` when serving under ASGI.
+    """
+    headers = [header for header, _ in LOG_EXPORT_COLUMNS]
+    # The rows are read after the view returns, outside any read_replica()
+    # block it ran in, so bind the database the router picks now
+    queryset = queryset.using(queryset.db)
+    rows = queryset.order_by('-timestamp', '-id').values_list(
+        *[lookup for _, lookup in LOG_EXPORT_COLUMNS], 'args'
+    ).iterator(chunk_size=chunk_size)
+    rows = (row[:-2] + (render_log_message(row[-2], row[-1]),) for row in rows)
+
+    if fmt == 'ndjson':
+        chunks = _ndjson_chunks(rows, headers, chunk_size)
+    else:
+        fmt = 'csv'
+        chunks = _csv_chunks(rows, headers, chunk_size)
+
+    filename = f'{filename}.{fmt}'
+    content_type = EXPORT_FORMATS[fmt]
+    if compress:
+        chunks = _gzip_chunks(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    if asynchronous:
+        chunks = _chunks_in_thread(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -4,6 +4,7 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, Row, Column, Submit, HTML
 from crispy_forms.bootstrap import Field, InlineRadios
 from .models import Server, ServerGroup
+from .inventory import get_inventory
 
 class ServerGroupForm(forms.ModelForm):
     class Meta:
@@ -208,7 +209,12 @@ class ServerSearchForm(forms.Form):
     
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        inventory = kwargs.pop('inventory', None)
         super().__init__(*args, **kwargs)
         
         if user:
-            self.fields['group'].queryset = ServerGroup.objects.filter(created_by=user)
\ No newline at end of file
+            # The queryset only validates the submitted group, the choices
+            # come from the user's inventory snapshot instead of a query
+            self.fields['group'].queryset = ServerGroup.objects.filter(created_by=user)
+            inventory = inventory or get_inventory(user)
+            self.fields['group'].choices = [('', 'All Groups')] + inventory.group_choices()
\ No newline at end of file
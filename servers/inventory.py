@@ -0,0 +1,258 @@
+import time
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .models import Server, ServerGroup
+from .cache import count_cache_lookups
+
+# A user's inventory lives in one cache entry and is patched in place by the
+# model signals. The generation key guards against lost updates: any write
+# that can't be applied to a current snapshot bumps it, which makes the
+# next read rebuild the snapshot from the database.
+INVENTORY_KEY = 'server_inventory_{}'
+INVENTORY_GEN_KEY = 'server_inventory_gen_{}'
+INVENTORY_LOCK_KEY = 'server_inventory_lock_{}'
+LOCK_TIMEOUT = 5
+
+
+class ServerInventory:
+    """Read-only view of a user's server inventory snapshot"""
+    
+    def __init__(self, data):
+        self.data = data
+    
+    @property
+    def total_servers(self):
+        return len(self.data['servers'])
+    
+    @property
+    def total_groups(self):
+        return len(self.data['groups'])
+    
+    @property
+    def status_counts(self):
+        return dict(self.data['status_counts'])
+    
+    @property
+    def group_counts(self):
+        """Servers per group id, ungrouped servers under None"""
+        return dict(self.data['group_counts'])
+    
+    @property
+    def tag_counts(self):
+        return dict(self.data['tag_counts'])
+    
+    @property
+    def servers(self):
+        """Lightweight server entries (id, name, status, group_id, tags) by name"""
+        return sorted(self.data['servers'].values(), key=lambda entry: (entry['name'], entry['id']))
+    
+    @property
+    def groups(self):
+        """Group entries (id, name, description, color, server_count) by name"""
+        counts = self.data['group_counts']
+        return [
+            dict(group, server_count=counts.get(group['id'], 0))
+            for group in sorted(self.data['groups'].values(), key=lambda group: (group['name'], group['id']))
+        ]
+    
+    def group_choices(self):
+        return [(group['id'], group['name']) for group in self.groups]
+    
+    def servers_by_group(self):
+        """(group, servers) pairs by group name, ungrouped servers last under None"""
+        members = {}
+        for entry in self.servers:
+            members.setdefault(entry['group_id'], []).append(entry)
+        pairs = [(group, members[group['id']]) for group in self.groups if group['id'] in members]
+        if None in members:
+            pairs.append((None, members[None]))
+        return pairs
+
+
+def _server_entry(server):
+    return {
+        'id': server.id,
+        'name': server.name,
+        'status': server.status,
+        'group_id': server.group_id,
+        'tags': server.get_tags_list(),
+    }
+
+
+def _group_entry(group):
+    return {
+        'id': group.id,
+        'name': group.name,
+        'description': group.description,
+        'color': group.color,
+    }
+
+
+def _count(counts, key, delta):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+
+def _add_server(data, entry, sign=1):
+    """Add (sign=1) or remove (sign=-1) a server's contribution to the counters"""
+    _count(data['status_counts'], entry['status'], sign)
+    _count(data['group_counts'], entry['group_id'], sign)
+    for tag in entry['tags']:
+        _count(data['tag_counts'], tag, sign)
+
+
+def _put_server(data, entry):
+    old = data['servers'].get(entry['id'])
+    if old is not None:
+        _add_server(data, old, -1)
+    data['servers'][entry['id']] = entry
+    _add_server(data, entry)
+
+
+def _remove_server(data, server_id):
+    old = data['servers'].pop(server_id, None)
+    if old is not None:
+        _add_server(data, old, -1)
+
+
+def build_inventory(user_id, gen):
+    """Build a user's snapshot from the database"""
+    data = {
+        'gen': gen,
+        'servers': {},
+        'groups': {},
+        'status_counts': {},
+        'group_counts': {},
+        'tag_counts': {},
+    }
+    # Always from the primary: a snapshot built from a lagging replica would
+    # stay wrong until the next write
+    servers = Server.objects.using(DEFAULT_DB_ALIAS).filter(created_by_id=user_id).only(
+        'id', 'name', 'status', 'group_id', 'tags'
+    )
+    for server in servers.iterator(chunk_size=2000):
+        _put_server(data, _server_entry(server))
+    for group in ServerGroup.objects.using(DEFAULT_DB_ALIAS).filter(created_by_id=user_id).only(
+        'id', 'name', 'description', 'color'
+    ):
+        data['groups'][group.id] = _group_entry(group)
+    return data
+
+
+def inventory_keys(user_id):
+    """The snapshot and generation keys, for callers batching them into a get_many"""
+    return [INVENTORY_KEY.format(user_id), INVENTORY_GEN_KEY.format(user_id)]
+
+
+def _current_gen(user_id, fetched):
+    """The generation from ``fetched`` (a get_many of inventory_keys), created if missing"""
+    key = INVENTORY_GEN_KEY.format(user_id)
+    gen = fetched.get(key)
+    if gen is None:
+        # A time based start can't collide with a generation from before an eviction
+        gen = time.time_ns()
+        if not cache.add(key, gen, None):
+            gen = cache.get(key)
+    return gen
+
+
+def _bump_gen(user_id):
+    key = INVENTORY_GEN_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_inventory(user, fetched=None):
+    """Return the user's ServerInventory, rebuilding it if it is missing or stale.
+
+    ``fetched`` may hold a get_many of ``inventory_keys`` already done by the
+    caller, so the snapshot costs no extra round trip when it is current.
+    """
+    user_id = getattr(user, 'id', user)
+    snapshot_key = INVENTORY_KEY.format(user_id)
+    if fetched is None:
+        fetched = cache.get_many(inventory_keys(user_id))
+    gen = _current_gen(user_id, fetched)
+    data = fetched.get(snapshot_key)
+    stale = data is None or data['gen'] != gen
+    count_cache_lookups('inventory', int(not stale), int(stale))
+    if stale:
+        data = build_inventory(user_id, gen)
+        cache.set(snapshot_key, data, None)
+    return ServerInventory(data)
+
+
+def _apply(user_id, change):
+    """Apply ``change(data)`` to a current snapshot, or retire the snapshot"""
+    lock_key = INVENTORY_LOCK_KEY.format(user_id)
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # Another writer is patching the snapshot, rebuild instead of waiting
+        _bump_gen(user_id)
+        return
+    try:
+        snapshot_key = INVENTORY_KEY.format(user_id)
+        fetched = cache.get_many(inventory_keys(user_id))
+        gen = _current_gen(user_id, fetched)
+        data = fetched.get(snapshot_key)
+        if data is None or data['gen'] != gen:
+            # A reader may be building from data read before this write
+            _bump_gen(user_id)
+            return
+        change(data)
+        cache.set(snapshot_key, data, None)
+    finally:
+        cache.delete(lock_key)
+
+
+def invalidate_inventory(user_id):
+    """Retire a user's snapshot after writes that skip the model signals"""
+    _bump_gen(user_id)
+
+
+def update_inventory(user_id, change):
+    """Patch a user's snapshot once the current transaction commits"""
+    if user_id is not None:
+        transaction.on_commit(lambda: _apply(user_id, change))
+
+
+def server_saved(server):
+    entry = _server_entry(server)
+    update_inventory(server.created_by_id, lambda data: _put_server(data, entry))
+
+
+def server_deleted(server):
+    server_id = server.id
+    update_inventory(server.created_by_id, lambda data: _remove_server(data, server_id))
+
+
+def servers_changed(user_id, changes):
+    """Record ``{server_id: {field: value}}`` from bulk updates, which skip signals"""
+    def change(data):
+        for server_id, fields in changes.items():
+            old = data['servers'].get(server_id)
+            if old is not None:
+                _put_server(data, dict(old, **fields))
+    update_inventory(user_id, change)
+
+
+def group_saved(group):
+    entry = _group_entry(group)
+    
+    def change(data):
+        data['groups'][entry['id']] = entry
+    update_inventory(group.created_by_id, change)
+
+
+def group_deleted(group):
+    group_id = group.id
+    
+    def change(data):
+        data['groups'].pop(group_id, None)
+        # Servers are moved out of the group with a bulk SET NULL
+        for entry in list(data['servers'].values()):
+            if entry['group_id'] == group_id:
+                _put_server(data, dict(entry, group_id=None))
+    update_inventory(group.created_by_id, change)
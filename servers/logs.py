@@ -0,0 +1,184 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import connections, transaction
+from .models import ServerLog, LogMessage
+from .cache import invalidate_users
+from server_manager import metrics
+
+logger = logging.getLogger(__name__)
+
+BUFFERED = 'buffered'
+DURABLE = 'durable'
+
+LOG_ROWS = metrics.Counter(
+    'serverhub_log_rows_total',
+    'Server log rows by outcome',
+    ['outcome'],
+)
+LOG_FLUSH_DURATION = metrics.Histogram(
+    'serverhub_log_flush_duration_seconds',
+    'Time to write one batch of server logs',
+)
+
+
+class LogWriter:
+    """Write-behind buffer for ServerLog rows.
+    
+    Records are queued in memory and written with ``bulk_create`` once
+    ``batch_size`` records are waiting, ``interval`` seconds after the first
+    one was queued, or when the process exits. A crash can lose what is
+    still queued; in ``durable`` mode every record is written before
+    ``write`` returns instead.
+    """
+    
+    def __init__(self, interval=None, batch_size=None, max_queue=None, mode=None):
+        self.interval = interval if interval is not None else getattr(settings, 'SERVER_LOG_FLUSH_INTERVAL', 1.0)
+        self.batch_size = batch_size or getattr(settings, 'SERVER_LOG_BATCH_SIZE', 500)
+        self.max_queue = max_queue or getattr(settings, 'SERVER_LOG_MAX_QUEUE', 10000)
+        self.mode = mode or getattr(settings, 'SERVER_LOG_DURABILITY', BUFFERED)
+        self._lock = threading.Lock()
+        # Serializes flushes so batches are written in the order they were queued
+        self._flush_lock = threading.Lock()
+        self._queue = deque()
+        self._timer = None
+        self.written = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+    
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+    
+    def stats(self):
+        """Queue depth and flush counters for monitoring"""
+        return {
+            'mode': self.mode,
+            'queue_depth': self.queue_depth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+        }
+    
+    def write(self, server, log_type, message, args=None, user=None, session_id=None, durable=None):
+        """Log an event on ``server``, ``message`` is a template filled from ``args``.
+        
+        ``durable=True`` (or durable mode) writes the row right away, in the
+        caller's transaction. Otherwise the row is queued once the caller's
+        transaction commits, so rolled back work leaves no log behind.
+        """
+        log = ServerLog(
+            server=server,
+            owner_id=server.created_by_id,
+            user=user,
+            log_type=log_type,
+            template_id=LogMessage.objects.intern(message),
+            args=args,
+            session_id=session_id,
+        )
+        if durable or (durable is None and self.mode == DURABLE):
+            log.save()
+            return log
+        transaction.on_commit(lambda: self._enqueue(log))
+        return log
+    
+    def _enqueue(self, log):
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                # The database is not keeping up, shed the oldest record
+                # rather than grow without bound
+                self._queue.popleft()
+                self.dropped += 1
+                LOG_ROWS.inc(outcome='dropped')
+            self._queue.append(log)
+            flush = len(self._queue) >= self.batch_size
+            if not flush and self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush_quietly)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write server logs')
+    
+    def flush(self):
+        """Write every queued record, returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._queue)
+                self._queue.clear()
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not batch:
+                return 0
+            
+            started = time.perf_counter()
+            try:
+                ServerLog.objects.bulk_create(batch, batch_size=self.batch_size)
+                written = batch
+            except Exception:
+                logger.exception('Bulk log write failed, retrying %d rows one by one', len(batch))
+                written = self._write_each(batch)
+            elapsed = time.perf_counter() - started
+            self.written += len(written)
+            LOG_ROWS.inc(len(written), outcome='written')
+            LOG_FLUSH_DURATION.observe(elapsed)
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        
+        user_ids = set()
+        for log in written:
+            user_ids.add(log.user_id)
+            user_ids.add(log.server.created_by_id)
+        invalidate_users(user_ids, 'logs')
+        return len(written)
+    
+    def _write_each(self, batch):
+        """Save rows one at a time so one bad row doesn't lose the batch"""
+        written = []
+        for log in batch:
+            try:
+                log.save(force_insert=True)
+                written.append(log)
+            except Exception:
+                self.dropped += 1
+                LOG_ROWS.inc(outcome='dropped')
+                logger.exception('Dropped log row for server %s', log.server_id)
+        return written
+    
+    def flush_quietly(self):
+        """Flush from a timer thread or at exit, logging instead of raising"""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to write server logs')
+        finally:
+            # Every timer is a new thread with its own connection, which
+            # close_old_connections keeps open under CONN_MAX_AGE
+            connections.close_all()
+
+
+log_writer = LogWriter()
+
+LOG_QUEUE_DEPTH = metrics.Gauge(
+    'serverhub_log_queue_depth',
+    'Server log rows waiting to be written',
+    function=lambda: log_writer.queue_depth,
+)
+
+# Write whatever is still queued when the process exits
+atexit.register(log_writer.flush_quietly)
+
+
+def write_log(server, log_type, message, args=None, user=None, session_id=None, durable=None):
+    """Log an event through the shared writer"""
+    return log_writer.write(
+        server, log_type, message, args, user=user, session_id=session_id, durable=durable
+    )
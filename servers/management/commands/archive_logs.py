@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+from datetime import timedelta
+from servers.models import ServerConnection, ServerLog
+from servers.archive import (
+    archive_day, delete_in_batches, LOG_ARCHIVE_COLUMNS, CONNECTION_ARCHIVE_COLUMNS
+)
+from servers.dates import day_range, local_today
+
+class Command(BaseCommand):
+    help = 'Moves logs and closed connections older than the retention period into compressed daily archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'LOG_RETENTION_DAYS', 90),
+            help='Number of days of logs to keep in the database'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.05,
+            help='Seconds to sleep between delete batches to let other writers in'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report which days would be archived'
+        )
+
+    def handle(self, *args, **options):
+        cutoff_day = local_today() - timedelta(days=options['days'])
+        self.stdout.write(self.style.NOTICE(f'Archiving rows older than {cutoff_day}'))
+
+        targets = [
+            ('serverlog', ServerLog.objects.all(), LOG_ARCHIVE_COLUMNS, 'timestamp'),
+            # Only closed connections, active ones are still being tracked
+            ('serverconnection', ServerConnection.objects.filter(is_active=False),
+             CONNECTION_ARCHIVE_COLUMNS, 'connected_at'),
+        ]
+
+        for kind, queryset, columns, timestamp_field in targets:
+            archived, deleted = self.archive(
+                kind, queryset, columns, timestamp_field, cutoff_day, options
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: archived {archived} rows, deleted {deleted} rows'
+            ))
+
+    def archive(self, kind, queryset, columns, timestamp_field, cutoff_day, options):
+        """Archive then delete one day at a time, oldest first"""
+        cutoff = day_range(cutoff_day)[0]
+        oldest = queryset.filter(**{f'{timestamp_field}__lt': cutoff}).aggregate(
+            oldest=Min(timestamp_field)
+        )['oldest']
+        if oldest is None:
+            return 0, 0
+
+        archived = deleted = 0
+        day = timezone.localtime(oldest).date()
+        while day < cutoff_day:
+            if options['dry_run']:
+                self.stdout.write(f'Would archive {kind} for {day}')
+            else:
+                count, max_id = archive_day(queryset, kind, day, columns, timestamp_field)
+                if count:
+                    start, end = day_range(day)
+                    # Never delete rows that were not written to the archive
+                    deleted += delete_in_batches(
+                        queryset.filter(**{
+                            f'{timestamp_field}__gte': start,
+                            f'{timestamp_field}__lt': end,
+                            'id__lte': max_id,
+                        }),
+                        batch_size=options['batch_size'],
+                        pause=options['pause'],
+                    )
+                    archived += count
+                    self.stdout.write(f'{kind} {day}: {count} rows')
+            day += timedelta(days=1)
+        return archived, deleted
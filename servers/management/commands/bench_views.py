@@ -0,0 +1,262 @@
+import json
+import math
+import platform
+import statistics
+import threading
+import time
+from datetime import timedelta
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from servers.models import Server, ServerGroup, ServerLog
+from servers.scaledata import FleetGenerator
+from servers.dates import local_today
+from server_manager.profiling import profiled
+
+# (label, url name, query string built from the dataset's user)
+BENCHMARKS = [
+    ('dashboard_home', 'dashboard:home', lambda user: {}),
+    ('server_overview', 'dashboard:server_overview', lambda user: {}),
+    ('activity_logs', 'dashboard:activity_logs', lambda user: {}),
+    ('activity_logs (type + week)', 'dashboard:activity_logs', lambda user: {
+        'type': 'command',
+        'date_from': (local_today() - timedelta(days=7)).isoformat(),
+        'date_to': local_today().isoformat(),
+    }),
+    ('server_list', 'servers:list', lambda user: {}),
+    ('server_list (search)', 'servers:list', lambda user: {'search': 'web'}),
+    ('server_list (group)', 'servers:list', lambda user: {
+        'group': ServerGroup.objects.filter(created_by=user).order_by('pk').values_list('pk', flat=True).first()
+    }),
+    ('server_list (status)', 'servers:list', lambda user: {'status': 'error'}),
+    ('server_list (tags)', 'servers:list', lambda user: {'tags': 'docker'}),
+    ('server_list (combined)', 'servers:list', lambda user: {
+        'search': 'prod', 'status': 'online', 'tags': 'linux'
+    }),
+    ('terminal_sessions', 'terminal:sessions', lambda user: {}),
+]
+
+# Each run gets an empty in-memory cache of its own, so cold runs can clear it
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-views',
+    }
+}
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds"""
+    samples = sorted(samples)
+    
+    def pick(pct):
+        return round(samples[min(len(samples) - 1, int(pct / 100 * len(samples)))], 2)
+    return {
+        'samples': len(samples),
+        'mean': round(statistics.fmean(samples), 2),
+        'p50': pick(50),
+        'p90': pick(90),
+        'p99': pick(99),
+        'max': round(samples[-1], 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the dashboard, server list and log pages cold and warm against seeded '
+        'datasets of several sizes, and writes latency, throughput and query counts as JSON'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000',
+            help='Comma separated server counts, one dataset per size'
+        )
+        parser.add_argument('--logs-per-server', type=int, default=100, help='Logs generated per server')
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per view, cold and warm')
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Threads sending warm requests for the throughput figure'
+        )
+        parser.add_argument('--only', help='Only run benchmarks whose label contains this text')
+        parser.add_argument(
+            '--regenerate', action='store_true',
+            help='Rebuild the datasets even if they exist from an earlier run'
+        )
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes takes comma separated numbers, e.g. 1000,10000')
+        benchmarks = [
+            benchmark for benchmark in BENCHMARKS
+            if not options['only'] or options['only'] in benchmark[0]
+        ]
+        if not benchmarks:
+            raise CommandError(f'No benchmark matches "{options["only"]}"')
+        
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'environment': self.environment(),
+            'config': {
+                key: options[key] for key in ('iterations', 'concurrency', 'logs_per_server')
+            },
+            'datasets': [],
+        }
+        for size in sizes:
+            user, dataset = self.dataset(size, options)
+            self.stdout.write(self.style.SUCCESS(
+                f'Dataset of {size} servers: {dataset["servers"]} servers, {dataset["logs"]} logs'
+            ))
+            views = {}
+            with override_settings(CACHES=BENCH_CACHES, ALLOWED_HOSTS=['testserver'], REQUEST_PROFILING=False):
+                for label, url_name, make_params in benchmarks:
+                    views[label] = self.run_benchmark(user, url_name, make_params(user), options)
+                    self.report(label, views[label])
+            results['datasets'].append({'size': size, 'dataset': dataset, 'views': views})
+        
+        results['scaling'] = self.scaling(results['datasets'])
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["json_path"]}')
+    
+    def environment(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT sqlite_version()')
+            else:
+                cursor.execute('SHOW server_version')
+            version = cursor.fetchone()[0]
+        return {
+            'database': connection.vendor,
+            'database_version': version,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+        }
+    
+    def dataset(self, size, options):
+        """The user owning a ``size`` server dataset, generated on first use"""
+        generator = FleetGenerator(prefix=f'bench{size}', progress=self.stdout.write)
+        user = User.objects.filter(username=f'bench{size}-user-0').first()
+        if user is not None and options['regenerate']:
+            generator.clear()
+            user = None
+        if user is None:
+            self.stdout.write(f'Generating a dataset of {size} servers...')
+            generator.generate(
+                users=1,
+                groups=max(1, size // 50),
+                servers=size,
+                connections=size * 2,
+                logs=size * options['logs_per_server'],
+            )
+            user = User.objects.get(username=f'bench{size}-user-0')
+        return user, {
+            'servers': Server.objects.filter(created_by=user).count(),
+            'groups': ServerGroup.objects.filter(created_by=user).count(),
+            'logs': ServerLog.objects.filter(server__created_by=user).count(),
+        }
+    
+    def run_benchmark(self, user, url_name, params, options):
+        url = reverse(url_name)
+        client = Client()
+        client.force_login(user)
+        
+        def timed_get(client):
+            with profiled() as profile:
+                response = client.get(url, params)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+            return profile.elapsed * 1000, profile.queries
+        
+        cold, cold_queries = [], 0
+        for _ in range(options['iterations']):
+            cache.clear()
+            elapsed, cold_queries = timed_get(client)
+            cold.append(elapsed)
+        timed_get(client)
+        warm, warm_queries = [], 0
+        for _ in range(options['iterations']):
+            elapsed, warm_queries = timed_get(client)
+            warm.append(elapsed)
+        
+        return {
+            'params': params,
+            'cold_ms': summarize(cold),
+            'warm_ms': summarize(warm),
+            'cold_queries': cold_queries,
+            'warm_queries': warm_queries,
+            'warm_requests_per_second': self.throughput(user, timed_get, options),
+        }
+    
+    def throughput(self, user, timed_get, options):
+        """Warm requests per second with ``concurrency`` clients sending at once"""
+        clients = []
+        for _ in range(options['concurrency']):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        errors = []
+        
+        def send(client):
+            try:
+                for _ in range(options['iterations']):
+                    timed_get(client)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=send, args=(client,)) for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'Throughput run failed: {errors[0]}')
+        return round(len(clients) * options['iterations'] / elapsed, 1)
+    
+    def scaling(self, datasets):
+        """How p50 latency grows between the smallest and largest dataset.
+        
+        An exponent near 0 means the page cost doesn't depend on the fleet
+        size, near 1 means it grows linearly with it.
+        """
+        if len(datasets) < 2:
+            return {}
+        smallest, largest = datasets[0], datasets[-1]
+        size_ratio = largest['dataset']['servers'] / max(1, smallest['dataset']['servers'])
+        if size_ratio <= 1:
+            return {}
+        scaling = {}
+        for label in largest['views']:
+            scaling[label] = {}
+            for run in ('cold_ms', 'warm_ms'):
+                before = smallest['views'][label][run]['p50']
+                after = largest['views'][label][run]['p50']
+                scaling[label][run] = round(math.log(max(after, 0.01) / max(before, 0.01)) / math.log(size_ratio), 2)
+            if scaling[label]['cold_ms'] > 0.5:
+                self.stdout.write(self.style.WARNING(
+                    f'{label}: cold latency grows with the fleet (exponent {scaling[label]["cold_ms"]})'
+                ))
+        return scaling
+    
+    def report(self, label, result):
+        cold, warm = result['cold_ms'], result['warm_ms']
+        self.stdout.write(
+            f'  {label}: cold p50 {cold["p50"]} ms p99 {cold["p99"]} ms ({result["cold_queries"]} queries), '
+            f'warm p50 {warm["p50"]} ms p99 {warm["p99"]} ms, '
+            f'{result["warm_requests_per_second"]} req/s'
+        )
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import re
+from contextlib import contextmanager
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.base import SessionBase
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from servers.models import Server, ServerLog
+from servers.cache import invalidate_user_cache
+from dashboard import views as dashboard_views
+from terminal import views as terminal_views
+
+# Tables that must never be read with a full scan
+GUARDED_TABLES = [ServerLog._meta.db_table]
+
+# A function or cast applied to the timestamp column hides it from its indexes
+WRAPPED_TIMESTAMP = re.compile(
+    r'\w+\(\s*"\w+"\."timestamp"|"\w+"\."timestamp"\s*(AT TIME ZONE|::)', re.IGNORECASE
+)
+
+# The next page link of a keyset paginated page
+NEXT_CURSOR = re.compile(r'[?&](?:amp;)?after=([\w-]+)')
+
+
+class _QueryCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries = []
+    
+    def emit(self, record):
+        sql = getattr(record, 'sql', None)
+        if sql:
+            self.queries.append(sql)
+
+
+@contextmanager
+def capture_all_queries():
+    """Collect the SQL run on every thread's connection.
+    
+    Async views run their queries on worker threads with their own
+    connections, which CaptureQueriesContext (one connection) would miss.
+    """
+    logger = logging.getLogger('django.db.backends')
+    collector = _QueryCollector()
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(collector)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        with override_settings(DEBUG=True):
+            yield collector.queries
+    finally:
+        logger.removeHandler(collector)
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the log views against the current database and fails if their log queries stop using an index or sort their rows'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Username to run the views as (defaults to the user with the most servers)'
+        )
+        parser.add_argument(
+            '--date-from',
+            default='2024-01-01',
+            help='date_from used for the filtered activity log checks'
+        )
+        parser.add_argument(
+            '--date-to',
+            default='2024-01-31',
+            help='date_to used for the filtered activity log checks'
+        )
+    
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        server = Server.objects.filter(created_by=user).first()
+        date_filter = {'date_from': options['date_from'], 'date_to': options['date_to']}
+        
+        checks = [
+            ('dashboard_home', dashboard_views.dashboard_home, '/dashboard/', {}, {}),
+            ('activity_logs', dashboard_views.activity_logs, '/dashboard/activity/', {}, {}),
+            ('activity_logs (dates)', dashboard_views.activity_logs, '/dashboard/activity/', date_filter, {}),
+            ('activity_logs (type + dates)', dashboard_views.activity_logs, '/dashboard/activity/',
+             dict(date_filter, type='connection'), {}),
+        ]
+        if server:
+            checks.append((
+                'terminal_logs (dates)', terminal_views.terminal_logs,
+                f'/terminal/{server.id}/logs/', date_filter, {'server_id': server.id}
+            ))
+        
+        # Page 1 of a keyset paginated view doesn't seek, so check the page
+        # its next link leads to as well
+        for name, view, path, params, kwargs in list(checks):
+            _, content = self.capture_queries(user, view, path, params, kwargs)
+            cursor = NEXT_CURSOR.search(content)
+            if cursor:
+                checks.append((f'{name} (next page)', view, path, dict(params, after=cursor.group(1)), kwargs))
+        
+        failures = []
+        for name, view, path, params, kwargs in checks:
+            queries, _ = self.capture_queries(user, view, path, params, kwargs)
+            for sql in queries:
+                plan = self.explain(sql)
+                problems = [
+                    f'full scan of {table}' for table in GUARDED_TABLES
+                    if self.is_full_scan(plan, table)
+                ]
+                if WRAPPED_TIMESTAMP.search(self.where_clause(sql)):
+                    problems.append('timestamp wrapped in a function')
+                if ' LIMIT ' in sql and self.is_sorted(plan):
+                    problems.append('rows sorted before the LIMIT')
+                if problems:
+                    failures.append((name, sql, plan))
+                    self.stdout.write(self.style.ERROR(f'{name}: {", ".join(problems)}'))
+                    self.stdout.write(f'  {sql}')
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+            if not any(failure[0] == name for failure in failures):
+                self.stdout.write(self.style.SUCCESS(f'{name}: indexes used'))
+        
+        if failures:
+            raise CommandError(f'{len(failures)} log queries no longer read through an index')
+    
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.filter(server__isnull=False).first() or User.objects.first()
+        if user is None:
+            raise CommandError('No users found, generate a dataset with seed_fleet first')
+        return user
+    
+    def capture_queries(self, user, view, path, params, kwargs):
+        """Run a view cold, return the SQL of every log query it executed and the page"""
+        invalidate_user_cache(user.id)
+        request = RequestFactory().get(path, params)
+        request.user = user
+        request.session = SessionBase()
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        with capture_all_queries() as captured:
+            response = view(request, **kwargs)
+        queries = [
+            sql for sql in captured
+            if sql.lstrip().upper().startswith('SELECT')
+            and any(table in sql for table in GUARDED_TABLES)
+        ]
+        return queries, response.content.decode()
+    
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [row[-1] for row in cursor.fetchall()]
+            # Small seeded tables make a seq scan cheapest, so ask whether
+            # an index can be used at all rather than whether it is chosen
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+    
+    def where_clause(self, sql):
+        """Return the WHERE part of a query, without GROUP BY / ORDER BY"""
+        _, _, where = sql.partition(' WHERE ')
+        return re.split(r' (GROUP BY|ORDER BY|LIMIT) ', where)[0]
+    
+    def is_full_scan(self, plan, table):
+        for line in plan:
+            line = line.strip().lstrip('-> ').strip()
+            if connection.vendor == 'sqlite':
+                line = line.replace('SCAN TABLE ', 'SCAN ')
+                if line.startswith(f'SCAN {table}') and 'USING' not in line:
+                    return True
+            elif line.startswith(f'Seq Scan on {table}'):
+                return True
+        return False
+    
+    def is_sorted(self, plan):
+        """Whether the rows are sorted instead of read in index order.
+        
+        A sort has to read every matching row first, so a LIMIT no longer
+        bounds the cost of the query.
+        """
+        for line in plan:
+            line = line.strip().lstrip('-> ').strip()
+            if connection.vendor == 'sqlite':
+                if 'TEMP B-TREE' in line and 'ORDER BY' in line:
+                    return True
+            elif line.startswith('Sort '):
+                return True
+        return False
@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from servers.models import Server
+from server_manager.profiling import profiled, assert_budget, BudgetExceeded
+
+# Most queries and cache calls each page may make with an empty cache (cold)
+# and right after a first visit (warm). Both include the session and user
+# lookups done by the auth middleware, so a page served from the page cache
+# costs 2 queries, plus 2 cache calls for the user's cache version and the
+# page. The limits must hold for any number of servers, so a query per
+# server or per group shows up as soon as the user has a few hundred of them.
+#
+# A cold dashboard makes 15 cache calls: the cache version (get and add),
+# the page, one get_many for its cached parts and the inventory snapshot,
+# an add for the inventory generation and a set for the snapshot, a set_many
+# per part timeout (3), one get_many for the template fragments and their
+# tag versions, an add per new tag (2), a set per fragment (2) and the page.
+# The version can't join the get_many, every other key is built from it,
+# and the fragment keys are only known once the template renders.
+BUDGETS = [
+    # (label, url name, needs a server id, cold, warm), budgets as (queries, cache calls)
+    ('dashboard_home', 'dashboard:home', False, (10, 15), (2, 2)),
+    ('server_overview', 'dashboard:server_overview', False, (7, 9), (2, 2)),
+    ('activity_logs', 'dashboard:activity_logs', False, (7, 8), (2, 2)),
+    ('server_list', 'servers:list', False, (7, 3), (5, 1)),
+    ('server_detail', 'servers:detail', True, (7, 0), (7, 0)),
+    ('terminal_sessions', 'terminal:sessions', False, (8, 4), (2, 2)),
+    ('terminal_logs', 'terminal:logs', True, (6, 4), (2, 2)),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'if any of them runs more queries or cache calls than its budget'
+        'if any of them runs more queries than its budget'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Username to request the pages as (defaults to the user with the most servers)'
+        )
+    
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        server = Server.objects.filter(created_by=user).order_by('pk').first()
+        server_count = Server.objects.filter(created_by=user).count()
+        self.stdout.write(f'Requesting pages as {user.username} ({server_count} servers)')
+        
+        # A private cache, so clearing it for the cold runs is safe anywhere
+        private_cache = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'view-budgets',
+            }
+        }
+        failures = []
+        with override_settings(CACHES=private_cache, ALLOWED_HOSTS=['testserver'], REQUEST_PROFILING=False):
+            client = Client()
+            client.force_login(user)
+            for label, url_name, needs_server, cold_budget, warm_budget in BUDGETS:
+                if needs_server and server is None:
+                    self.stdout.write(self.style.WARNING(f'{label}: skipped, the user has no servers'))
+                    continue
+                url = reverse(url_name, args=[server.pk] if needs_server else [])
+                cache.clear()
+                for run, budget in (('cold', cold_budget), ('warm', warm_budget)):
+                    with profiled() as profile:
+                        response = client.get(url)
+                    if response.status_code != 200:
+                        raise CommandError(f'{label}: {url} answered {response.status_code}')
+                    stats = profile.as_dict()
+                    line = (
+                        f'{label} ({run}): {stats["queries"]} queries in {stats["db_ms"]} ms, '
+                        f'{stats["cache_calls"]} cache calls in {stats["cache_ms"]} ms'
+                    )
+                    query_budget, cache_budget = budget
+                    try:
+                        assert_budget(profile, f'{label} ({run})', queries=query_budget, cache_calls=cache_budget)
+                    except BudgetExceeded as exc:
+                        failures.append(label)
+                        self.stdout.write(self.style.ERROR(str(exc)))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(
+                            f'{line}, budget {query_budget} queries and {cache_budget} cache calls'
+                        ))
+        
+        if failures:
+            raise CommandError(f'{len(failures)} pages are over their budget')
+    
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.annotate(servers=Count('server')).order_by('-servers').first()
+        if user is None:
+            raise CommandError('No users found, generate a dataset with seed_fleet first')
+        return user
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db import transaction
 from servers.models import ServerConnection
+from servers.cache import invalidate_users
 from datetime import timedelta
 
 class Command(BaseCommand):
@@ -31,8 +32,11 @@ class Command(BaseCommand):
             count = expired_connections.count()
             
             if count > 0:
+                user_ids = set(expired_connections.values_list('user_id', flat=True))
+                
                 # Mark connections as inactive
                 expired_connections.update(is_active=False)
+                invalidate_users(user_ids, 'connections')
                 
                 self.stdout.write(
                     self.style.SUCCESS(f'Successfully cleaned up {count} expired connections')
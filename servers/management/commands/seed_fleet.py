@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from servers.scaledata import FleetGenerator, PASSWORD
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a seeded, fleet-sized dataset of users, groups, servers with encrypted '
+        'credentials, connections and logs for benchmarks and query plan checks'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users owning the fleet')
+        parser.add_argument('--groups', type=int, default=200, help='Server groups, spread over the users')
+        parser.add_argument('--servers', type=int, default=10000, help='Servers, spread over the users')
+        parser.add_argument('--connections', type=int, default=20000, help='Terminal sessions')
+        parser.add_argument('--logs', type=int, default=1000000, help='ServerLog rows')
+        parser.add_argument('--days', type=int, default=90, help='Days of history to spread logs and sessions over')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create')
+        parser.add_argument(
+            '--prefix',
+            default='scale',
+            help='Prefix of the generated usernames, so several datasets can live side by side'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete the dataset with this prefix first'
+        )
+    
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('At least one user is needed')
+        generator = FleetGenerator(
+            prefix=options['prefix'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=self.stdout.write,
+        )
+        if options['clear']:
+            self.stdout.write(f'Deleted {generator.clear()} rows of the "{options["prefix"]}" dataset')
+        elif User.objects.filter(username__startswith=f'{options["prefix"]}-user-').exists():
+            raise CommandError(
+                f'A "{options["prefix"]}" dataset already exists, pass --clear to replace it '
+                f'or --prefix to add another one'
+            )
+        counts = generator.generate(
+            users=options['users'],
+            groups=options['groups'],
+            servers=options['servers'],
+            connections=options['connections'],
+            logs=options['logs'],
+            days=options['days'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {counts["users"]} users, {counts["groups"]} groups, {counts["servers"]} servers, '
+            f'{counts["connections"]} connections and {counts["logs"]} logs in {counts["seconds"]} s'
+        ))
+        self.stdout.write(f'Log in as {options["prefix"]}-user-0 with password "{PASSWORD}"')
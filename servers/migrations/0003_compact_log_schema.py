@@ -0,0 +1,119 @@
+import hashlib
+import uuid
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def convert_connection_sessions(apps, schema_editor):
+    """Copy ServerConnection.session_id strings into the UUID column"""
+    ServerConnection = apps.get_model('servers', 'ServerConnection')
+    batch = []
+    for connection in ServerConnection.objects.only('id', 'session_id').iterator(chunk_size=BATCH_SIZE):
+        # Ids were always uuid4 strings, anything else gets a fresh one
+        connection.session_uuid = parse_uuid(connection.session_id) or uuid.uuid4()
+        batch.append(connection)
+        if len(batch) >= BATCH_SIZE:
+            ServerConnection.objects.bulk_update(batch, ['session_uuid'])
+            batch = []
+    ServerConnection.objects.bulk_update(batch, ['session_uuid'])
+
+
+def convert_log_sessions_and_messages(apps, schema_editor):
+    """Intern every distinct log message and copy session ids as UUIDs"""
+    ServerLog = apps.get_model('servers', 'ServerLog')
+    LogMessage = apps.get_model('servers', 'LogMessage')
+
+    message_ids = {}
+    batch = []
+    rows = ServerLog.objects.only('id', 'message', 'session_id').iterator(chunk_size=BATCH_SIZE)
+    for log in rows:
+        template_id = message_ids.get(log.message)
+        if template_id is None:
+            digest = hashlib.sha1(log.message.encode()).hexdigest()
+            template_id = LogMessage.objects.get_or_create(
+                digest=digest, defaults={'text': log.message}
+            )[0].pk
+            message_ids[log.message] = template_id
+        log.template_id = template_id
+        log.session_uuid = parse_uuid(log.session_id)
+        batch.append(log)
+        if len(batch) >= BATCH_SIZE:
+            ServerLog.objects.bulk_update(batch, ['template', 'session_uuid'])
+            batch = []
+    ServerLog.objects.bulk_update(batch, ['template', 'session_uuid'])
+
+
+class Migration(migrations.Migration):
+    """Store session ids as UUIDs and log message text once in LogMessage.
+
+    Every conversion goes through a new column so it runs the same way on
+    SQLite and PostgreSQL. The old columns are dropped in 0004, in a separate
+    transaction, since PostgreSQL refuses to ALTER a table with pending
+    foreign key trigger events from the data copy.
+    """
+
+    dependencies = [
+        ('servers', '0002_alter_server_created_at_alter_server_hostname_and_more'),
+    ]
+
+    operations = [
+        # ServerConnection.session_id: varchar(100) -> uuid
+        migrations.AddField(
+            model_name='serverconnection',
+            name='session_uuid',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(convert_connection_sessions),
+        migrations.RemoveField(
+            model_name='serverconnection',
+            name='session_id',
+        ),
+        migrations.RenameField(
+            model_name='serverconnection',
+            old_name='session_uuid',
+            new_name='session_id',
+        ),
+        migrations.AlterField(
+            model_name='serverconnection',
+            name='session_id',
+            field=models.UUIDField(default=uuid.uuid4, unique=True),
+        ),
+
+        # ServerLog.message -> interned LogMessage + args
+        migrations.CreateModel(
+            name='LogMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='serverlog',
+            name='template',
+            field=models.ForeignKey(
+                null=True, db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                related_name='+', to='servers.logmessage'
+            ),
+        ),
+        migrations.AddField(
+            model_name='serverlog',
+            name='args',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='serverlog',
+            name='session_uuid',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(convert_log_sessions_and_messages),
+    ]
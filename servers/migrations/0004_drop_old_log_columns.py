@@ -0,0 +1,49 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_log_session_uuids(apps, schema_editor):
+    ServerLog = apps.get_model('servers', 'ServerLog')
+    ServerLog.objects.exclude(session_uuid=None).update(session_id=models.F('session_uuid'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0003_compact_log_schema'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='serverlog',
+            name='message',
+        ),
+        migrations.AlterField(
+            model_name='serverlog',
+            name='template',
+            field=models.ForeignKey(
+                db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                related_name='+', to='servers.logmessage'
+            ),
+        ),
+
+        # ServerLog.session_id: indexed varchar(100) -> uuid linked to the connection
+        migrations.RemoveField(
+            model_name='serverlog',
+            name='session_id',
+        ),
+        migrations.AddField(
+            model_name='serverlog',
+            name='session',
+            field=models.ForeignKey(
+                blank=True, db_constraint=False, null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING, related_name='logs',
+                to='servers.serverconnection', to_field='session_id'
+            ),
+        ),
+        migrations.RunPython(copy_log_session_uuids),
+        migrations.RemoveField(
+            model_name='serverlog',
+            name='session_uuid',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0004_drop_old_log_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='serverlog',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_server_owners(apps, schema_editor):
+    """One UPDATE per owner, through the server_id index"""
+    Server = apps.get_model('servers', 'Server')
+    ServerLog = apps.get_model('servers', 'ServerLog')
+    owner_ids = Server.objects.exclude(created_by=None).order_by().values_list('created_by_id', flat=True).distinct()
+    for owner_id in owner_ids:
+        ServerLog.objects.filter(
+            server__in=Server.objects.filter(created_by_id=owner_id)
+        ).update(owner_id=owner_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('servers', '0005_serverlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverlog',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_server_owners, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='serverlog',
+            index=models.Index(fields=['server', '-timestamp', '-id'], name='servers_ser_server__a6fb8c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serverlog',
+            index=models.Index(fields=['owner', '-timestamp', '-id'], name='servers_ser_owner_i_158e70_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='serverlog',
+            name='servers_ser_server__de8eb3_idx',
+        ),
+    ]
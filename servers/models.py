@@ -1,10 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from cryptography.fernet import Fernet
 from django.conf import settings
+from django.utils import timezone
 import base64
+import hashlib
 import os
+import uuid
 
 class ServerGroup(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -154,7 +157,7 @@ class ServerConnection(models.Model):
     """Track active connections to servers"""
     server = models.ForeignKey(Server, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    session_id = models.CharField(max_length=100, unique=True)
+    session_id = models.UUIDField(default=uuid.uuid4, unique=True)
     connected_at = models.DateTimeField(auto_now_add=True, db_index=True)
     last_activity = models.DateTimeField(auto_now=True, db_index=True)
     is_active = models.BooleanField(default=True, db_index=True)
@@ -170,6 +173,46 @@ class ServerConnection(models.Model):
     def __str__(self):
         return f"{self.user.username} -> {self.server.name} ({self.session_id})"
 
+class LogMessageManager(models.Manager):
+    # Process-wide digest -> id map, message texts are few and never change
+    _ids = {}
+    MAX_CACHED = 10000
+
+    def intern(self, text):
+        """Return the id of the LogMessage holding ``text``, creating it once"""
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        message_id = self._ids.get(digest)
+        if message_id is None:
+            message_id = self.get_or_create(digest=digest, defaults={'text': text})[0].pk
+            if len(self._ids) >= self.MAX_CACHED:
+                self._ids.clear()
+            # A row created inside a transaction only exists once it commits
+            transaction.on_commit(lambda: self._ids.__setitem__(digest, message_id))
+        return message_id
+
+class LogMessage(models.Model):
+    """Log message text stored once and shared by every log row using it.
+
+    Text with ``{name}`` placeholders is a template filled from the log
+    row's ``args``.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    text = models.TextField()
+
+    objects = LogMessageManager()
+
+    def __str__(self):
+        return self.text
+
+def render_log_message(text, args):
+    """Fill a message template with a log row's arguments"""
+    if not args:
+        return text
+    try:
+        return text.format(**args)
+    except (KeyError, IndexError, ValueError):
+        return text
+
 class ServerLog(models.Model):
     """Log server activities and commands"""
     LOG_TYPES = [
@@ -180,16 +223,37 @@ class ServerLog(models.Model):
     ]
     
     server = models.ForeignKey(Server, on_delete=models.CASCADE)
+    # Copy of server.created_by, so a user's activity across all their
+    # servers reads in timestamp order from one index instead of being
+    # sorted after a join
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, db_index=False, related_name='+'
+    )
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     log_type = models.CharField(max_length=20, choices=LOG_TYPES, db_index=True)
-    message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
-    session_id = models.CharField(max_length=100, blank=True, db_index=True)
+    # Never filtered on, so no index on the hot table
+    template = models.ForeignKey(LogMessage, on_delete=models.PROTECT, db_index=False, related_name='+')
+    args = models.JSONField(null=True, blank=True)
+    # Set when the event happens, not when a buffered batch is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    # Stores the connection's UUID. No database constraint and no cascade, so
+    # logs keep their session id after the connection row is archived
+    session = models.ForeignKey(
+        ServerConnection,
+        to_field='session_id',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='logs'
+    )
     
     class Meta:
         ordering = ['-timestamp']
         indexes = [
-            models.Index(fields=['server', '-timestamp']),
+            # Ending in id matches the keyset ordering, so pages need no sort
+            models.Index(fields=['server', '-timestamp', '-id']),
+            models.Index(fields=['owner', '-timestamp', '-id']),
             models.Index(fields=['user', '-timestamp']),
             models.Index(fields=['log_type', '-timestamp']),
             models.Index(fields=['server', 'log_type', '-timestamp']),
@@ -198,4 +262,20 @@ class ServerLog(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.server.name} - {self.log_type} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.server.name} - {self.log_type} - {self.timestamp}"
+
+    def save(self, *args, **kwargs):
+        if self.owner_id is None and self.server_id is not None:
+            self.owner_id = self.server.created_by_id
+        super().save(*args, **kwargs)
+
+    @property
+    def message(self):
+        """Message text, filled from ``args`` when the template has placeholders"""
+        return render_log_message(self.template.text, self.args)
+
+    @message.setter
+    def message(self, text):
+        # Lets ServerLog(message=...) keep working, the text is stored as-is
+        self.template_id = LogMessage.objects.intern(text)
+        self.args = None
\ No newline at end of file
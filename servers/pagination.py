@@ -0,0 +1,172 @@
+import base64
+import json
+from datetime import datetime
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.dateparse import parse_datetime
+
+CURSOR_AFTER = 'after'
+CURSOR_BEFORE = 'before'
+
+
+def encode_cursor(values):
+    """Encode ordering values into an opaque URL-safe cursor"""
+    payload = [
+        {'dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into ordering values, or None if it is invalid"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, list):
+        return None
+    values = []
+    for value in payload:
+        if isinstance(value, dict):
+            value = parse_datetime(value.get('dt') or '')
+            if value is None:
+                return None
+        values.append(value)
+    return values
+
+
+def capped_count(queryset, cap=10000):
+    """Count rows up to a cap so large tables never pay for a full COUNT(*).
+
+    Returns a (count, is_capped) tuple.
+    """
+    count = queryset[:cap + 1].count()
+    return min(count, cap), count > cap
+
+
+class KeysetPage:
+    """One page of keyset paginated results with next/previous cursors"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, params=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_query = self._build_query(params, CURSOR_AFTER, next_cursor)
+        self.previous_query = self._build_query(params, CURSOR_BEFORE, previous_cursor)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @staticmethod
+    def _build_query(params, name, cursor):
+        if cursor is None:
+            return ''
+        query = params.copy() if params is not None else QueryDict(mutable=True)
+        for key in (CURSOR_AFTER, CURSOR_BEFORE, 'page'):
+            query.pop(key, None)
+        query[name] = cursor
+        return query.urlencode()
+
+
+def _seek_filter(fields, values, forward):
+    """Build the WHERE clause that seeks past a row in the given ordering.
+
+    For ordering (a, b) this is ``a >= x AND (a > x OR (a = x AND b > y))``,
+    with the comparisons flipped for descending fields and for backward
+    paging. The leading ``a >= x`` is redundant, but unlike the OR it can
+    bound an index range scan that is already in the page's order, so the
+    database reads one page of rows instead of sorting everything past
+    the cursor.
+    """
+    first = fields[0]
+    bound = 'lte' if first.startswith('-') == forward else 'gte'
+    condition = Q()
+    for i, field in enumerate(fields):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            clause &= Q(**{prev_field.lstrip('-'): prev_value})
+        condition |= clause
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+
+def _coerce_cursor(model, ordering, values):
+    """Convert decoded cursor values to their fields' types, or None if any doesn't fit.
+
+    Cursors come from the URL, so a well-formed one can still carry values
+    the database would reject, e.g. a string in place of the id.
+    """
+    if values is None or len(values) != len(ordering):
+        return None
+    coerced = []
+    for field, value in zip(ordering, values):
+        try:
+            value = model._meta.get_field(field.lstrip('-')).to_python(value)
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            return None
+        if value is None:
+            return None
+        coerced.append(value)
+    return coerced
+
+
+def _reverse_field(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def keyset_paginate(queryset, ordering, params, per_page=50):
+    """Paginate a queryset by seeking on an indexed ordering instead of OFFSET.
+
+    ``ordering`` must end in a unique field (normally ``id``) so every row has
+    a distinct position. The cursor is read from the ``after``/``before``
+    request parameters, so page N costs the same as page 1.
+    """
+    model = queryset.model
+    after = _coerce_cursor(model, ordering, decode_cursor(params.get(CURSOR_AFTER)))
+    before = None
+    if after is None:
+        before = _coerce_cursor(model, ordering, decode_cursor(params.get(CURSOR_BEFORE)))
+    names = [field.lstrip('-') for field in ordering]
+
+    def position(obj):
+        return [getattr(obj, name) for name in names]
+
+    if before is not None:
+        rows = list(
+            queryset.filter(_seek_filter(ordering, before, forward=False))
+            .order_by(*[_reverse_field(field) for field in ordering])[:per_page + 1]
+        )
+        has_more_before = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        previous_cursor = encode_cursor(position(rows[0])) if rows and has_more_before else None
+        next_cursor = encode_cursor(position(rows[-1])) if rows else None
+    else:
+        if after is not None:
+            queryset = queryset.filter(_seek_filter(ordering, after, forward=True))
+        rows = list(queryset.order_by(*ordering)[:per_page + 1])
+        has_more_after = len(rows) > per_page
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(position(rows[-1])) if rows and has_more_after else None
+        previous_cursor = encode_cursor(position(rows[0])) if rows and after is not None else None
+
+    return KeysetPage(rows, next_cursor, previous_cursor, params)
@@ -0,0 +1,338 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import accumulate
+from datetime import timedelta
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Server, ServerGroup, ServerConnection, ServerLog, LogMessage
+from .cache import invalidate_users
+from .inventory import invalidate_inventory
+
+# Seeded fleet-sized datasets for benchmarks and query plan checks. Every
+# row belongs to a user named "<prefix>-user-<n>", so a dataset can be
+# removed again with clear(). Rows are written in bulk, which skips model
+# signals, so the users' caches are invalidated at the end.
+
+PASSWORD = 'scale-test'
+
+ENVIRONMENTS = ['prod', 'staging', 'dev', 'qa']
+ROLES = ['web', 'api', 'db', 'cache', 'queue', 'worker', 'lb', 'search', 'batch', 'monitor']
+REGIONS = ['us-east', 'us-west', 'eu-central', 'eu-west', 'ap-south']
+GROUP_COLORS = ['#007bff', '#28a745', '#dc3545', '#ffc107', '#17a2b8', '#6f42c1', '#fd7e14']
+TAGS = ['linux', 'ubuntu', 'debian', 'rhel', 'docker', 'k8s', 'critical', 'legacy', 'gpu', 'backup']
+
+# (value, weight)
+STATUSES = [('online', 80), ('offline', 10), ('error', 5), ('unknown', 5)]
+AUTH_METHODS = [('password', 60), ('key', 30), ('key_password', 10)]
+LOG_TYPES = [('command', 70), ('connection', 20), ('status', 6), ('error', 4)]
+
+# Message templates per log type, with the args each can be filled with
+COMMANDS = [
+    'ls -la', 'uptime', 'df -h', 'free -m', 'systemctl status nginx', 'tail -n 100 /var/log/syslog',
+    'docker ps', 'top -bn1', 'journalctl -u app --since today', 'git pull', 'sudo apt update',
+]
+LOG_MESSAGES = {
+    'command': [
+        ('Command executed: {command}', [{'command': command} for command in COMMANDS]),
+    ],
+    'connection': [
+        ('Connected to terminal', [None]),
+        ('Disconnected from terminal', [None]),
+        ('Connection test: {status}', [{'status': 'success'}, {'status': 'success'}, {'status': 'failed'}]),
+    ],
+    'status': [
+        ('Status changed from {old} to {new}', [
+            {'old': old, 'new': new}
+            for old in ('online', 'offline', 'error') for new in ('online', 'offline', 'error') if old != new
+        ]),
+    ],
+    'error': [
+        ('SSH error: {error}', [
+            {'error': error}
+            for error in ('Authentication failed', 'Connection timeout', 'Connection refused', 'Host key mismatch')
+        ]),
+    ],
+}
+
+# SQLite page cache while loading logs, in KiB
+BULK_LOAD_CACHE_KIB = 512 * 1024
+
+LOG_COLUMNS = ['server', 'owner', 'user', 'log_type', 'template', 'args', 'timestamp', 'session']
+
+
+def insert_rows(model, field_names, rows):
+    """INSERT rows of database-ready values for ``field_names`` of ``model``"""
+    fields = [model._meta.get_field(name) for name in field_names]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    row_sql = f'({", ".join(["%s"] * len(fields))})'
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # sqlite3's executemany loops in C, nothing beats it there
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES {row_sql}', rows)
+            return
+        per_statement = connection.ops.bulk_batch_size(fields, rows)
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {", ".join([row_sql] * len(chunk))}',
+                [value for row in chunk for value in row],
+            )
+
+
+@contextmanager
+def bulk_load():
+    """Give SQLite a page cache big enough for the log table's indexes while loading"""
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA cache_size')
+        previous = cursor.fetchone()[0]
+        cursor.execute(f'PRAGMA cache_size = {-BULK_LOAD_CACHE_KIB}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA cache_size = {previous}')
+
+
+def weighted(rng, choices, k):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights, k=k)
+
+
+class FleetGenerator:
+    """Writes a reproducible fleet: users, groups, servers, connections and logs.
+    
+    The same ``seed`` and sizes give the same names, credentials and log
+    mix every time. ``progress(message)`` is called as each part is done.
+    """
+    
+    def __init__(self, prefix='scale', seed=42, batch_size=5000, progress=None):
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress or (lambda message: None)
+        self.now = timezone.now()
+    
+    def generate(self, users=10, groups=200, servers=10000, connections=20000, logs=1000000, days=90):
+        """Write the whole dataset and return the number of rows of each kind"""
+        started = time.perf_counter()
+        user_objs = self.create_users(users)
+        group_objs = self.create_groups(user_objs, groups)
+        server_objs = self.create_servers(user_objs, group_objs, servers)
+        connection_objs = self.create_connections(server_objs, connections, days)
+        log_count = self.create_logs(server_objs, connection_objs, logs, days)
+        self.invalidate(user_objs)
+        return {
+            'users': len(user_objs),
+            'groups': len(group_objs),
+            'servers': len(server_objs),
+            'connections': len(connection_objs),
+            'logs': log_count,
+            'seconds': round(time.perf_counter() - started, 1),
+        }
+    
+    def clear(self):
+        """Delete every user of this prefix, and with them all their rows"""
+        deleted, _ = User.objects.filter(username__startswith=f'{self.prefix}-user-').delete()
+        return deleted
+    
+    def create_users(self, count):
+        # One hash for everyone, hashing is deliberately slow
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create([
+            User(
+                username=f'{self.prefix}-user-{index}',
+                email=f'{self.prefix}-user-{index}@example.com',
+                password=password,
+            )
+            for index in range(count)
+        ], batch_size=self.batch_size)
+        self.progress(f'{len(users)} users')
+        return users
+    
+    def create_groups(self, users, count):
+        groups = []
+        for index in range(count):
+            owner = users[index % len(users)]
+            env, role, region = (
+                self.rng.choice(ENVIRONMENTS), self.rng.choice(ROLES), self.rng.choice(REGIONS)
+            )
+            groups.append(ServerGroup(
+                name=f'{self.prefix}-{env}-{role}-{region}-{index}',
+                description=f'{env.title()} {role} servers in {region}',
+                color=self.rng.choice(GROUP_COLORS),
+                created_by=owner,
+            ))
+        groups = ServerGroup.objects.bulk_create(groups, batch_size=self.batch_size)
+        self.progress(f'{len(groups)} groups')
+        return groups
+    
+    def create_servers(self, users, groups, count):
+        groups_by_owner = {}
+        for group in groups:
+            groups_by_owner.setdefault(group.created_by_id, []).append(group)
+        keys = [self.private_key() for _ in range(4)]
+        statuses = weighted(self.rng, STATUSES, count)
+        auth_methods = weighted(self.rng, AUTH_METHODS, count)
+        
+        servers = []
+        for index in range(count):
+            owner = users[index % len(users)]
+            owner_groups = groups_by_owner.get(owner.id)
+            env, role, region = (
+                self.rng.choice(ENVIRONMENTS), self.rng.choice(ROLES), self.rng.choice(REGIONS)
+            )
+            server = Server(
+                name=f'{role}-{env}-{index:05d}',
+                hostname=f'{role}-{index:05d}.{region}.{env}.{self.prefix}.example.com',
+                port=22 if self.rng.random() < 0.9 else self.rng.choice([2222, 2200, 8022]),
+                username=self.rng.choice(['root', 'ubuntu', 'deploy', 'admin', 'ec2-user']),
+                auth_method=auth_methods[index],
+                description=f'{env} {role} node in {region}',
+                # One server in ten is left ungrouped
+                group=self.rng.choice(owner_groups) if owner_groups and self.rng.random() < 0.9 else None,
+                tags=', '.join(self.rng.sample(TAGS, self.rng.randint(0, 3))),
+                status=statuses[index],
+                last_checked=self.now - timedelta(seconds=self.rng.randint(0, 86400)),
+                last_error='Connection timeout' if statuses[index] == 'error' else '',
+                created_by=owner,
+                timeout=self.rng.choice([10, 30, 60]),
+            )
+            if server.auth_method == 'password':
+                server.set_password(self.rng.randbytes(12).hex())
+            else:
+                server.set_private_key(self.rng.choice(keys))
+                if server.auth_method == 'key_password':
+                    server.set_key_password(self.rng.randbytes(8).hex())
+            servers.append(server)
+            if len(servers) % 1000 == 0:
+                self.progress(f'{len(servers)} servers encrypted')
+        
+        with transaction.atomic():
+            servers = Server.objects.bulk_create(servers, batch_size=self.batch_size)
+        self.progress(f'{len(servers)} servers')
+        return servers
+    
+    def private_key(self):
+        """An OpenSSH Ed25519 key drawn from the seed, the format the terminal consumer loads"""
+        key = ed25519.Ed25519PrivateKey.from_private_bytes(self.rng.randbytes(32))
+        return key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.OpenSSH,
+            serialization.NoEncryption(),
+        ).decode()
+    
+    def create_connections(self, servers, count, days):
+        if not servers:
+            return []
+        sessions, connected_times = [], []
+        for _ in range(count):
+            server = self.rng.choice(servers)
+            connected_at = self.now - timedelta(seconds=self.rng.randint(0, days * 86400))
+            connected_times.append(connected_at)
+            sessions.append(ServerConnection(
+                server=server,
+                user_id=server.created_by_id,
+                session_id=uuid.UUID(int=self.rng.getrandbits(128), version=4),
+                # Only a handful of recent sessions are still open
+                is_active=connected_at > self.now - timedelta(hours=1) and self.rng.random() < 0.5,
+            ))
+        
+        with transaction.atomic():
+            sessions = ServerConnection.objects.bulk_create(sessions, batch_size=self.batch_size)
+            # auto_now_add overrides connected_at on create, bulk_update doesn't
+            for session, connected_at in zip(sessions, connected_times):
+                session.connected_at = connected_at
+                session.last_activity = connected_at + timedelta(seconds=self.rng.randint(5, 3600))
+            ServerConnection.objects.bulk_update(
+                sessions, ['connected_at', 'last_activity'], batch_size=1000
+            )
+        self.progress(f'{len(sessions)} connections')
+        return sessions
+    
+    def create_logs(self, servers, sessions, count, days):
+        """Logs spread over the last ``days`` days, written oldest first"""
+        if not servers:
+            return 0
+        # (template id, args ready for the database) per log type
+        prep_args = ServerLog._meta.get_field('args').get_db_prep_save
+        templates = {
+            log_type: [
+                (LogMessage.objects.intern(text), args and prep_args(args, connection))
+                for text, options in messages for args in options
+            ]
+            for log_type, messages in LOG_MESSAGES.items()
+        }
+        sessions_by_server = {}
+        for session in sessions:
+            sessions_by_server.setdefault(session.server_id, []).append(session.session_id)
+        # A few busy servers get most of the traffic, like a real fleet
+        cum_weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(servers))))
+        span = days * 86400
+        step = span / count if count else 0
+        
+        # Values are converted for the database here, once per row, and go
+        # straight to insert_rows: bulk_create's per-field preparation tops
+        # out around ten thousand rows a second
+        prep_session = ServerLog._meta.get_field('session').target_field.get_db_prep_save
+        session_values = {
+            server_id: [prep_session(session_id, connection) for session_id in session_ids]
+            for server_id, session_ids in sessions_by_server.items()
+        }
+        
+        written = 0
+        started = time.perf_counter()
+        with bulk_load():
+            while written < count:
+                # Commit every 20 batches, smaller transactions spend their time syncing
+                with transaction.atomic():
+                    for _ in range(20):
+                        if written >= count:
+                            break
+                        size = min(self.batch_size, count - written)
+                        insert_rows(ServerLog, LOG_COLUMNS, self.log_rows(
+                            servers, cum_weights, templates, session_values, size,
+                            start=self.now - timedelta(seconds=span), offset=written, step=step,
+                        ))
+                        written += size
+                rate = written / (time.perf_counter() - started)
+                self.progress(f'{written} logs ({rate:,.0f} rows/s)')
+        return written
+    
+    def log_rows(self, servers, cum_weights, templates, session_values, size, start, offset, step):
+        """One batch of log rows as tuples of LOG_COLUMNS values"""
+        adapt_datetime = connection.ops.adapt_datetimefield_value
+        picked = self.rng.choices(servers, cum_weights=cum_weights, k=size)
+        log_types = weighted(self.rng, LOG_TYPES, size)
+        rows = []
+        for index in range(size):
+            server = picked[index]
+            log_type = log_types[index]
+            template_id, args = self.rng.choice(templates[log_type])
+            sessions = session_values.get(server.id)
+            rows.append((
+                server.id,
+                server.created_by_id,
+                server.created_by_id,
+                log_type,
+                template_id,
+                args,
+                adapt_datetime(start + timedelta(seconds=(offset + index) * step)),
+                self.rng.choice(sessions) if sessions and log_type != 'status' else None,
+            ))
+        return rows
+    
+    def invalidate(self, users):
+        """Retire cached pages and snapshots, bulk writes skip the model signals"""
+        invalidate_users([user.id for user in users], 'servers', 'groups', 'connections', 'logs')
+        for user in users:
+            invalidate_inventory(user.id)
@@ -0,0 +1,61 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Server, ServerGroup, ServerConnection, ServerLog
+from .cache import invalidate_users
+from . import inventory
+
+# Dependency tag touched by writes to each model
+MODEL_TAGS = {
+    Server: 'servers',
+    ServerGroup: 'groups',
+    ServerConnection: 'connections',
+    ServerLog: 'logs',
+}
+
+
+@receiver([post_save, post_delete], sender=Server)
+@receiver([post_save, post_delete], sender=ServerGroup)
+def invalidate_owner_cache(sender, instance, **kwargs):
+    """Drop cached pages for the owner of a changed server or group"""
+    names = [MODEL_TAGS[sender]]
+    if sender is ServerGroup:
+        # Server listings show their group
+        names.append('servers')
+    invalidate_users([instance.created_by_id], *names)
+
+
+@receiver(post_save, sender=Server)
+def update_inventory_server(sender, instance, **kwargs):
+    """Patch the owner's inventory snapshot with the saved server"""
+    inventory.server_saved(instance)
+
+
+@receiver(post_delete, sender=Server)
+def remove_inventory_server(sender, instance, **kwargs):
+    """Drop a deleted server from the owner's inventory snapshot"""
+    inventory.server_deleted(instance)
+
+
+@receiver(post_save, sender=ServerGroup)
+def update_inventory_group(sender, instance, **kwargs):
+    """Patch the owner's inventory snapshot with the saved group"""
+    inventory.group_saved(instance)
+
+
+@receiver(post_delete, sender=ServerGroup)
+def remove_inventory_group(sender, instance, **kwargs):
+    """Drop a deleted group, and its membership, from the owner's snapshot"""
+    inventory.group_deleted(instance)
+
+
+# Only post_save here: a delete receiver on these models would stop Django
+# from fast-deleting them when a server is removed, and the server's own
+# post_delete already covers that case
+@receiver(post_save, sender=ServerConnection)
+@receiver(post_save, sender=ServerLog)
+def invalidate_activity_cache(sender, instance, **kwargs):
+    """Drop cached pages for the acting user and the server owner"""
+    user_ids = {instance.user_id} if instance.user_id else set()
+    if sender._meta.get_field('server').is_cached(instance):
+        user_ids.add(instance.server.created_by_id)
+    invalidate_users(user_ids, MODEL_TAGS[sender])
@@ -0,0 +1,123 @@
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .models import Server
+from .cache import invalidate_users
+from . import inventory
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = ['status', 'last_checked', 'last_error']
+
+
+class StatusWriter:
+    """Coalesces server status changes from probes and terminals.
+
+    Only ``status``, ``last_checked`` and ``last_error`` are written, never
+    the whole row. A check that finds nothing new is dropped while the last
+    stored check is younger than ``freshness``, and changes recorded within
+    ``delay`` seconds of each other are written with one ``bulk_update``.
+    """
+
+    def __init__(self, freshness=None, delay=None, max_batch=500):
+        self.freshness = timedelta(seconds=(
+            freshness if freshness is not None
+            else getattr(settings, 'SERVER_STATUS_FRESHNESS', 60)
+        ))
+        self.delay = delay if delay is not None else getattr(settings, 'SERVER_STATUS_FLUSH_DELAY', 0.5)
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = {}
+        # Last state written by this process per server. Other processes may
+        # have written since, so a dropped check can leave a status stale
+        # for at most ``freshness``
+        self._stored = {}
+        self._timer = None
+
+    def record(self, server, status, error='', flush=False):
+        """Record the outcome of a check on ``server``.
+
+        The instance is updated in place either way. Returns False when the
+        check was dropped as a duplicate of a fresh stored state.
+        """
+        now = timezone.now()
+        error = error or ''
+        previous = (server.status, server.last_error, server.last_checked)
+        server.status = status
+        server.last_error = error
+        server.last_checked = now
+        if server.pk is None:
+            # Unsaved servers (e.g. testing an edit form) have no row to update
+            return False
+
+        with self._lock:
+            stored_status, stored_error, stored_at = self._stored.get(server.pk, previous)
+            if (
+                server.pk not in self._pending
+                and stored_status == status
+                and stored_error == error
+                and stored_at is not None
+                and now - stored_at < self.freshness
+            ):
+                return False
+            self._pending[server.pk] = (server.created_by_id, status, error, now)
+            self._stored[server.pk] = (status, error, now)
+            flush = flush or len(self._pending) >= self.max_batch
+            if not flush and self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush_quietly)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if flush:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write every pending change, returns the number of servers updated"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        servers = [
+            Server(pk=pk, status=status, last_error=error, last_checked=checked)
+            for pk, (_, status, error, checked) in pending.items()
+        ]
+        Server.objects.bulk_update(servers, STATUS_FIELDS, batch_size=self.max_batch)
+
+        changes = {}
+        for pk, (owner_id, status, error, _) in pending.items():
+            changes.setdefault(owner_id, {})[pk] = {'status': status}
+        invalidate_users(changes, 'servers')
+        for owner_id, owner_changes in changes.items():
+            inventory.servers_changed(owner_id, owner_changes)
+        return len(servers)
+
+    def flush_quietly(self):
+        """Flush from a timer thread or at exit, logging instead of raising"""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to write server status updates')
+        finally:
+            # Every timer is a new thread with its own connection, which
+            # close_old_connections keeps open under CONN_MAX_AGE
+            connections.close_all()
+
+
+status_writer = StatusWriter()
+
+# Don't lose a pending batch when the process exits
+atexit.register(status_writer.flush_quietly)
+
+
+def record_server_status(server, status, error='', flush=False):
+    """Record a status check through the shared writer"""
+    return status_writer.record(server, status, error, flush=flush)
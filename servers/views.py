@@ -2,21 +2,24 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.core.paginator import Paginator
 from django.db.models import Q
 from django.views.decorators.http import require_http_methods
-from django.utils import timezone
 import paramiko
 import socket
 import threading
 import json
 from .models import Server, ServerGroup, ServerLog
 from .forms import ServerForm, ServerGroupForm, ServerTestForm, ServerSearchForm
+from .pagination import keyset_paginate, capped_count
+from .inventory import get_inventory
+from .status import record_server_status
+from .logs import write_log
 
 @login_required
 def server_list(request):
     """List all servers with search and filtering"""
-    search_form = ServerSearchForm(request.GET, user=request.user)
+    inventory = get_inventory(request.user)
+    search_form = ServerSearchForm(request.GET, user=request.user, inventory=inventory)
     servers = Server.objects.filter(created_by=request.user)
     
     # Apply filters
@@ -42,15 +45,18 @@ def server_list(request):
         if tags:
             servers = servers.filter(tags__icontains=tags)
     
-    # Pagination
-    paginator = Paginator(servers, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination on (name, id), no OFFSET scans on deep pages
+    page_obj = keyset_paginate(
+        servers.select_related('group'), ['name', 'id'], request.GET, per_page=12
+    )
+    total_servers, total_is_estimate = capped_count(servers)
     
     context = {
         'page_obj': page_obj,
         'search_form': search_form,
-        'total_servers': servers.count(),
+        'groups': inventory.groups,
+        'total_servers': total_servers,
+        'total_is_estimate': total_is_estimate,
     }
     return render(request, 'servers/list.html', context)
 
@@ -58,7 +64,7 @@ def server_list(request):
 def server_detail(request, pk):
     """Show server details"""
     server = get_object_or_404(Server, pk=pk, created_by=request.user)
-    recent_logs = ServerLog.objects.filter(server=server)[:10]
+    recent_logs = ServerLog.objects.filter(server=server).select_related('user', 'template')[:10]
     
     
     context = {
@@ -152,11 +158,9 @@ def server_test(request, pk):
             result = test_server_connection(temp_server)
             
             # Log the test
-            ServerLog.objects.create(
-                server=server,
-                user=request.user,
-                log_type='connection',
-                message=f'Connection test from edit page: {result["status"]}'
+            write_log(
+                server, 'connection', 'Connection test from edit page: {status}',
+                {'status': result['status']}, user=request.user
             )
             
             return JsonResponse({
@@ -173,11 +177,9 @@ def server_test(request, pk):
                 result = test_server_connection(server, test_command)
                 
                 # Log the test
-                ServerLog.objects.create(
-                    server=server,
-                    user=request.user,
-                    log_type='connection',
-                    message=f'Connection test: {result["status"]}'
+                write_log(
+                    server, 'connection', 'Connection test: {status}',
+                    {'status': result['status']}, user=request.user
                 )
                 
                 return JsonResponse(result)
@@ -222,7 +224,7 @@ def test_server_connection(server, command='whoami'):
                     'status': 'error',
                     'message': 'SSH key is missing. Please edit the server and add a private key.'
                 }
-                
+
             private_key_file = StringIO(private_key_str)
             
             try:
@@ -267,10 +269,7 @@ def test_server_connection(server, command='whoami'):
         client.close()
         
         # Update server status
-        server.status = 'online'
-        server.last_checked = timezone.now()
-        server.last_error = ''
-        server.save()
+        record_server_status(server, 'online', flush=True)
         
         return {
             'status': 'success',
@@ -278,29 +277,20 @@ def test_server_connection(server, command='whoami'):
             'output': output,
             'error': error if error else None
         }
-        
+
     except paramiko.AuthenticationException:
         error_msg = 'Authentication failed'
-        server.status = 'error'
-        server.last_error = error_msg
-        server.last_checked = timezone.now()
-        server.save()
+        record_server_status(server, 'error', error_msg, flush=True)
         return {'status': 'error', 'message': error_msg}
-        
+
     except socket.timeout:
         error_msg = 'Connection timeout'
-        server.status = 'offline'
-        server.last_error = error_msg
-        server.last_checked = timezone.now()
-        server.save()
+        record_server_status(server, 'offline', error_msg, flush=True)
         return {'status': 'error', 'message': error_msg}
-        
+
     except Exception as e:
         error_msg = f'Connection failed: {str(e)}'
-        server.status = 'error'
-        server.last_error = error_msg
-        server.last_checked = timezone.now()
-        server.save()
+        record_server_status(server, 'error', error_msg, flush=True)
         return {'status': 'error', 'message': error_msg}
 
 @login_required
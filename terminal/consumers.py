@@ -1,16 +1,33 @@
 import json
 import asyncio
+import logging
 import paramiko
 import threading
 import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from servers.models import Server, ServerConnection, ServerLog
+from servers.models import Server, ServerConnection
+from servers.status import record_server_status
+from servers.logs import write_log
+from .sessions import registry, session_group, SessionLimitReached, SSH_CONNECT_DURATION, PEER_DISCONNECTS
+from server_manager.loopmonitor import ensure_loop_monitor
+from .latency import latency_recorder
+from .sshpool import ssh_executor, send_all, SSHOperationTimeout
+from .scheduler import connect_scheduler
 from io import StringIO
 import socket
 import time
 
+logger = logging.getLogger(__name__)
+
+# Close code telling the browser not to retry right away
+SESSION_LIMIT_CLOSE_CODE = 4429
+# Close code for a session ended on purpose (closed from the sessions page or
+# reaped while idle), which the browser must not reopen
+SESSION_CLOSED_CLOSE_CODE = 4410
+
 class TerminalConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -21,10 +38,20 @@ class TerminalConsumer(AsyncWebsocketConsumer):
         self.session_id = None
         self.connection_obj = None
         self.read_thread = None
+        self.keepalive_task = None
         self.connected = False
         self.loop = None
+        self.live = None
+        self.start_task = None
+        # Set once the session's slots and connection record are released
+        self.ended = False
+        # Latency probe waiting for its first output byte, and the server
+        # side timings of recent probes until the browser reports its own
+        self.pending_probe = None
+        self.probe_timings = {}
 
     async def connect(self):
+        ensure_loop_monitor()
         self.server_id = self.scope['url_route']['kwargs']['server_id']
         self.user = self.scope['user']
         
@@ -38,10 +65,35 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
+        await self.accept()
+        
+        # Send initial message
+        await self.send(text_data=json.dumps({
+            'type': 'status',
+            'message': f'Connecting to {self.server.name}...'
+        }))
+        
+        # Wait for a session slot and connect over SSH in the background, so
+        # a queued client can still disconnect
+        self.start_task = asyncio.create_task(self.start_session())
+    
+    async def start_session(self):
+        """Get a session slot, record the session and open the SSH connection"""
+        try:
+            await registry.admit(self, self.user.id, self.server.id, self.send_queue_position)
+        except SessionLimitReached as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            await self.close(code=SESSION_LIMIT_CLOSE_CODE)
+            return
+        
         # Get or generate session ID
         if 'session_id' in self.scope['url_route']['kwargs']:
-            # Use existing session ID from URL
-            self.session_id = self.scope['url_route']['kwargs']['session_id']
+            # Use existing session ID from URL, in canonical form so it
+            # matches the channel group close_session sends to
+            self.session_id = str(uuid.UUID(self.scope['url_route']['kwargs']['session_id']))
             
             # Check if this session exists
             existing_connection = await self.get_connection_by_session_id(self.session_id)
@@ -58,64 +110,186 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             await self.create_connection_record()
         
         # Join room group
-        self.room_group_name = f'terminal_{self.server_id}_{self.session_id}'
+        self.room_group_name = session_group(self.server_id, self.session_id)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        await self.accept()
+        self.live = registry.register(self, self.connection_obj.pk, self.user.id, self.session_id)
         
-        # Send initial message
+        # Wait for a connect slot, so a reconnect storm logs in a few at a time
+        try:
+            try:
+                await connect_scheduler.acquire(
+                    self, self.user.id, self.server.hostname.lower(), self.send_connect_position
+                )
+            except SessionLimitReached as e:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': str(e)
+                }))
+                await self.close(code=SESSION_LIMIT_CLOSE_CODE)
+                return
+            await self.connect_ssh()
+        finally:
+            connect_scheduler.release(self)
+    
+    async def send_queue_position(self, position, limit):
         await self.send(text_data=json.dumps({
-            'type': 'status',
-            'message': f'Connecting to {self.server.name}...'
+            'type': 'queued',
+            'position': position,
+            'message': f'Session limit reached for {limit}, waiting for a free slot (position {position})'
         }))
-        
-        # Start SSH connection in background
-        asyncio.create_task(self.connect_ssh())
 
+    async def send_connect_position(self, position, host):
+        await self.send(text_data=json.dumps({
+            'type': 'queued',
+            'position': position,
+            'message': f'Waiting to connect to {host} (position {position})'
+        }))
+    
     async def disconnect(self, close_code):
-        # Clean up SSH connection
+        # Stop waiting for a session or connect slot, or abandon the login.
+        # A connect already running is closed when paramiko returns
+        if self.start_task and not self.connected and not self.start_task.done():
+            self.start_task.cancel()
+        connect_scheduler.release(self)
+        
+        # Clean up SSH connection, unless terminate() already did
+        ended_here = await self.end_session()
+        
+        # Leave room group
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
+        
+        # Log disconnection
+        if ended_here and self.connection_obj:
+            await self.log_activity('connection', 'Disconnected from terminal')
+
+    async def close_ssh(self):
+        """Close the SSH channel and transport, stopping the read thread and keepalives"""
+        self.connected = False
+        if self.keepalive_task and self.keepalive_task is not asyncio.current_task():
+            self.keepalive_task.cancel()
+        if self.ssh_channel or self.ssh_client:
+            try:
+                await ssh_executor.run('close', self.close_transport)
+            except SSHOperationTimeout:
+                logger.warning('Closing the SSH connection of session %s timed out', self.session_id)
+    
+    def close_transport(self):
         if self.ssh_channel:
             try:
                 self.ssh_channel.close()
             except:
                 pass
-        
+
         if self.ssh_client:
             try:
                 self.ssh_client.close()
             except:
                 pass
+
+    async def end_session(self):
+        """Close SSH and release the session's slots and connection record.
         
-        # Update connection record
-        if self.connection_obj:
+        Runs once, returns False when the session had already ended.
+        """
+        if self.ended:
+            return False
+        self.ended = True
+        await self.close_ssh()
+        if self.live:
+            registry.unregister(self.session_id)
+            self.live = None
+        registry.release(self)
+        if self.connection_obj and self.connection_obj.is_active:
             await self.update_connection_record(False)
+        return True
+
+    async def terminate(self, message, message_type='status', code=SESSION_CLOSED_CLOSE_CODE,
+                        log_message='Disconnected: {message}'):
+        """Close the session from the server side: SSH first, then the WebSocket.
         
-        # Leave room group
-        if hasattr(self, 'room_group_name'):
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
+        ``code`` is the WebSocket close code, None for the default one the
+        browser reconnects after.
+        """
+        if not await self.end_session():
+            return
+        if self.connection_obj:
+            await self.log_activity('connection', log_message, {'message': message})
+        try:
+            await self.send(text_data=json.dumps({
+                'type': message_type,
+                'message': message
+            }))
+        except Exception:
+            pass
+        await self.close(code=code)
+
+    async def peer_lost(self, reason, message):
+        """The SSH side went away: release the session and tell the browser"""
+        if not self.connected:
+            return
+        PEER_DISCONNECTS.inc(reason=reason)
+        # The browser reconnects, the server may be back by then
+        await self.terminate(message, 'disconnect', code=None, log_message='Connection lost: {message}')
+    
+    async def keep_alive(self):
+        """Send SSH keepalives and drop the session when the peer stops answering.
         
-        # Log disconnection
-        if self.server:
-            await self.log_activity('connection', 'Disconnected from terminal')
+        Every interval a keepalive asking for a reply goes out. A peer that
+        doesn't answer within TERMINAL_KEEPALIVE_COUNT intervals is taken as
+        dead, so a session dropped by a NAT is released within
+        ``interval * (count + 1)`` seconds.
+        """
+        interval = getattr(settings, 'TERMINAL_KEEPALIVE_INTERVAL', 15)
+        count = getattr(settings, 'TERMINAL_KEEPALIVE_COUNT', 3)
+        transport = self.ssh_client.get_transport()
+        while self.connected:
+            await asyncio.sleep(interval)
+            if not self.connected:
+                return
+            try:
+                await ssh_executor.run(
+                    'keepalive', transport.global_request, 'keepalive@openssh.com', None, True,
+                    timeout=interval * count,
+                )
+            except SSHOperationTimeout:
+                await self.peer_lost('keepalive', f'No response from {self.server.name} for {interval * count:g}s')
+                return
+            if not transport.is_active():
+                await self.peer_lost('transport', f'Connection to {self.server.name} lost')
+                return
+    
+    async def session_close(self, event):
+        """Channel layer message sent by close_session"""
+        await self.terminate(event.get('message', 'Session closed'))
 
     async def receive(self, text_data):
+        received = time.perf_counter()
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
             
             if message_type == 'command':
                 command = data.get('data', '')
-                await self.send_command(command)
+                await self.send_command(command, data.get('probe'), received)
             elif message_type == 'resize':
                 cols = data.get('cols', 80)
                 rows = data.get('rows', 24)
                 await self.resize_terminal(cols, rows)
+            elif message_type == 'ping':
+                await self.send(text_data=json.dumps({
+                    'type': 'pong',
+                    'id': data.get('id')
+                }))
+            elif message_type == 'latency':
+                self.record_latency(data)
         except json.JSONDecodeError:
             await self.send(text_data=json.dumps({
                 'type': 'error',
@@ -141,49 +315,45 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             if self.server.auth_method == 'password':
                 connect_params['password'] = self.server.get_password()
             elif self.server.auth_method in ['key', 'key_password']:
-                private_key_str = self.server.get_private_key()
-                private_key_file = StringIO(private_key_str)
-                
                 try:
-                    if self.server.auth_method == 'key_password':
-                        key_password = self.server.get_key_password()
-                        private_key = paramiko.RSAKey.from_private_key(private_key_file, password=key_password)
-                    else:
-                        private_key = paramiko.RSAKey.from_private_key(private_key_file)
-                    connect_params['pkey'] = private_key
-                except Exception:
-                    try:
-                        private_key_file.seek(0)
-                        if self.server.auth_method == 'key_password':
-                            key_password = self.server.get_key_password()
-                            private_key = paramiko.Ed25519Key.from_private_key(private_key_file, password=key_password)
-                        else:
-                            private_key = paramiko.Ed25519Key.from_private_key(private_key_file)
-                        connect_params['pkey'] = private_key
-                    except Exception as e:
-                        await self.send(text_data=json.dumps({
-                            'type': 'error',
-                            'message': f'Invalid private key: {str(e)}'
-                        }))
-                        return
+                    connect_params['pkey'] = await ssh_executor.run('parse_key', self.load_private_key)
+                except Exception as e:
+                    await self.send(text_data=json.dumps({
+                        'type': 'error',
+                        'message': f'Invalid private key: {str(e)}'
+                    }))
+                    return
+            
+            # Connect. The socket, banner and auth steps each get the
+            # server's timeout, so the whole call is bounded by three of them
+            connect_params['banner_timeout'] = connect_params['auth_timeout'] = self.server.timeout
             
-            # Connect
             # Create a wrapper function to handle keyword arguments
             def connect_ssh_with_params():
                 return self.ssh_client.connect(**connect_params)
-                
-            await asyncio.get_event_loop().run_in_executor(
-                None, connect_ssh_with_params
-            )
+
+            started = time.perf_counter()
+            try:
+                await ssh_executor.run(
+                    'connect', connect_ssh_with_params,
+                    timeout=self.server.timeout * 3 + 1,
+                    cleanup=self.ssh_client.close,
+                )
+            except BaseException:
+                SSH_CONNECT_DURATION.observe(time.perf_counter() - started, outcome='error')
+                raise
+            SSH_CONNECT_DURATION.observe(time.perf_counter() - started, outcome='ok')
             
             # Create interactive shell
-            self.ssh_channel = self.ssh_client.invoke_shell(
-                term='xterm-256color',
-                width=80,
-                height=24
+            self.ssh_channel = await ssh_executor.run(
+                'open_shell', self.ssh_client.invoke_shell,
+                'xterm-256color', 80, 24,
+                cleanup=self.ssh_client.close,
             )
             
             self.connected = True
+            # The shell is open, let the next login start
+            connect_scheduler.release(self)
             
             # Send success message
             await self.send(text_data=json.dumps({
@@ -205,20 +375,23 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             self.read_thread.daemon = True
             self.read_thread.start()
             
+            if self.server.keep_alive:
+                self.keepalive_task = asyncio.create_task(self.keep_alive())
+
         except paramiko.AuthenticationException:
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': 'Authentication failed'
             }))
             await self.update_server_status('error', 'Authentication failed')
-            
-        except socket.timeout:
+
+        except (socket.timeout, SSHOperationTimeout):
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': 'Connection timeout'
             }))
             await self.update_server_status('offline', 'Connection timeout')
-            
+
         except Exception as e:
             await self.send(text_data=json.dumps({
                 'type': 'error',
@@ -226,6 +399,16 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             }))
             await self.update_server_status('error', str(e))
 
+    def load_private_key(self):
+        """Parse the server's private key, RSA first, then Ed25519"""
+        private_key_file = StringIO(self.server.get_private_key())
+        key_password = self.server.get_key_password() if self.server.auth_method == 'key_password' else None
+        try:
+            return paramiko.RSAKey.from_private_key(private_key_file, password=key_password)
+        except Exception:
+            private_key_file.seek(0)
+            return paramiko.Ed25519Key.from_private_key(private_key_file, password=key_password)
+    
     def read_ssh_output(self):
         """Read output from SSH channel and send to WebSocket"""
         while self.connected and self.ssh_channel:
@@ -233,13 +416,24 @@ class TerminalConsumer(AsyncWebsocketConsumer):
                 if self.ssh_channel.recv_ready():
                     data = self.ssh_channel.recv(1024)
                     if data:
+                        if self.live:
+                            self.live.touch(bytes_out=len(data))
+                        # The first output after a probed keystroke answers it
+                        probe, self.pending_probe = self.pending_probe, None
+                        if probe:
+                            probe['first_byte'] = time.perf_counter()
                         asyncio.run_coroutine_threadsafe(
-                            self.send(text_data=json.dumps({
-                                'type': 'output',
-                                'data': data.decode('utf-8', errors='ignore')
-                            })),
+                            self.send_output(data.decode('utf-8', errors='ignore'), probe),
                             self.loop
                         )
+                elif self.ssh_channel.closed or self.ssh_channel.eof_received:
+                    # Output is drained and the remote side is gone
+                    if self.ssh_channel.get_transport().is_active():
+                        reason, message = 'exit', 'Shell exited'
+                    else:
+                        reason, message = 'transport', f'Connection to {self.server.name} lost'
+                    asyncio.run_coroutine_threadsafe(self.peer_lost(reason, message), self.loop)
+                    break
                 else:
                     time.sleep(0.01)
             except Exception as e:
@@ -250,16 +444,68 @@ class TerminalConsumer(AsyncWebsocketConsumer):
                     })),
                     self.loop
                 )
+                asyncio.run_coroutine_threadsafe(self.peer_lost('transport', f'Read error: {str(e)}'), self.loop)
                 break
 
-    async def send_command(self, command):
-        """Send command to SSH channel"""
+    async def send_output(self, text, probe=None):
+        """Send SSH output to the browser, then the server side timings of a probe"""
+        await self.send(text_data=json.dumps({
+            'type': 'output',
+            'data': text
+        }))
+        if probe:
+            timings = {
+                'consumer': (probe['written'] - probe['received']) * 1000,
+                'ssh': (probe['first_byte'] - probe['written']) * 1000,
+                'relay': (time.perf_counter() - probe['first_byte']) * 1000,
+            }
+            self.probe_timings[probe['id']] = timings
+            while len(self.probe_timings) > 10:
+                self.probe_timings.pop(next(iter(self.probe_timings)))
+            await self.send(text_data=json.dumps({
+                'type': 'pong',
+                'probe': probe['id'],
+                'server': {segment: round(ms, 2) for segment, ms in timings.items()}
+            }))
+    
+    def record_latency(self, report):
+        """Combine the browser's timings for a probe with ours and record them"""
+        probe = report.get('probe')
+        # Looked up as a dict key, a list or object from the client would raise
+        if not isinstance(probe, (int, str)):
+            return
+        timings = self.probe_timings.pop(probe, None)
+        try:
+            round_trip = float(report['round_trip'])
+            render = float(report.get('render', 0))
+        except (KeyError, TypeError, ValueError):
+            return
+        segments = {'round_trip': round_trip, 'render': render}
+        if isinstance(report.get('websocket'), (int, float)):
+            segments['websocket'] = report['websocket']
+        if timings:
+            segments.update(timings)
+            segments['network'] = max(0.0, round_trip - render - sum(timings.values()))
+        latency_recorder.record(self.server.id, segments)
+    
+    async def send_command(self, command, probe=None, received=None):
+        """Send command to SSH channel, timing it when the browser marked it as a probe"""
         if self.ssh_channel and self.connected:
             try:
-                self.ssh_channel.send(command)
+                # Armed before writing: a fast echo can reach the read thread
+                # before send_all returns
+                if isinstance(probe, (int, str)) and received is not None:
+                    self.pending_probe = {
+                        'id': probe,
+                        'received': received,
+                        'written': time.perf_counter(),
+                    }
+                await send_all(self.ssh_channel, command.encode('utf-8'))
+                if self.live:
+                    self.live.touch(bytes_in=len(command))
                 # Log command if it's not just keystrokes
                 if command.strip() and command != '\r' and command != '\n':
-                    await self.log_activity('command', f'Executed: {command.strip()}')
+                    await self.log_activity('command', 'Executed: {command}', {'command': command.strip()})
             except Exception as e:
                 await self.send(text_data=json.dumps({
                     'type': 'error',
@@ -270,7 +516,7 @@ class TerminalConsumer(AsyncWebsocketConsumer):
         """Resize terminal"""
         if self.ssh_channel and self.connected:
             try:
-                self.ssh_channel.resize_pty(width=cols, height=rows)
+                await ssh_executor.run('resize', self.ssh_channel.resize_pty, cols, rows)
             except Exception as e:
                 await self.send(text_data=json.dumps({
                     'type': 'error',
@@ -316,23 +562,10 @@ class TerminalConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def update_server_status(self, status, error_message=''):
-        """Update server status"""
-        from django.utils import timezone
-        self.server.status = status
-        self.server.last_checked = timezone.now()
-        if error_message:
-            self.server.last_error = error_message
-        else:
-            self.server.last_error = ''
-        self.server.save()
+        """Update server status, coalesced with other connects into one bulk write"""
+        record_server_status(self.server, status, error_message)
 
     @database_sync_to_async
-    def log_activity(self, log_type, message):
-        """Log activity"""
-        ServerLog.objects.create(
-            server=self.server,
-            user=self.user,
-            log_type=log_type,
-            message=message,
-            session_id=self.session_id
-        )
\ No newline at end of file
+    def log_activity(self, log_type, message, args=None):
+        """Log activity, ``message`` is a template filled from ``args``"""
+        write_log(self.server, log_type, message, args, user=self.user, session_id=self.session_id)
\ No newline at end of file
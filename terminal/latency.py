@@ -0,0 +1,107 @@
+import os
+import socket
+import time
+from collections import deque
+from django.core.cache import cache
+
+# Keystroke latency split into the hops a probe passes through:
+#   network    browser -> daphne -> browser, the round trip minus the rest
+#   consumer   consumer receive -> write to the SSH channel starts
+#   ssh        SSH write starts -> first output byte seen by the read thread
+#              (this includes the write and the read thread's poll interval)
+#   relay      first output byte -> output frame sent by the consumer
+#   render     output frame received -> drawn by the browser
+#   round_trip browser keystroke -> echo drawn
+SEGMENTS = ('round_trip', 'network', 'consumer', 'ssh', 'relay', 'render', 'websocket')
+
+NODE = f'{socket.gethostname()}:{os.getpid()}'
+NODES_KEY = 'terminal_latency_nodes'
+NODE_KEY = 'terminal_latency_node_{}'
+# Nodes that stop publishing drop out after this long
+NODE_TTL = 600
+NODES_LOCK_KEY = 'terminal_latency_nodes_lock'
+LOCK_TIMEOUT = 5
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    
+    def pick(pct):
+        return round(samples[min(len(samples) - 1, int(pct / 100 * len(samples)))], 1)
+    return {'count': len(samples), 'p50': pick(50), 'p90': pick(90), 'p99': pick(99)}
+
+
+class LatencyRecorder:
+    """Recent latency samples per server for this process.
+    
+    Each segment keeps the last ``max_samples`` values. ``publish`` copies
+    them to the cache under this node's name so any process can report
+    percentiles across nodes.
+    """
+    
+    def __init__(self, max_samples=200):
+        self.max_samples = max_samples
+        self._samples = {}
+    
+    def record(self, server_id, segments):
+        server_samples = self._samples.setdefault(server_id, {})
+        for segment, value in segments.items():
+            if segment in SEGMENTS and isinstance(value, (int, float)) and 0 <= value < 600000:
+                server_samples.setdefault(segment, deque(maxlen=self.max_samples)).append(float(value))
+    
+    def snapshot(self):
+        return {
+            server_id: {segment: list(values) for segment, values in segments.items()}
+            for server_id, segments in list(self._samples.items())
+        }
+    
+    def publish(self):
+        """Share this node's samples through the cache"""
+        if not self._samples:
+            return
+        cache.set(NODE_KEY.format(NODE), self.snapshot(), NODE_TTL)
+        # The node list is read, changed and written back, so only one
+        # process may do that at a time
+        if not cache.add(NODES_LOCK_KEY, NODE, LOCK_TIMEOUT):
+            # Another node is updating it, this one is added on its next publish
+            return
+        try:
+            nodes = cache.get(NODES_KEY) or {}
+            now = time.time()
+            nodes = {node: seen for node, seen in nodes.items() if now - seen < NODE_TTL}
+            nodes[NODE] = now
+            cache.set(NODES_KEY, nodes, None)
+        finally:
+            cache.delete(NODES_LOCK_KEY)
+
+
+def latency_summary(server_ids=None):
+    """Percentiles per segment by server and by node, from every node's published samples.
+    
+    ``server_ids`` limits both views to those servers.
+    """
+    nodes = list((cache.get(NODES_KEY) or {}).keys())
+    published = cache.get_many([NODE_KEY.format(node) for node in nodes])
+    by_server, by_node = {}, {}
+    for node in nodes:
+        samples = published.get(NODE_KEY.format(node))
+        if not samples:
+            continue
+        for server_id, segments in samples.items():
+            if server_ids is not None and server_id not in server_ids:
+                continue
+            for segment, values in segments.items():
+                by_server.setdefault(server_id, {}).setdefault(segment, []).extend(values)
+                by_node.setdefault(node, {}).setdefault(segment, []).extend(values)
+    
+    def summarize(groups):
+        return {
+            key: {segment: percentiles(values) for segment, values in segments.items()}
+            for key, segments in groups.items()
+        }
+    return {'servers': summarize(by_server), 'nodes': summarize(by_node)}
+
+
+latency_recorder = LatencyRecorder()
@@ -0,0 +1,335 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import secrets
+import time
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from channels.db import database_sync_to_async
+from servers.models import Server
+from servers.logs import log_writer
+from terminal import sshstub
+from terminal.sessions import registry
+
+BENCH_USERNAME = 'bench_terminal'
+CONNECT_TIMEOUT = 30
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of ``pid``, from /proc or getrusage for this process"""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except OSError:
+        if pid != os.getpid():
+            raise
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+
+def process_rss_bytes(pid):
+    """Resident memory of ``pid``, from /proc or the peak for this process"""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        if pid != os.getpid():
+            raise
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class CommunicatorClient:
+    """Drives TerminalConsumer in this process through channels' test communicator"""
+
+    def __init__(self, user, path):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from terminal.routing import websocket_urlpatterns
+        self.communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError('The terminal consumer refused the connection')
+
+    async def send(self, message):
+        await self.communicator.send_to(text_data=json.dumps(message))
+
+    async def receive(self):
+        # A receive timeout would kill the app, the caller cancels instead
+        return json.loads(await self.communicator.receive_from(timeout=3600))
+
+    async def close(self):
+        try:
+            await self.communicator.disconnect()
+        except BaseException:
+            pass
+
+
+class WebSocketClient:
+    """Drives a running daphne over a real WebSocket, logged in with a session cookie"""
+
+    def __init__(self, url, cookie):
+        self.url = url
+        self.cookie = cookie
+        self.socket = None
+
+    async def connect(self):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError('--url needs the websockets package')
+        origin = self.url.replace('ws://', 'http://').replace('wss://', 'https://').split('/ws/')[0]
+        self.socket = await websockets.connect(
+            self.url, extra_headers={'Cookie': self.cookie, 'Origin': origin}, max_size=None
+        )
+
+    async def send(self, message):
+        await self.socket.send(json.dumps(message))
+
+    async def receive(self):
+        return json.loads(await self.socket.recv())
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+
+
+class Session:
+    """One benchmark terminal: waits for the shell, then plays its role"""
+
+    def __init__(self, client, role):
+        self.client = client
+        self.role = role
+        self.buffer = ''
+        self.bytes_out = 0
+        self.latencies = []
+        self.connected = asyncio.Event()
+        self.error = None
+        self.output = asyncio.Condition()
+
+    async def read(self):
+        while True:
+            message = await self.client.receive()
+            if message.get('type') == 'status' and message.get('message', '').startswith('Connected to'):
+                self.connected.set()
+            elif message.get('type') == 'error' and not self.connected.is_set():
+                self.error = message.get('message')
+                self.connected.set()
+            elif message.get('type') == 'output':
+                self.bytes_out += len(message['data'])
+                if self.role == 'echo':
+                    async with self.output:
+                        self.buffer += message['data']
+                        self.output.notify_all()
+
+    async def type_keys(self, interval):
+        """Send one marker at a time and time how long until it is echoed back"""
+        sequence = 0
+        while True:
+            sequence += 1
+            marker = f'<{sequence}>'
+            started = time.perf_counter()
+            await self.client.send({'type': 'command', 'data': marker})
+            async with self.output:
+                await self.output.wait_for(lambda: marker in self.buffer)
+                self.buffer = self.buffer.split(marker, 1)[1]
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests TerminalConsumer against a local stand-in SSH server with echoing, '
+        'flooding and idle shells, and reports echo latency, throughput, CPU and memory per session'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--echo', type=int, default=10, help='Sessions that type and time the echo')
+        parser.add_argument('--flood', type=int, default=2, help='Sessions whose shell streams output nonstop')
+        parser.add_argument('--idle', type=int, default=10, help='Sessions that stay connected and quiet')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to measure for')
+        parser.add_argument(
+            '--keystroke-interval', type=float, default=50,
+            help='Milliseconds between keystrokes of an echo session'
+        )
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running daphne (e.g. ws://127.0.0.1:8000) instead of the in-process consumer'
+        )
+        parser.add_argument(
+            '--server-pid', type=int,
+            help='PID of the daphne process, for CPU and memory figures with --url'
+        )
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        roles = ['echo'] * options['echo'] + ['flood'] * options['flood'] + ['idle'] * options['idle']
+        if not roles:
+            raise CommandError('Nothing to run, ask for at least one session')
+        if options['url'] and not options['server_pid']:
+            self.stdout.write(self.style.WARNING('No --server-pid, CPU and memory are not measured'))
+
+        password = secrets.token_urlsafe(16)
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        stub = multiprocessing.Process(target=sshstub.serve, args=(sender, password), daemon=True)
+        stub.start()
+        try:
+            if not receiver.poll(CONNECT_TIMEOUT):
+                raise CommandError('The stand-in SSH server did not start')
+            port = receiver.recv()
+            user, servers = self.create_fixtures(port, password)
+            try:
+                results = asyncio.run(self.run(user, servers, roles, options))
+            finally:
+                log_writer.flush()
+                for server in servers.values():
+                    server.delete()
+        finally:
+            stub.terminate()
+
+        results['config'] = {
+            key: options[key] for key in ('echo', 'flood', 'idle', 'duration', 'keystroke_interval', 'url')
+        }
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["json_path"]}')
+
+    def create_fixtures(self, port, password):
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME, defaults={'is_active': True})
+        servers = {}
+        for role in sshstub.SHELLS:
+            server, _ = Server.objects.update_or_create(
+                hostname='127.0.0.1',
+                port=port,
+                username=role,
+                defaults={'name': f'bench-{role}', 'created_by': user, 'auth_method': 'password'},
+            )
+            server.set_password(password)
+            server.save()
+            servers[role] = server
+        return user, servers
+
+    def session_cookie(self, user):
+        from importlib import import_module
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store[SESSION_KEY] = str(user.pk)
+        store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        store.save()
+        return f'{settings.SESSION_COOKIE_NAME}={store.session_key}'
+
+    def make_client(self, user, server, options, cookie):
+        if options['url']:
+            return WebSocketClient(f'{options["url"].rstrip("/")}/ws/terminal/{server.pk}/', cookie)
+        return CommunicatorClient(user, f'/ws/terminal/{server.pk}/')
+
+    async def run(self, user, servers, roles, options):
+        in_process = not options['url']
+        pid = os.getpid() if in_process else options['server_pid']
+        cookie = None if in_process else await database_sync_to_async(self.session_cookie)(user)
+
+        if in_process:
+            # The limits would queue the benchmark's own sessions
+            saved_limits = (registry.max_sessions, registry.max_per_user, registry.max_per_server)
+            registry.max_sessions = registry.max_per_user = registry.max_per_server = 0
+
+        sessions = [
+            Session(self.make_client(user, servers[role], options, cookie), role) for role in roles
+        ]
+        tasks = []
+        try:
+            rss_before = process_rss_bytes(pid) if pid else None
+            started = time.perf_counter()
+            for session in sessions:
+                await session.client.connect()
+                tasks.append(asyncio.create_task(session.read()))
+            await asyncio.wait_for(
+                asyncio.gather(*(session.connected.wait() for session in sessions)), CONNECT_TIMEOUT
+            )
+            connect_seconds = time.perf_counter() - started
+            failed = [session.error for session in sessions if session.error]
+            if failed:
+                raise CommandError(f'{len(failed)} sessions failed to connect: {failed[0]}')
+            rss_connected = process_rss_bytes(pid) if pid else None
+
+            # Measure with every session in its steady state
+            for session in sessions:
+                session.bytes_out = 0
+            cpu_before = process_cpu_seconds(pid) if pid else None
+            measure_started = time.perf_counter()
+            tasks += [
+                asyncio.create_task(session.type_keys(options['keystroke_interval'] / 1000))
+                for session in sessions if session.role == 'echo'
+            ]
+            await asyncio.sleep(options['duration'])
+            elapsed = time.perf_counter() - measure_started
+            cpu_seconds = process_cpu_seconds(pid) - cpu_before if pid else None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for session in sessions:
+                await session.client.close()
+            if in_process:
+                registry.max_sessions, registry.max_per_user, registry.max_per_server = saved_limits
+
+        latencies = [latency for session in sessions for latency in session.latencies]
+        flood_bytes = sum(session.bytes_out for session in sessions if session.role == 'flood')
+        count = len(sessions)
+        return {
+            'sessions': count,
+            'connect_seconds': round(connect_seconds, 3),
+            'echo_latency_ms': {
+                'samples': len(latencies),
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies, default=None),
+            },
+            'flood_throughput_kib_s': round(flood_bytes / 1024 / elapsed, 1),
+            'cpu_percent_per_session': (
+                round(cpu_seconds / elapsed / count * 100, 3) if cpu_seconds is not None else None
+            ),
+            'memory_kib_per_session': (
+                round((rss_connected - rss_before) / 1024 / count, 1) if rss_before is not None else None
+            ),
+            # In process the figures include the benchmark's own clients
+            'measured_process': 'this process' if in_process else pid,
+        }
+
+    def report(self, results):
+        latency = results['echo_latency_ms']
+
+        def ms(value):
+            return f'{value:.1f} ms' if value is not None else '-'
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["sessions"]} sessions connected in {results["connect_seconds"]} s'
+        ))
+        self.stdout.write(
+            f'Echo latency ({latency["samples"]} keystrokes): p50 {ms(latency["p50"])}, '
+            f'p90 {ms(latency["p90"])}, p99 {ms(latency["p99"])}, max {ms(latency["max"])}'
+        )
+        self.stdout.write(f'Flood output: {results["flood_throughput_kib_s"]} KiB/s')
+        if results['cpu_percent_per_session'] is not None:
+            self.stdout.write(
+                f'CPU per session: {results["cpu_percent_per_session"]}% of a core, '
+                f'memory per session: {results["memory_kib_per_session"]} KiB '
+                f'({results["measured_process"]})'
+            )
@@ -3,5 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/terminal/(?P<server_id>\d+)/$', consumers.TerminalConsumer.as_asgi()),
-    re_path(r'ws/terminal/(?P<server_id>\d+)/(?P<session_id>[\w-]+)/$', consumers.TerminalConsumer.as_asgi()),
+    re_path(r'ws/terminal/(?P<server_id>\d+)/(?P<session_id>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})/$', consumers.TerminalConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+from django.conf import settings
+from server_manager import metrics
+from .sessions import SessionLimitReached
+
+CONNECT_WAIT = metrics.Histogram(
+    'serverhub_ssh_connect_wait_seconds',
+    'Time terminal sessions waited for an SSH connect slot',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class _ConnectWaiter:
+    def __init__(self, consumer, user_id, host):
+        self.consumer = consumer
+        self.user_id = user_id
+        self.host = host
+        self.admitted = False
+        self.changed = asyncio.Event()
+
+
+class ConnectScheduler:
+    """Limits the SSH logins a worker runs at once, in total and per target host.
+    
+    After a deploy or a network blip every open terminal reconnects at
+    about the same moment. Logins past ``max_connects`` or past
+    ``max_per_host`` for one host wait instead, in a FIFO queue per user.
+    Freed slots go round robin across users, so one user reopening fifty
+    tabs can't starve everyone else. A slot is held from before the key is
+    parsed until the shell is open, and ``release`` frees it.
+    """
+    
+    def __init__(self):
+        self.max_connects = getattr(settings, 'TERMINAL_MAX_CONNECTS', 16)
+        self.max_per_host = getattr(settings, 'TERMINAL_MAX_CONNECTS_PER_HOST', 4)
+        self.queue_timeout = getattr(settings, 'TERMINAL_CONNECT_QUEUE_TIMEOUT', 60)
+        self._active = {}
+        self._host_counts = Counter()
+        # user_id -> waiters, in round robin order
+        self._queues = OrderedDict()
+    
+    def _fits(self, host):
+        if self.max_connects and len(self._active) >= self.max_connects:
+            return False
+        if self.max_per_host and self._host_counts[host] >= self.max_per_host:
+            return False
+        return True
+    
+    def _take(self, consumer, host):
+        self._active[consumer] = host
+        self._host_counts[host] += 1
+    
+    async def acquire(self, consumer, user_id, host, on_queued=None):
+        """Wait for a connect slot for ``consumer``.
+        
+        ``on_queued(position, host)`` is awaited each time the consumer's
+        estimated place in line changes. Raises SessionLimitReached when
+        the wait times out.
+        """
+        if consumer in self._active:
+            return
+        if not self._queues and self._fits(host):
+            self._take(consumer, host)
+            return
+        
+        waiter = _ConnectWaiter(consumer, user_id, host)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        position = None
+        try:
+            while not waiter.admitted:
+                waiter.changed.clear()
+                if on_queued and self.position(waiter) != position:
+                    position = self.position(waiter)
+                    await on_queued(position, host)
+                remaining = deadline - time.monotonic()
+                if waiter.changed.is_set():
+                    continue
+                if remaining <= 0:
+                    raise SessionLimitReached(f'Timed out waiting to connect to {host}, try again later')
+                try:
+                    await asyncio.wait_for(waiter.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # Cancelled after _dispatch had already given it a slot
+            if waiter.admitted:
+                self.release(consumer)
+            raise
+        finally:
+            CONNECT_WAIT.observe(time.monotonic() - started)
+            queue = self._queues.get(user_id)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[user_id]
+                self._dispatch()
+    
+    def release(self, consumer):
+        """Free ``consumer``'s connect slot, if it holds one, and start the next connects"""
+        host = self._active.pop(consumer, None)
+        if host is None:
+            return
+        self._host_counts[host] -= 1
+        self._dispatch()
+    
+    def _dispatch(self):
+        """Admit waiters that fit, one per user per round, and tell the rest their new place"""
+        while True:
+            for user_id, queue in self._queues.items():
+                waiter = next((waiter for waiter in queue if self._fits(waiter.host)), None)
+                if waiter is not None:
+                    break
+            else:
+                break
+            queue.remove(waiter)
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._take(waiter.consumer, waiter.host)
+            waiter.admitted = True
+            waiter.changed.set()
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.changed.set()
+    
+    def position(self, waiter):
+        """Estimated place in line: the round robin order, ignoring host limits"""
+        users = list(self._queues)
+        mine = users.index(waiter.user_id)
+        rank = self._queues[waiter.user_id].index(waiter)
+        ahead = rank
+        for index, user_id in enumerate(users):
+            if user_id != waiter.user_id:
+                ahead += min(len(self._queues[user_id]), rank + 1 if index < mine else rank)
+        return ahead + 1
+    
+    def usage(self):
+        return {
+            'connecting': len(self._active),
+            'max_connects': self.max_connects,
+            'max_per_host': self.max_per_host,
+            'waiting': sum(len(queue) for queue in self._queues.values()),
+        }
+
+
+connect_scheduler = ConnectScheduler()
+
+metrics.Gauge(
+    'serverhub_ssh_connects_in_progress',
+    'SSH logins holding a connect slot',
+    function=lambda: len(connect_scheduler._active),
+)
+metrics.Gauge(
+    'serverhub_ssh_connects_waiting',
+    'Terminal sessions waiting for an SSH connect slot',
+    function=lambda: sum(len(queue) for queue in list(connect_scheduler._queues.values())),
+)
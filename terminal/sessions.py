@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from servers.models import ServerConnection
+from servers.cache import invalidate_users
+from server_manager import metrics
+from .latency import latency_recorder
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_BYTES = metrics.Counter(
+    'serverhub_terminal_bytes_total',
+    'Terminal traffic, in is keystrokes to SSH and out is output to the browser',
+    ['direction'],
+)
+PEER_DISCONNECTS = metrics.Counter(
+    'serverhub_terminal_peer_disconnects_total',
+    'Terminal sessions ended from the SSH side: keepalive timeout, transport lost or shell exit',
+    ['reason'],
+)
+SSH_CONNECT_DURATION = metrics.Histogram(
+    'serverhub_ssh_connect_seconds',
+    'Time to open an SSH connection for a terminal',
+    ['outcome'],
+)
+
+
+def session_group(server_id, session_id):
+    """Channel layer group a terminal session's consumer listens on"""
+    return f'terminal_{server_id}_{session_id}'
+
+
+class LiveSession:
+    """A terminal session with an open SSH channel in this process.
+
+    ``touch`` is called for every chunk in or out, so it only bumps counters
+    and a monotonic timestamp. The registry turns those into database
+    heartbeats in the background.
+    """
+
+    def __init__(self, consumer, connection_id, user_id, session_id):
+        self.consumer = consumer
+        self.connection_id = connection_id
+        self.user_id = user_id
+        self.session_id = session_id
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.last_seen = time.monotonic()
+        self.flushed_at = self.last_seen
+
+    def touch(self, bytes_in=0, bytes_out=0):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        if bytes_in:
+            TERMINAL_BYTES.inc(bytes_in, direction='in')
+        if bytes_out:
+            TERMINAL_BYTES.inc(bytes_out, direction='out')
+        self.last_seen = time.monotonic()
+
+    @property
+    def idle_seconds(self):
+        return time.monotonic() - self.last_seen
+
+
+class SessionLimitReached(Exception):
+    """A terminal session could not get a slot"""
+
+
+class _Waiter:
+    def __init__(self, consumer, user_id, server_id):
+        self.consumer = consumer
+        self.user_id = user_id
+        self.server_id = server_id
+        self.admitted = False
+        self.changed = asyncio.Event()
+
+
+class SessionRegistry:
+    """Per-process registry of live terminal sessions.
+
+    Consumers first get a slot from ``admit``, which enforces the per
+    process, per user and per server limits (0 means unlimited). When a
+    limit is reached the consumer waits in a bounded FIFO queue for up to
+    ``queue_timeout`` seconds, and slots freed by ``release`` go to the
+    first waiter they fit.
+    
+    While sessions are registered, a task on the event loop writes
+    ``last_activity`` for sessions with new traffic every ``interval``
+    seconds in one ``bulk_update``, and closes sessions idle for longer than
+    ``idle_timeout``, SSH transport included. Rows left active by a process
+    that died are marked inactive once their heartbeat is older than the
+    idle timeout.
+    """
+
+    def __init__(self, interval=None, idle_timeout=None):
+        self.interval = interval or getattr(settings, 'TERMINAL_HEARTBEAT_INTERVAL', 15)
+        self.idle_timeout = idle_timeout or getattr(settings, 'TERMINAL_IDLE_TIMEOUT', 1800)
+        self.max_sessions = getattr(settings, 'TERMINAL_MAX_SESSIONS', 200)
+        self.max_per_user = getattr(settings, 'TERMINAL_MAX_SESSIONS_PER_USER', 10)
+        self.max_per_server = getattr(settings, 'TERMINAL_MAX_SESSIONS_PER_SERVER', 20)
+        self.queue_size = getattr(settings, 'TERMINAL_QUEUE_SIZE', 50)
+        self.queue_timeout = getattr(settings, 'TERMINAL_QUEUE_TIMEOUT', 30)
+        self._sessions = {}
+        self._task = None
+        # Admission state: consumer -> (user_id, server_id), plus counters
+        self._slots = {}
+        self._user_counts = Counter()
+        self._server_counts = Counter()
+        self._queue = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        return self._sessions.get(str(session_id))
+
+    def _blocked(self, user_id, server_id):
+        """Describe the first limit a new session would exceed, or None"""
+        if self.max_sessions and len(self._slots) >= self.max_sessions:
+            return 'this worker'
+        if self.max_per_user and self._user_counts[user_id] >= self.max_per_user:
+            return 'your account'
+        if self.max_per_server and self._server_counts[server_id] >= self.max_per_server:
+            return 'this server'
+        return None
+    
+    def _take(self, consumer, user_id, server_id):
+        self._slots[consumer] = (user_id, server_id)
+        self._user_counts[user_id] += 1
+        self._server_counts[server_id] += 1
+    
+    async def admit(self, consumer, user_id, server_id, on_queued=None):
+        """Reserve a session slot for ``consumer``, queueing while a limit is reached.
+        
+        ``on_queued(position, limit)`` is awaited each time the consumer's
+        place in the queue changes. Raises SessionLimitReached when the
+        queue is full or the wait times out.
+        """
+        if consumer in self._slots:
+            return
+        limit = self._blocked(user_id, server_id)
+        if limit is None:
+            self._take(consumer, user_id, server_id)
+            return
+        if len(self._queue) >= self.queue_size:
+            raise SessionLimitReached(f'Too many terminal sessions for {limit}, try again later')
+        
+        waiter = _Waiter(consumer, user_id, server_id)
+        self._queue.append(waiter)
+        deadline = time.monotonic() + self.queue_timeout
+        position = None
+        try:
+            while not waiter.admitted:
+                waiter.changed.clear()
+                if on_queued and self._queue.index(waiter) + 1 != position:
+                    position = self._queue.index(waiter) + 1
+                    await on_queued(position, limit)
+                remaining = deadline - time.monotonic()
+                if waiter.changed.is_set():
+                    continue
+                if remaining <= 0:
+                    raise SessionLimitReached(f'Timed out waiting for a free terminal session on {limit}')
+                try:
+                    await asyncio.wait_for(waiter.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                limit = self._blocked(user_id, server_id) or limit
+        except BaseException:
+            # Cancelled after _wake had already taken a slot for it: the
+            # consumer's release ran while it was still queued, so free it here
+            if waiter.admitted:
+                self.release(consumer)
+            raise
+        finally:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                self._wake()
+    
+    def release(self, consumer):
+        """Free ``consumer``'s slot and hand it to the first waiter it fits"""
+        slot = self._slots.pop(consumer, None)
+        if slot is None:
+            return
+        user_id, server_id = slot
+        self._user_counts[user_id] -= 1
+        self._server_counts[server_id] -= 1
+        self._wake()
+    
+    def _wake(self):
+        """Admit waiters that now fit and tell the rest their new position"""
+        for waiter in list(self._queue):
+            if self._blocked(waiter.user_id, waiter.server_id) is None:
+                # Take the slot now so a newcomer can't grab it first
+                self._take(waiter.consumer, waiter.user_id, waiter.server_id)
+                waiter.admitted = True
+                self._queue.remove(waiter)
+            waiter.changed.set()
+    
+    def usage(self, user_id=None):
+        """Current slot use against the limits, for the sessions page"""
+        return {
+            'sessions': len(self._slots),
+            'max_sessions': self.max_sessions,
+            'user_sessions': self._user_counts[user_id],
+            'max_per_user': self.max_per_user,
+            'max_per_server': self.max_per_server,
+            'queued': len(self._queue),
+        }
+    
+    def register(self, consumer, connection_id, user_id, session_id):
+        """Track a consumer's session, starting the heartbeat task if needed"""
+        session = LiveSession(consumer, connection_id, user_id, str(session_id))
+        self._sessions[session.session_id] = session
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return session
+
+    def unregister(self, session_id):
+        return self._sessions.pop(str(session_id), None)
+
+    def stats(self):
+        sessions = list(self._sessions.values())
+        return {
+            'sessions': len(sessions),
+            'bytes_in': sum(session.bytes_in for session in sessions),
+            'bytes_out': sum(session.bytes_out for session in sessions),
+        }
+
+    async def _run(self):
+        while self._sessions:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.heartbeat()
+                await self.reap()
+                await sync_to_async(latency_recorder.publish, thread_sensitive=False)()
+            except Exception:
+                logger.exception('Terminal session heartbeat failed')
+
+    def _pending_heartbeats(self):
+        """(connection_id, last activity) for sessions with traffic since the last flush"""
+        now_wall, now_mono = timezone.now(), time.monotonic()
+        beats = []
+        for session in list(self._sessions.values()):
+            if session.last_seen > session.flushed_at:
+                session.flushed_at = session.last_seen
+                beats.append((
+                    session.connection_id,
+                    now_wall - timedelta(seconds=now_mono - session.last_seen),
+                ))
+        return beats
+
+    async def heartbeat(self):
+        """Write last_activity for every session with new traffic"""
+        beats = self._pending_heartbeats()
+        if beats:
+            await database_sync_to_async(write_heartbeats)(beats)
+        return len(beats)
+
+    async def reap(self):
+        """Close sessions idle past the timeout or closed from another process,
+        and mark dead processes' rows inactive
+        """
+        idle = [
+            session for session in list(self._sessions.values())
+            if session.idle_seconds > self.idle_timeout
+        ]
+        for session in idle:
+            logger.info('Closing idle terminal session %s', session.session_id)
+            await session.consumer.terminate('Session closed after being idle')
+        # close_session marks the row inactive. Its channel layer message only
+        # reaches this process with a shared (Redis) layer, so catch it here too
+        closed_ids = await database_sync_to_async(inactive_connection_ids)(
+            [session.connection_id for session in self._sessions.values()]
+        )
+        closed = [
+            session for session in list(self._sessions.values())
+            if session.connection_id in closed_ids
+        ]
+        for session in closed:
+            logger.info('Closing terminal session %s closed elsewhere', session.session_id)
+            await session.consumer.terminate('Session closed')
+        await database_sync_to_async(expire_stale_connections)(self.idle_timeout + self.interval)
+        return len(idle) + len(closed)
+
+
+def write_heartbeats(beats):
+    ServerConnection.objects.bulk_update(
+        [ServerConnection(pk=pk, last_activity=seen) for pk, seen in beats],
+        ['last_activity'],
+    )
+
+
+def inactive_connection_ids(connection_ids):
+    """The ids among ``connection_ids`` whose rows are no longer active"""
+    if not connection_ids:
+        return set()
+    return set(ServerConnection.objects.filter(
+        pk__in=connection_ids, is_active=False,
+    ).values_list('pk', flat=True))
+
+
+def expire_stale_connections(max_age):
+    """Mark active connections without a heartbeat for ``max_age`` seconds inactive"""
+    stale = ServerConnection.objects.filter(
+        is_active=True,
+        last_activity__lt=timezone.now() - timedelta(seconds=max_age),
+    )
+    user_ids = set(stale.values_list('user_id', flat=True))
+    if not user_ids:
+        return 0
+    count = stale.update(is_active=False)
+    invalidate_users(user_ids, 'connections')
+    return count
+
+
+registry = SessionRegistry()
+
+metrics.Gauge(
+    'serverhub_terminal_websockets',
+    'Terminal WebSockets holding a session slot',
+    function=lambda: len(registry._slots),
+)
+metrics.Gauge(
+    'serverhub_terminal_ssh_sessions',
+    'Terminal sessions with an open SSH shell',
+    function=lambda: sum(1 for session in list(registry._sessions.values()) if session.consumer.connected),
+)
+metrics.Gauge(
+    'serverhub_terminal_queued',
+    'Terminal WebSockets waiting for a session slot',
+    function=lambda: len(registry._queue),
+)
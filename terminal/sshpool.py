@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from server_manager import metrics
+
+logger = logging.getLogger(__name__)
+
+# Every blocking paramiko call a terminal makes (connect, opening the shell,
+# writes, resizes, close, key parsing) runs on one sized pool of its own
+# rather than the loop's default executor, and each call has a timeout. A
+# hung target then ties up a pool thread, not the event loop or the threads
+# sync_to_async and the database use.
+
+SSH_OPERATION_DURATION = metrics.Histogram(
+    'serverhub_ssh_operation_seconds',
+    'Time blocking SSH calls take on the SSH executor, queueing included',
+    ['operation'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+)
+SSH_OPERATION_TIMEOUTS = metrics.Counter(
+    'serverhub_ssh_operation_timeouts_total',
+    'Blocking SSH calls abandoned after their timeout',
+    ['operation'],
+)
+
+
+class SSHOperationTimeout(TimeoutError):
+    """A blocking SSH call did not finish within its timeout"""
+
+
+class SSHExecutor:
+    """Thread pool for blocking SSH calls, with per-call timeouts.
+    
+    A call that times out or is cancelled keeps its thread until paramiko
+    gives up, so its ``cleanup`` (e.g. closing the half-open client) runs
+    once it returns.
+    ``busy`` and ``queued`` count calls running on and waiting for a thread.
+    """
+    
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(settings, 'TERMINAL_SSH_WORKERS', 32)
+        self.busy = 0
+        self.queued = 0
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ssh')
+            return self._pool
+    
+    def _call(self, func, args):
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.busy -= 1
+    
+    async def run(self, operation, func, *args, timeout=None, cleanup=None):
+        """Run ``func(*args)`` on the pool, raising SSHOperationTimeout after ``timeout`` seconds"""
+        if timeout is None:
+            timeout = getattr(settings, 'TERMINAL_SSH_OPERATION_TIMEOUT', 10)
+        with self._lock:
+            self.queued += 1
+        future = self.pool.submit(self._call, func, args)
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            SSH_OPERATION_TIMEOUTS.inc(operation=operation)
+            raise SSHOperationTimeout(f'SSH {operation} timed out after {timeout:g}s') from None
+        finally:
+            SSH_OPERATION_DURATION.observe(time.perf_counter() - started, operation=operation)
+            # Timed out or cancelled: drop the call if it hasn't started,
+            # otherwise clean up whenever it does return
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            elif not future.done() and cleanup is not None:
+                future.add_done_callback(lambda _: self._cleanup(operation, cleanup))
+    
+    def _cleanup(self, operation, cleanup):
+        try:
+            cleanup()
+        except Exception:
+            logger.exception('Cleaning up after a timed out SSH %s failed', operation)
+    
+    def utilisation(self):
+        return {'workers': self.workers, 'busy': self.busy, 'queued': self.queued}
+
+
+async def send_all(channel, data, timeout=None, chunk_size=None):
+    """Write ``data`` to ``channel`` in chunks, waiting on the loop while the SSH window is full.
+    
+    Each chunk is one call on the executor, so a large paste takes turns
+    with the other sessions' calls instead of holding a thread until the
+    remote side has read all of it. Raises SSHOperationTimeout when the
+    window stays closed for ``timeout`` seconds.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'TERMINAL_SSH_OPERATION_TIMEOUT', 10)
+    chunk_size = chunk_size or getattr(settings, 'TERMINAL_SEND_CHUNK_SIZE', 32768)
+    offset = 0
+    while offset < len(data):
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not channel.send_ready():
+            if time.monotonic() > deadline:
+                SSH_OPERATION_TIMEOUTS.inc(operation='send')
+                raise SSHOperationTimeout(f'SSH send window stayed closed for {timeout:g}s')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        chunk = data[offset:offset + chunk_size]
+        sent = await ssh_executor.run('send', channel.send, chunk, timeout=timeout)
+        if sent == 0:
+            raise EOFError('SSH channel closed')
+        offset += sent
+
+
+ssh_executor = SSHExecutor()
+
+metrics.Gauge(
+    'serverhub_ssh_executor_workers',
+    'Threads of the SSH executor',
+    function=lambda: ssh_executor.workers,
+)
+metrics.Gauge(
+    'serverhub_ssh_executor_busy',
+    'SSH executor threads running a call',
+    function=lambda: ssh_executor.busy,
+)
+metrics.Gauge(
+    'serverhub_ssh_executor_queued',
+    'Blocking SSH calls waiting for an SSH executor thread',
+    function=lambda: ssh_executor.queued,
+)
@@ -0,0 +1,101 @@
+import socket
+import threading
+import paramiko
+
+# Local SSH server stand-in for terminal load tests. It only depends on
+# paramiko, so it can run in a child process without Django. The login name
+# picks the scripted shell: 'echo' writes input straight back, 'flood'
+# streams output as fast as the client reads it, 'idle' never writes.
+
+FLOOD_CHUNK = b'0123456789abcdef' * 256
+
+
+def echo_shell(channel):
+    while True:
+        data = channel.recv(4096)
+        if not data:
+            break
+        channel.sendall(data)
+
+
+def flood_shell(channel):
+    while not channel.closed:
+        channel.sendall(FLOOD_CHUNK)
+
+
+def idle_shell(channel):
+    while channel.recv(4096):
+        pass
+
+
+SHELLS = {
+    'echo': echo_shell,
+    'flood': flood_shell,
+    'idle': idle_shell,
+}
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts a password login for any of SHELLS and one interactive shell"""
+
+    def __init__(self, password):
+        self.password = password
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if username in SHELLS and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height, pixelwidth, pixelheight):
+        return True
+
+
+def handle_client(client, host_key, password):
+    transport = paramiko.Transport(client)
+    try:
+        transport.add_server_key(host_key)
+        server = StubServer(password)
+        transport.start_server(server=server)
+        channel = transport.accept(30)
+        if channel is None or not server.shell_requested.wait(30):
+            return
+        try:
+            SHELLS[transport.get_username()](channel)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+    except (OSError, EOFError, paramiko.SSHException):
+        pass
+    finally:
+        transport.close()
+
+
+def serve(ready, password, host='127.0.0.1'):
+    """Listen on a free port, send it through the ``ready`` pipe and serve forever"""
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, 0))
+    listener.listen(1024)
+    ready.send(listener.getsockname()[1])
+    ready.close()
+    while True:
+        client, _ = listener.accept()
+        thread = threading.Thread(target=handle_client, args=(client, host_key, password))
+        thread.daemon = True
+        thread.start()
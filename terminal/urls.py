@@ -6,6 +6,7 @@ app_name = 'terminal'
 urlpatterns = [
     path('<int:server_id>/', views.terminal_view, name='connect'),
     path('sessions/', views.terminal_sessions, name='sessions'),
+    path('latency/', views.terminal_latency, name='latency'),
     path('<int:server_id>/logs/', views.terminal_logs, name='logs'),
-    path('close/<str:session_id>/', views.close_session, name='close_session'),
+    path('close/<uuid:session_id>/', views.close_session, name='close_session'),
 ]
\ No newline at end of file
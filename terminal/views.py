@@ -1,16 +1,33 @@
+import uuid
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse
+from django.utils import timezone
 from servers.models import Server, ServerConnection, ServerLog
-from django.core.paginator import Paginator
+from servers.pagination import keyset_paginate, capped_count
+from servers.dates import timestamp_range_filter
+from servers.exports import stream_logs_response
+from server_manager.db import replica_reads
+from servers.inventory import get_inventory
+from .sessions import registry, session_group
+from .latency import latency_summary
 
 @login_required
 def terminal_view(request, server_id):
     """Main terminal view"""
     server = get_object_or_404(Server, id=server_id, created_by=request.user)
     
-    # Check if a session_id was provided for reconnection
-    session_id = request.GET.get('session_id')
+    # Check if a session_id was provided for reconnection, ignoring anything
+    # that isn't a session UUID
+    try:
+        session_id = uuid.UUID(request.GET.get('session_id', ''))
+    except ValueError:
+        session_id = None
     
     # Construct WebSocket URL
     websocket_url = f'ws/terminal/{server_id}/'
@@ -25,6 +42,7 @@ def terminal_view(request, server_id):
     return render(request, 'terminal/terminal.html', context)
 
 @login_required
+@replica_reads
 def terminal_sessions(request):
     """List active terminal sessions"""
     sessions = ServerConnection.objects.filter(
@@ -32,10 +50,12 @@ def terminal_sessions(request):
         is_active=True
     ).select_related('server')
     
-    # Calculate statistics
+    # Calculate statistics. last_activity is kept current by the session
+    # heartbeats, so an old one means nothing went over the channel lately
+    idle_since = timezone.now() - timedelta(seconds=settings.TERMINAL_IDLE_AFTER)
     total_sessions = sessions.count()
     active_sessions = sessions.filter(is_active=True).count()
-    idle_sessions = 0  # Could implement idle detection based on last_activity
+    idle_sessions = sessions.filter(last_activity__lt=idle_since).count()
     unique_servers = sessions.values('server').distinct().count()
     
     context = {
@@ -43,7 +63,9 @@ def terminal_sessions(request):
         'total_sessions': total_sessions,
         'active_sessions': active_sessions,
         'idle_sessions': idle_sessions,
-        'unique_servers': unique_servers
+        'unique_servers': unique_servers,
+        # Slot use in the worker serving this page; limits apply per worker
+        'session_usage': registry.usage(request.user.id),
     }
     
     # Handle AJAX requests for auto-refresh
@@ -53,6 +75,7 @@ def terminal_sessions(request):
     return render(request, 'terminal/sessions.html', context)
 
 @login_required
+@replica_reads
 def terminal_logs(request, server_id):
     """View terminal logs for a server"""
     server = get_object_or_404(Server, id=server_id, created_by=request.user)
@@ -60,21 +83,42 @@ def terminal_logs(request, server_id):
     logs = ServerLog.objects.filter(
         server=server,
         user=request.user
-    ).order_by('-timestamp')
+    )
     
     # Filter by log type if specified
-    log_type = request.GET.get('type')
+    log_type = request.GET.get('log_type') or request.GET.get('type')
     if log_type:
         logs = logs.filter(log_type=log_type)
     
-    # Pagination
-    paginator = Paginator(logs, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Date filters as a half-open timestamp range in the user's time zone
+    logs = logs.filter(**timestamp_range_filter(
+        request.GET.get('date_from'), request.GET.get('date_to')
+    ))
+    
+    # Stream the full filtered log instead of a page when exporting
+    export_format = request.GET.get('export')
+    if export_format:
+        return stream_logs_response(
+            logs,
+            export_format,
+            f'server_logs_{server.pk}',
+            compress=request.GET.get('gzip') in ('1', 'true', 'on'),
+            asynchronous=isinstance(request, ASGIRequest),
+        )
+    
+    # Keyset pagination on (timestamp, id) uses the (server, user, timestamp) index
+    page_obj = keyset_paginate(
+        logs.select_related('user', 'template'), ['-timestamp', '-id'], request.GET, per_page=50
+    )
+    total_logs, total_is_estimate = capped_count(logs)
     
     context = {
         'server': server,
         'page_obj': page_obj,
+        'logs': page_obj.object_list,
+        'is_paginated': page_obj.has_other_pages(),
+        'total_logs': total_logs,
+        'total_is_estimate': total_is_estimate,
         'log_types': ServerLog.LOG_TYPES,
         'current_type': log_type
     }
@@ -93,6 +137,15 @@ def close_session(request, session_id):
             connection.is_active = False
             connection.save()
             
+            # Tell the consumer holding the session to close its SSH transport
+            # and WebSocket. Other processes only get this with the Redis
+            # layer (USE_REDIS); with the in-memory one the owning process
+            # sees the inactive row on its next heartbeat and closes it then
+            async_to_sync(get_channel_layer().group_send)(
+                session_group(connection.server_id, connection.session_id),
+                {'type': 'session.close', 'message': 'Session closed'}
+            )
+
             return JsonResponse({
                 'status': 'success',
                 'message': 'Session closed successfully'
@@ -106,4 +159,13 @@ def close_session(request, session_id):
     return JsonResponse({
         'status': 'error',
         'message': 'Invalid request method'
-    })
\ No newline at end of file
+    })
+
+@login_required
+def terminal_latency(request):
+    """Keystroke latency percentiles for the user's servers, by server and by node"""
+    names = {entry['id']: entry['name'] for entry in get_inventory(request.user).servers}
+    summary = latency_summary(set(names))
+    for server_id, segments in summary['servers'].items():
+        segments['name'] = names.get(server_id)
+    return JsonResponse(summary)